@@ -0,0 +1,159 @@
+import random, sqlite3, threading, time
+from collections import OrderedDict
+from db import connection
+from attempts import QUESTION_TYPES, OTHER_TYPE
+from question_bank import claim_questions, record_draw, CONCEPT_KINDS
+
+# Configuration Constants
+INDEX_SYNC_INTERVAL_SECONDS = 2 # Pick up items other processes added to the bank at most this often
+INDEX_RELOAD_INTERVAL_SECONDS = 300 # Full reload, drops items other processes took from the bank
+PRIOR_MASTERY = 0.5 # Assumed mastery of a concept the user hasn't answered yet
+MIN_WEIGHT = 0.1 # Mastered concepts still come up now and then
+REPEAT_DECAY = 0.5 # Each question picked from a concept halves its weight, so a test covers several weak areas
+MAX_CACHED_MASTERY = 1024 # Users whose mastery is kept in memory per process
+MAX_DRAW_ROUNDS = 3 # Re-plan this many times when picked items were taken elsewhere or already seen
+
+class ConceptIndex:
+    """IDs of the bank items of one kind grouped by concept, oldest first, mirrored from the question_bank table"""
+    def __init__(self, kind):
+        self.kind = kind
+        self.buckets = {} # concept -> {id: None}, a dict keeps insertion order and removes in O(1)
+        self.last_id = 0
+        self.synced_at = 0
+        self.reloaded_at = 0
+        self.lock = threading.Lock()
+
+    def sync(self):
+        """Add items inserted since the last sync, or reload everything every INDEX_RELOAD_INTERVAL_SECONDS"""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.synced_at < INDEX_SYNC_INTERVAL_SECONDS:
+                return
+            self.synced_at = now
+            reload = now - self.reloaded_at >= INDEX_RELOAD_INTERVAL_SECONDS
+            after = 0 if reload else self.last_id
+        try:
+            with connection() as conn:
+                rows = conn.execute(
+                    "SELECT id, concept FROM question_bank WHERE kind = ? AND id > ? ORDER BY id", (self.kind, after)
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return
+
+        with self.lock:
+            if reload:
+                self.buckets = {}
+                self.reloaded_at = now
+            for row_id, concept in rows:
+                self.buckets.setdefault(concept or OTHER_TYPE, {})[row_id] = None
+            if rows:
+                self.last_id = max(self.last_id, rows[-1][0])
+
+    def depths(self, exclude=()):
+        with self.lock:
+            return {concept: sum(1 for row_id in ids if row_id not in exclude) for concept, ids in self.buckets.items()}
+
+    def pick(self, concept, count, exclude=()):
+        """The oldest `count` IDs of a concept, not removed from the index until they are claimed"""
+        with self.lock:
+            picked = []
+            for row_id in self.buckets.get(concept, ()):
+                if len(picked) >= count:
+                    break
+                if row_id not in exclude:
+                    picked.append(row_id)
+            return picked
+
+    def discard(self, ids):
+        with self.lock:
+            for ids_of_concept in self.buckets.values():
+                for row_id in ids:
+                    ids_of_concept.pop(row_id, None)
+
+_indexes = {kind: ConceptIndex(kind) for kind in CONCEPT_KINDS}
+_mastery = OrderedDict() # (user_id, kind) -> (last_at of the newest attempt read, {concept: rolling accuracy})
+_mastery_lock = threading.Lock()
+
+def get_mastery(user_id, kind):
+    """
+    The user's rolling accuracy per concept, kept in memory while the attempt aggregates don't change.
+    A test submitted to another process moves last_at, one read on the primary key tells whether the copy is stale.
+    """
+    key = (user_id, kind)
+    try:
+        with connection() as conn:
+            last_at = conn.execute(
+                "SELECT MAX(last_at) FROM attempt_stats WHERE user_id = ? AND kind = ?", (user_id, kind)
+            ).fetchone()[0]
+            with _mastery_lock:
+                cached = _mastery.get(key)
+                if cached and cached[0] == last_at:
+                    _mastery.move_to_end(key)
+                    return cached[1]
+            rows = conn.execute(
+                "SELECT question_type, ema_accuracy FROM attempt_stats WHERE user_id = ? AND kind = ?", (user_id, kind)
+            ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return {}
+    mastery = dict(rows)
+    with _mastery_lock:
+        _mastery[key] = (last_at, mastery)
+        while len(_mastery) > MAX_CACHED_MASTERY:
+            _mastery.popitem(last=False)
+    return mastery
+
+def forget_mastery(user_id):
+    """Drop the cached mastery after the user submits a test, so the next one reflects it"""
+    with _mastery_lock:
+        for kind in QUESTION_TYPES:
+            _mastery.pop((user_id, kind), None)
+
+def concept_weights(mastery, concepts):
+    """Weak concepts get a high weight, unanswered ones a medium one, mastered ones MIN_WEIGHT"""
+    return {concept: max(MIN_WEIGHT, 1 - mastery.get(concept, PRIOR_MASTERY)) for concept in concepts}
+
+def plan_test(weights, available, count, rng=random):
+    """How many questions to take from each concept: weighted sampling, never more than a bucket holds"""
+    weights = dict(weights)
+    plan = {}
+    for _ in range(count):
+        concepts = [concept for concept, depth in available.items() if depth > plan.get(concept, 0)]
+        if not concepts:
+            break
+        concept = rng.choices(concepts, weights=[weights.get(concept, MIN_WEIGHT) for concept in concepts])[0]
+        plan[concept] = plan.get(concept, 0) + 1
+        weights[concept] = weights.get(concept, MIN_WEIGHT) * REPEAT_DECAY
+    return plan
+
+def assemble_test(kind, count, user_id=None, skip=None):
+    """
+    Take up to `count` items out of the bank, sampled toward the concepts the user is weakest at.
+    Guests get every concept with the same weight. Items for which skip(item) returns True stay in the bank.
+    """
+    index = _indexes[kind]
+    index.sync()
+    mastery = get_mastery(user_id, kind) if user_id else {}
+
+    taken = []
+    tried = set()
+    for _ in range(MAX_DRAW_ROUNDS):
+        needed = count - len(taken)
+        if needed <= 0:
+            break
+        available = index.depths(tried)
+        plan = plan_test(concept_weights(mastery, available), available, needed)
+        if not plan:
+            break
+        ids = []
+        for concept, number in plan.items():
+            ids += index.pick(concept, number, tried)
+        tried.update(ids)
+        items, gone = claim_questions(kind, ids, skip)
+        index.discard(gone)
+        taken += items
+
+    record_draw(kind, len(taken), count)
+    random.shuffle(taken) # Don't group questions of the same concept together
+    return taken
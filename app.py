@@ -1,11 +1,24 @@
-from google import genai
-from google.genai import errors
 from dotenv import load_dotenv, find_dotenv
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, flash, session, stream_with_context
 from flask_session import Session
-from werkzeug.security import check_password_hash, generate_password_hash
-import os, sys, sqlite3, ast
-from helpers import generate_grammar_questions, generate_reading_questions, validate_environment, login_required, get_username, update_user_streak
+import os, sys, sqlite3, json, msgspec
+from helpers import generate_grammar_questions, generate_reading_questions, fetch_grammar_questions, fetch_reading_questions, stream_questions, start_streamed_test, get_current_test, clear_current_test, pregenerate_next_test, use_pregenerated_test, discard_pregenerated_tests, validate_environment, login_required, get_username, update_user_streak
+from question_bank import init_bank, start_refill_worker, bank_stats
+from dedup import init_dedup
+from gemini_client import client_health
+from db import init_db, get_db
+from test_store import init_test_store, load_test
+from models import parse_answers, score_answers, split_answers, question_at, GrammarQuestion, UNANSWERED, NO_QUESTION
+from attempts import init_attempts, record_attempt, get_progress
+from rate_limit import init_rate_limits
+from speculative import speculation_stats
+from passwords import hash_password, verify_password, needs_rehash, hash_queue_stats, HashQueueFull
+from adaptive import forget_mastery
+from favorites import init_favorites, store_question, toggle_favorite, favorite_states, list_favorites
+from response_cache import response_cache
+from metrics import instrument_app, register_collector, render_prometheus
+from http_cache import init_http_cache, cached_page, http_cache_stats
+from exam import stream_exam, generate_exam, exam_sections, score_exam, record_exam, CHUNK_OFFSETS
 
 # Validate environment variables
 if not validate_environment():
@@ -23,48 +36,33 @@ app.config["SESSION_PERMANENT"] = True # Session persists even after browser is
 app.config["SESSION_TYPE"] = "filesystem" # Store session data in the filesystem on server
 app.config["SESSION_FILE_DIR"] = os.path.join(app.root_path, "flask_session") # Directory to store session data
 app.config["SESSION_FILE_THRESHOLD"] = 500 # The maximum number of session files before cleanup
+app.config["SESSION_REFRESH_EACH_REQUEST"] = False # Only write the session file when the session actually changed
 Session(app)
 
-# Setup database connection, create database file if it doesn't exist
-db_file = "database.db"
-conn = None
-
-if not os.path.exists(db_file):
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL,
-            streak INTEGER DEFAULT 0,
-            last_test_date TEXT DEFAULT NULL,
-            grammar_history TEXT DEFAULT '[]',
-            reading_history TEXT DEFAULT '[]'
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS favorites (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            question TEXT NOT NULL,
-            choices TEXT NOT NULL,
-            correct_answer TEXT NOT NULL,
-            explanation TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            UNIQUE(user_id, question)
-        )
-    """)
-    conn.commit()
-    conn.close()
+# Time requests and template renders, see metrics.py
+instrument_app(app)
 
-@app.template_filter('eval')
-def eval_filter(text):
-    """Convert string representation of list to actual list"""
-    try:
-        return ast.literal_eval(text)
-    except:
-        return []
+# Versioned, precompressed static files, conditional GETs for pages that only change on deploy and cached question cards
+init_http_cache(app)
+
+# Stream new tests into the page question by question instead of waiting for the whole set
+app.config["STREAMING_TESTS"] = os.getenv("STREAMING_TESTS", "1") == "1"
+
+# Create the app tables if they don't exist, connections are pooled and shared within a request
+init_db(app)
+
+# Create the question bank and fingerprint tables, also for databases created before they existed
+init_bank()
+init_dedup()
+init_test_store()
+init_favorites()
+init_attempts()
+init_rate_limits()
+
+@app.before_request
+def ensure_refill_worker():
+    """Start the question bank refill worker lazily, so each gunicorn worker gets its own thread after fork"""
+    start_refill_worker({"grammar": fetch_grammar_questions, "reading": fetch_reading_questions})
 
 # Home page
 @app.route("/", methods=["GET"])
@@ -72,14 +70,14 @@ def home():
     if session.get("user_id"):
         return redirect(url_for("dashboard"))
     else:
-        return render_template("index.html")
+        return cached_page("index.html")
     
 # Dashboard page
 @app.route("/dashboard", methods=["GET"])
 @login_required
 def dashboard():
     try:
-        conn = sqlite3.connect(db_file)
+        conn = get_db()
         with conn:
             cursor = conn.cursor()
             cursor.execute("SELECT streak FROM users WHERE id = ?", (session["user_id"],))
@@ -88,17 +86,22 @@ def dashboard():
                 streak = row[0]
             else:
                 streak = 0
-            return render_template("dashboard.html", streak=streak, username=get_username(session["user_id"]))
+            progress = get_progress(conn, session["user_id"])
+            return render_template("dashboard.html", streak=streak, username=get_username(session["user_id"]), progress=progress)
     except sqlite3.Error as e:
         flash(f"Error retrieving user data: {e}", "danger")
-        return render_template("dashboard.html", streak=0, username="Guest")
-    finally:
-        conn.close()
+        return render_template("dashboard.html", streak=0, username="Guest", progress={})
 
 # Generate grammar questions page
 @app.route("/grammar_test", methods=["GET", "POST"])
 def grammar_test():
     if request.method == "GET":
+        # A finished test is followed by the one generated in the background while the user read their results
+        use_pregenerated_test("grammar")
+        # Render the page right away and let the browser pull the questions from the stream endpoint
+        if app.config["STREAMING_TESTS"] and not (get_current_test("grammar") and not session.get("grammar_test_completed")):
+            start_streamed_test("grammar")
+            return render_template("grammar_test.html", questions=[], stream_url=url_for("grammar_test_stream"))
         try:
             questions = generate_grammar_questions()
             flash("Successfully generated questions", "success")
@@ -108,58 +111,64 @@ def grammar_test():
             return redirect(url_for("home"))
     else:
         """Check if the session has current test data"""
-        if "current_grammar_test" not in session:
+        test = get_current_test("grammar")
+        if test is None:
             flash("Session expired, please try again", "danger")
             return redirect(url_for("home"))
         
-        questions = session["current_grammar_test"]["GRAMMAR_DATA"]
+        questions = test.items
         if not questions:
             flash("Error retrieving questions", "danger")
             return redirect(url_for("home"))
         
-        """Handle form submission"""
-        total_questions = len(questions)
-        user_answers = [request.form.get(f"answers[{i}]") for i in range(total_questions)]
+        """Handle form submission, each answer is the index of the chosen choice"""
+        total_questions = len(test.answer_key)
+        user_answers = parse_answers(request.form.get(f"answers[{i}]") for i in range(total_questions))
         
         """Check if user answered all questions"""
-        if len(user_answers) != total_questions:
+        if UNANSWERED in user_answers:
             flash("Please answer all questions", "danger")
             return redirect(url_for("grammar_test"))
         else:
             session["grammar_test_completed"] = True
 
-        """Get favorited status for each question"""
-        favorited_questions = []
+        """Get the shared id and favorited status of each question"""
+        favorited = {}
         if session.get("user_id"):
             try:
-                conn = sqlite3.connect(db_file)
-                with conn:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT question FROM favorites WHERE user_id = ?", (session["user_id"],))
-                    favorited_questions = [row[0] for row in cursor.fetchall()]
+                favorited = favorite_states(get_db(), session["user_id"], questions)
             except sqlite3.Error as e:
                 flash(f"Error retrieving favorites: {e}", "danger")
             except Exception as e:
                 flash(f"Unexpected error: {e}", "danger")
-            finally:
-                conn.close()
         
-        """Calculate score"""
-        score = 0
-        for i, question in enumerate(questions):
-            if question["correct_answer"] == user_answers[i]:
-                score += 1
+        """Calculate score against the answer key stored with the test"""
+        score = score_answers(test.answer_key, user_answers)
         
         """Update user streak and history"""
         if session.get("user_id"):
             update_user_streak(session["user_id"])
+            try:
+                record_attempt(get_db(), session["user_id"], "grammar", test, user_answers)
+                forget_mastery(session["user_id"])
+            except sqlite3.Error as e:
+                flash(f"Error saving your answers: {e}", "danger")
+
+        """Start on the next test while the user reads their results, /retake swaps it in"""
+        pregenerate_next_test("grammar")
 
-        return render_template("grammar_result.html", questions=questions, total_questions=total_questions, user_answers=user_answers, score=score, favorited_questions=favorited_questions)
+        return render_template("grammar_result.html", questions=questions, total_questions=total_questions, user_answers=user_answers, score=score, favorite_states=favorited, test_id=session.get("current_grammar_test_id"))
     
 # Generate reading questions page
 @app.route("/reading_test", methods=["GET", "POST"])
 def reading_test():
     if request.method == "GET":
+        # A finished test is followed by the one generated in the background while the user read their results
+        use_pregenerated_test("reading")
+        # Render the page right away and let the browser pull the questions from the stream endpoint
+        if app.config["STREAMING_TESTS"] and not (get_current_test("reading") and not session.get("reading_test_completed")):
+            start_streamed_test("reading")
+            return render_template("reading_test.html", questions=[], stream_url=url_for("reading_test_stream"))
         try:
             questions = generate_reading_questions()
             flash("Successfully generated questions", "success")
@@ -169,56 +178,144 @@ def reading_test():
             return redirect(url_for("home"))
     else:
         """Check if the session has current test data"""
-        if "current_reading_test" not in session:
+        test = get_current_test("reading")
+        if test is None:
             flash("Session expired, please try again", "danger")
             return redirect(url_for("home"))
         
-        questions = session["current_reading_test"]["READING_DATA"]
+        questions = test.items
         if not questions:
             flash("Error retrieving questions", "danger")
             return redirect(url_for("home"))
         
-        """Handle form submission"""
-        total_questions = sum(len(passage["questions"]) for passage in questions)
-        user_answers = []
-        for i in range(len(questions)):
-            passage_answers = [request.form.get(f"answers[{i}][{j}]") for j in range(len(questions[i]["questions"]))]
-            user_answers.append(passage_answers)        
-        
         """
-        Check if user answered all questions
-        But user_answers is a list of lists, so we need to flatten it to check the length"""
-        answers_count = sum(len(passage) for passage in user_answers)
-        if answers_count != total_questions:
+        Handle form submission, each answer is the index of the chosen choice
+        The answers of all passages are read into one flat byte string, in the same order as the answer key"""
+        total_questions = len(test.answer_key)
+        user_answers = parse_answers(
+            request.form.get(f"answers[{i}][{j}]") for i, passage in enumerate(questions) for j in range(len(passage.questions))
+        )
+        
+        """Check if user answered all questions"""
+        if UNANSWERED in user_answers:
             flash("Please answer all questions", "danger")
             return redirect(url_for("reading_test"))
         else:
             session["reading_test_completed"] = True
         
-        """Calculate score"""
-        score = 0
-        for i, passage in enumerate(questions):
-            for j, question in enumerate(passage["questions"]):
-                if question["correct_answer"] == user_answers[i][j]:
-                    score += 1
+        """Calculate score against the answer key stored with the test"""
+        score = score_answers(test.answer_key, user_answers)
 
         """Update user streak and history"""
         if session.get("user_id"):
             update_user_streak(session["user_id"])
+            try:
+                record_attempt(get_db(), session["user_id"], "reading", test, user_answers)
+                forget_mastery(session["user_id"])
+            except sqlite3.Error as e:
+                flash(f"Error saving your answers: {e}", "danger")
+
+        """Start on the next test while the user reads their results, /retake swaps it in"""
+        pregenerate_next_test("reading")
+
+        return render_template("reading_result.html", questions=questions, total_questions=total_questions, user_answers=split_answers(questions, user_answers), score=score)
+
+def stream_events(event, payloads):
+    """Send each payload as a server-sent event as soon as it is ready, then a done event, or a failed one with the error"""
+    def events():
+        try:
+            for payload in payloads:
+                yield f"event: {event}\ndata: {msgspec.json.encode(payload).decode()}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"Streaming error: {e}")
+            yield f"event: failed\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def stream_test(kind):
+    """Send each question of a new test as a server-sent event as soon as it is ready"""
+    questions = stream_questions(kind, session.get(f"current_{kind}_test_id"))
+    return stream_events("question", ({"index": index, "item": item} for index, item in enumerate(questions)))
+
+@app.route("/grammar_test/stream", methods=["GET"])
+def grammar_test_stream():
+    return stream_test("grammar")
+
+@app.route("/reading_test/stream", methods=["GET"])
+def reading_test_stream():
+    return stream_test("reading")
+
+# Full-length reading mock exam, Parts 5 to 7
+@app.route("/exam", methods=["GET", "POST"])
+def exam():
+    if request.method == "GET":
+        """A finished exam is followed by a new one, an unfinished one is shown again"""
+        if session.get("exam_test_completed"):
+            clear_current_test("exam")
+        test = get_current_test("exam")
+        if test:
+            return render_template("exam.html", sections=exam_sections(test.items))
+        # Render the sections right away and let the browser fill each one in as its chunk is generated
+        if app.config["STREAMING_TESTS"]:
+            start_streamed_test("exam")
+            return render_template("exam.html", sections=exam_sections(), stream_url=url_for("exam_stream"))
+        try:
+            test = generate_exam()
+            flash("Successfully generated questions", "success")
+            return render_template("exam.html", sections=exam_sections(test.items))
+        except Exception as e:
+            flash(f"Error generating questions: {e}", "danger")
+            return redirect(url_for("home"))
+    else:
+        """Check if the session has current exam data"""
+        test = get_current_test("exam")
+        if test is None:
+            flash("Session expired, please try again", "danger")
+            return redirect(url_for("home"))
+
+        """
+        Each answer is the index of the chosen choice, named by its position in the answer key.
+        Unlike the practice tests questions may be left unanswered, they count as wrong"""
+        user_answers = parse_answers(request.form.get(f"answers[{i}]") for i in range(len(test.answer_key)))
+        session["exam_test_completed"] = True
+
+        """Calculate the score of every part against the answer key stored with the exam"""
+        parts = score_exam(test, user_answers)
+
+        favorited = {}
+        if session.get("user_id"):
+            try:
+                favorited = favorite_states(get_db(), session["user_id"], [q for chunk in test.items for q in chunk.questions])
+            except sqlite3.Error as e:
+                flash(f"Error retrieving favorites: {e}", "danger")
+
+            update_user_streak(session["user_id"])
+            try:
+                record_exam(get_db(), session["user_id"], test, user_answers)
+                forget_mastery(session["user_id"])
+            except sqlite3.Error as e:
+                flash(f"Error saving your answers: {e}", "danger")
 
-        return render_template("reading_result.html", questions=questions, total_questions=total_questions, user_answers=user_answers, score=score)
+        return render_template("exam_result.html", sections=exam_sections(test.items), parts=parts, user_answers=user_answers,
+                               score=sum(p["score"] for p in parts.values()), total_questions=sum(p["total"] for p in parts.values()),
+                               unanswered=user_answers.count(UNANSWERED) - test.answer_key.count(NO_QUESTION), favorite_states=favorited, test_id=session.get("current_exam_test_id"))
+
+@app.route("/exam/stream", methods=["GET"])
+def exam_stream():
+    """Each chunk of the exam as soon as it is ready, with the position of its first question in the exam"""
+    chunks = stream_exam(session.get("current_exam_test_id"))
+    return stream_events("chunk", ({"number": number, "offset": CHUNK_OFFSETS[number], "chunk": chunk} for number, chunk in chunks))
 
 # Clear current test session
 @app.route("/retake", methods=["POST"])
 def retake():
-    """Clear specific test session data based on which test was completed"""
+    """Clear specific test session data based on which test was completed, the test page then swaps in the pre-generated next test"""
     if session.get("grammar_test_completed"):
-        session.pop("current_grammar_test", None)
-        session.pop("grammar_test_completed", None)
+        clear_current_test("grammar")
         return redirect(url_for("grammar_test"))
     elif session.get("reading_test_completed"):
-        session.pop("current_reading_test", None)
-        session.pop("reading_test_completed", None)
+        clear_current_test("reading")
         return redirect(url_for("reading_test"))
     else:
         flash("No test session found", "warning")
@@ -229,7 +326,7 @@ def retake():
 def login():
     session.pop("user_id", None)
     if request.method == "GET":
-        return render_template("login.html")
+        return cached_page("login.html")
     else:
         if not request.form.get("username") or not request.form.get("password"):
             flash("Please fill in all fields", "danger")
@@ -239,29 +336,37 @@ def login():
         password = request.form.get("password")
 
         try:
-            conn = sqlite3.connect(db_file)
+            conn = get_db()
             with conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT id, password FROM users WHERE username = ?", (username,))
                 row = cursor.fetchone()
-                if not check_password_hash(row[1], password):
+                if not row or not verify_password(row[1], password):
                     flash("Invalid username or password", "danger")
                     return redirect(url_for("login"))
                 else:
+                    """Upgrade hashes made with an older method or cost while we have the password, best effort"""
+                    if needs_rehash(row[1]):
+                        try:
+                            cursor.execute("UPDATE users SET password = ? WHERE id = ?", (hash_password(password), row[0]))
+                        except (HashQueueFull, TimeoutError):
+                            pass # The password is verified, the hash is upgraded on a later login when the pool isn't busy
                     session["user_id"] = row[0]
                     flash("Logged in successfully", "success")
                     return redirect(url_for("dashboard"))
+        except HashQueueFull as e:
+            flash(str(e), "warning")
+            return redirect(url_for("login"))
         except sqlite3.Error as e:
             flash(f"Error logging in: {e}", "danger")
             return redirect(url_for("login"))
         except Exception as e:
             flash(f"Unexpected error: {e}", "danger")
             return redirect(url_for("login"))
-        finally:
-            conn.close() 
 
 @app.route("/logout", methods=["POST"])
 def logout():
+    discard_pregenerated_tests()
     session.pop("user_id", None)
     flash("Logged out successfully", "success")
     return redirect(url_for("home"))
@@ -269,7 +374,7 @@ def logout():
 @app.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "GET":
-        return render_template("register.html")
+        return cached_page("register.html")
     else:
         if not request.form.get("username") or not request.form.get("password"):
             flash("Please fill in all fields", "danger")
@@ -280,15 +385,18 @@ def register():
             return redirect(url_for("register"))
 
         username = request.form.get("username")
-        hash = generate_password_hash(request.form.get("password"))
 
         try:
-            conn = sqlite3.connect(db_file)
+            hash = hash_password(request.form.get("password"))
+            conn = get_db()
             with conn:
                 cursor = conn.cursor()
                 cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hash))
                 flash("Account created successfully!", "success")
                 return redirect(url_for("login"))
+        except HashQueueFull as e:
+            flash(str(e), "warning")
+            return redirect(url_for("register"))
         except sqlite3.Error as e:
             flash(f"Error creating account: {e}", "danger")
             return redirect(url_for("register"))
@@ -298,8 +406,6 @@ def register():
         except Exception as e:
             flash(f"Unexpected error: {e}", "danger")
             return redirect(url_for("register"))
-        finally:
-            conn.close()
 
 @app.route("/change_password", methods=["GET", "POST"])
 @login_required
@@ -319,27 +425,28 @@ def change_password():
         new_password = request.form.get("new_password")
 
         try:
-            conn = sqlite3.connect(db_file)
+            conn = get_db()
             with conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT password FROM users WHERE id = ?", (session["user_id"],))
                 row = cursor.fetchone()
-                if not row or not check_password_hash(row[0], old_password):
+                if not row or not verify_password(row[0], old_password):
                     flash("Invalid old password", "danger")
                     return redirect(url_for("change_password"))
                 
-                new_hash = generate_password_hash(new_password)
+                new_hash = hash_password(new_password)
                 cursor.execute("UPDATE users SET password = ? WHERE id = ?", (new_hash, session["user_id"]))
                 flash("Password changed successfully", "success")
                 return redirect(url_for("dashboard"))
+        except HashQueueFull as e:
+            flash(str(e), "warning")
+            return redirect(url_for("change_password"))
         except sqlite3.Error as e:
             flash(f"Error changing password: {e}", "danger")
             return redirect(url_for("change_password"))
         except Exception as e:
             flash(f"Unexpected error: {e}", "danger")
             return redirect(url_for("change_password"))
-        finally:
-            conn.close()
 
 # Favorite & unfavorite questions function
 @app.route("/favorite", methods=["POST"])
@@ -347,62 +454,133 @@ def change_password():
 def favorite():
     """Get data from the request using json"""
     data = request.get_json()
-    question = data.get("question")
-    choices = data.get("choices")
-    correct_answer = data.get("correct_answer")
-    explanation = data.get("explanation")
-
-    if not all([question, choices, correct_answer, explanation]):
-        return jsonify({"error": "Missing data"}), 400
+    question_id = data.get("question_id")
+    index = data.get("index")
+    if any(value is not None and (not isinstance(value, int) or isinstance(value, bool)) for value in (question_id, index)):
+        return jsonify({"error": "Question id and index must be integers"}), 400
     try:
-        conn = sqlite3.connect(db_file)
-        with conn:
-            cursor = conn.cursor()
-            """Check if the question already exists in the favorites table for the user"""
-            cursor.execute("SELECT * FROM favorites WHERE user_id = ? AND question = ?", (session["user_id"], question))
-            row = cursor.fetchone()
-            if row:
-                """If exist, remove from favorites
-                Since user_id and question are unique together, we can use them to delete the row"""
-                cursor.execute("DELETE FROM favorites WHERE user_id = ? AND question = ?", (session["user_id"], question))
-                return jsonify({"message": "Question removed from favorites"}), 200
-            else:
-                """Insert the question into the favorites table"""
-                cursor.execute("""
-                    INSERT INTO favorites (user_id, question, choices, correct_answer, explanation) VALUES (?, ?, ?, ?, ?)
-                """, (session["user_id"], question, choices, correct_answer, explanation))
-                return jsonify({"message": "Question added to favorites"}), 200
+        """
+        A card without an id shows a question no one has favorited yet. It is stored once for all users,
+        taken from the test it was served in so the stored question is always the one the server generated
+        """
+        if question_id is None:
+            test = load_test(data.get("test_id"))
+            if test is None or index is None:
+                return jsonify({"error": "Missing data"}), 400
+            item = question_at(test, index)
+            if not isinstance(item, GrammarQuestion):
+                return jsonify({"error": "Question not found"}), 404
+            question_id = store_question(get_db(), item.question, item.choices, item.correct_answer, item.explanation)
+
+        """Toggle on the integer (user_id, question_id) key"""
+        favorited = toggle_favorite(get_db(), session["user_id"], question_id)
+        if favorited is None:
+            return jsonify({"error": "Question not found"}), 404
+        elif favorited:
+            return jsonify({"message": "Question added to favorites", "question_id": question_id}), 200
+        else:
+            return jsonify({"message": "Question removed from favorites", "question_id": question_id}), 200
     except sqlite3.Error as e:
         return jsonify({"error": f"Database error: {e}"}), 500
     except Exception as e:
         return jsonify({"error": f"Unexpected error: {e}"}), 500
-    finally:
-        conn.close()
 
 # Show favorites page
 @app.route("/favorites", methods=["GET"])
 @login_required
 def show_favorites():
+    """Render the first page, the rest is loaded from /api/favorites as the user scrolls"""
+    search = request.args.get("q", "").strip()
     try:
-        conn = sqlite3.connect(db_file)
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT question, choices, correct_answer, explanation FROM favorites WHERE user_id = ?", (session["user_id"],))
-            favorites = cursor.fetchall()
-            if not favorites:
-                flash("No favorites found", "info")
-                return render_template("favorites.html", favorites=[])
-            else:
-                flash("Favorites retrieved successfully", "success")
-                return render_template("favorites.html", favorites=favorites)
+        favorites, next_after = list_favorites(get_db(), session["user_id"], search=search)
+        next_url = url_for("favorites_api", after=next_after, q=search or None) if next_after else None
+        if not favorites:
+            flash("No favorites found", "info")
+            return render_template("favorites.html", favorites=[], search=search, next_url=None)
+        else:
+            flash("Favorites retrieved successfully", "success")
+            return render_template("favorites.html", favorites=favorites, search=search, next_url=next_url)
     except sqlite3.Error as e:
         flash(f"Error retrieving favorites: {e}", "danger")
         return redirect(url_for("dashboard"))
     except Exception as e:
         flash(f"Unexpected error: {e}", "danger")
         return redirect(url_for("dashboard"))
-    finally:
-        conn.close()
+
+# One page of favorites as JSON, for infinite scroll
+@app.route("/api/favorites", methods=["GET"])
+@login_required
+def favorites_api():
+    search = request.args.get("q", "").strip()
+    after = request.args.get("after", 0, type=int)
+    try:
+        favorites, next_after = list_favorites(get_db(), session["user_id"], after=after, search=search)
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Database error: {e}"}), 500
+    next_url = url_for("favorites_api", after=next_after, q=search or None) if next_after else None
+    return jsonify({"favorites": favorites, "next": next_url})
+
+# Question bank depth and refill metrics
+@app.route("/metrics/question_bank", methods=["GET"])
+def question_bank_metrics():
+    return jsonify(bank_stats()), 200
+
+# Gemini client connection pool health
+@app.route("/metrics/gemini_client", methods=["GET"])
+def gemini_client_metrics():
+    return jsonify(client_health()), 200
+
+# Response cache hit/miss counters and memory use
+@app.route("/metrics/response_cache", methods=["GET"])
+def response_cache_metrics():
+    return jsonify(response_cache.snapshot()), 200
+
+# Tests generated in the background after a submission and how often a retake found them ready
+@app.route("/metrics/speculation", methods=["GET"])
+def speculation_metrics():
+    return jsonify(speculation_stats()), 200
+
+@app.route("/metrics/http_cache", methods=["GET"])
+def http_cache_metrics():
+    return jsonify(http_cache_stats()), 200
+
+def collect_component_metrics():
+    """The stats the question bank, response cache and Gemini client already keep, as Prometheus samples"""
+    for kind, stats in bank_stats().items():
+        labels = {"kind": kind}
+        yield "bank_depth", "gauge", "Items waiting in the question bank", labels, stats["depth"]
+        yield "bank_served_total", "counter", "Items handed out from the question bank", labels, stats["served"]
+        yield "bank_refilled_total", "counter", "Items added to the question bank", labels, stats["refilled"]
+        yield "bank_misses_total", "counter", "Draws the question bank couldn't fully serve", labels, stats["misses"]
+        yield "bank_refill_errors_total", "counter", "Failed question bank refills", labels, stats["refill_errors"]
+    cache = response_cache.snapshot()
+    for name in ("hits", "partial_hits", "misses", "items_stored", "items_served", "evictions", "expirations"):
+        yield f"response_cache_{name}_total", "counter", f"Response cache {name.replace('_', ' ')}", {}, cache[name]
+    yield "response_cache_items", "gauge", "Items in the response cache", {}, cache["items"]
+    yield "response_cache_bytes", "gauge", "Approximate size of the response cache", {}, cache["bytes"]
+    speculation = speculation_stats()
+    yield "speculative_tests_pending", "gauge", "Next tests waiting or being generated in the background", {}, speculation["pending"]
+    if speculation["hit_rate"] is not None:
+        yield "speculative_hit_rate", "gauge", "Share of retakes that found their next test ready", {}, speculation["hit_rate"]
+    hashing = hash_queue_stats()
+    yield "password_hash_queued", "gauge", "Password hashes waiting or running in this process", {}, hashing["queued"]
+    http = http_cache_stats()
+    for name in ("fragment_hits", "fragment_misses", "page_hits", "page_renders", "not_modified"):
+        yield f"http_cache_{name}_total", "counter", f"HTTP cache {name.replace('_', ' ')}", {}, http[name]
+    yield "http_cache_compressed_bytes_saved_total", "counter", "Response bytes saved by serving precompressed variants", {}, http["compressed_bytes_saved"]
+    yield "http_cache_fragments", "gauge", "Rendered question cards cached in this process", {}, http["fragments"]
+    client = client_health()
+    yield "gemini_client_connected", "gauge", "Whether this process has an open Gemini client", {}, int(client["connected"])
+    yield "gemini_client_calls_total", "counter", "Completed Gemini client calls", {}, client["calls"]
+    yield "gemini_client_errors_total", "counter", "Gemini client calls that raised", {}, client["errors"]
+    yield "gemini_client_reconnects_total", "counter", "Connection pool rebuilds after a transport error", {}, client["reconnects"]
+
+register_collector(collect_component_metrics)
+
+# Everything above plus the stage latency histograms and counters, in the Prometheus text format
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
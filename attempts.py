@@ -0,0 +1,110 @@
+import time
+from db import connection
+from favorites import question_hash
+from prompts import GRAMMAR_CONCEPTS, READING_QUESTION_TYPES
+from models import questions_of
+
+# Configuration Constants
+EMA_ALPHA = 0.3 # Weight of the latest test in the rolling accuracy
+ALL_TYPES = "*" # Aggregate row covering every question of a test kind
+OTHER_TYPE = "Other" # For questions the model didn't tag with a known concept or question type
+
+QUESTION_TYPES = {"grammar": GRAMMAR_CONCEPTS, "reading": READING_QUESTION_TYPES}
+_canonical_types = {kind: {name.lower(): name for name in names} for kind, names in QUESTION_TYPES.items()}
+
+def init_attempts():
+    """Create the answer log and the per-user aggregates if they don't exist, safe to call on every startup"""
+    with connection() as conn:
+        # Append-only, one row per answered question
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS attempts (
+                user_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                position INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                question_hash TEXT NOT NULL,
+                question_type TEXT NOT NULL,
+                answer TEXT,
+                correct INTEGER NOT NULL,
+                PRIMARY KEY (user_id, created_at, position),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            ) WITHOUT ROWID
+        """)
+        # Updated in the same transaction as each insert, so reading progress never scans the log
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS attempt_stats (
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                question_type TEXT NOT NULL,
+                tests INTEGER NOT NULL,
+                answered INTEGER NOT NULL,
+                correct INTEGER NOT NULL,
+                ema_accuracy REAL NOT NULL,
+                last_at REAL NOT NULL,
+                PRIMARY KEY (user_id, kind, question_type),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            ) WITHOUT ROWID
+        """)
+
+def question_type(kind, item):
+    """Return the concept (grammar) or question type (reading) the model tagged the question with"""
+    label = getattr(item, "concept" if kind == "grammar" else "question_type", "") or ""
+    return _canonical_types[kind].get(label.strip().lower(), OTHER_TYPE)
+
+def record_attempt(conn, user_id, kind, test, answers):
+    """
+    Log every answer of a submitted test and fold the result into the user's aggregates.
+    answers holds the index of the chosen choice of every question, in the order of test.answer_key.
+    """
+    now = time.time()
+    rows = []
+    totals = {} # question type -> [answered, correct]
+    for position, (item, answer, correct_answer) in enumerate(zip(questions_of(kind, test.items), answers, test.answer_key)):
+        qtype = question_type(kind, item)
+        correct = int(answer == correct_answer)
+        answer = item.choices[answer] if answer < len(item.choices) else None
+        rows.append((user_id, now, position, kind, question_hash(item.question, item.correct_answer), qtype, answer, correct))
+        for key in (qtype, ALL_TYPES):
+            counts = totals.setdefault(key, [0, 0])
+            counts[0] += 1
+            counts[1] += correct
+
+    with conn:
+        conn.executemany("""
+            INSERT INTO attempts (user_id, created_at, position, kind, question_hash, question_type, answer, correct)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        # The rolling accuracy moves toward this test's accuracy for each question type
+        conn.executemany("""
+            INSERT INTO attempt_stats (user_id, kind, question_type, tests, answered, correct, ema_accuracy, last_at)
+            VALUES (?, ?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT (user_id, kind, question_type) DO UPDATE SET
+                tests = tests + 1,
+                answered = answered + excluded.answered,
+                correct = correct + excluded.correct,
+                ema_accuracy = ? * excluded.ema_accuracy + (1 - ?) * ema_accuracy,
+                last_at = excluded.last_at
+        """, [
+            (user_id, kind, qtype, count, correct, correct / count, now, EMA_ALPHA, EMA_ALPHA)
+            for qtype, (count, correct) in totals.items()
+        ])
+
+def get_progress(conn, user_id):
+    """
+    Return {kind: {"tests", "answered", "accuracy", "rolling_accuracy", "types": [...]}} for the kinds the user has taken,
+    with question types weakest first. Reads only the user's aggregate rows.
+    """
+    rows = conn.execute(
+        "SELECT kind, question_type, tests, answered, correct, ema_accuracy FROM attempt_stats WHERE user_id = ?", (user_id,)
+    ).fetchall()
+    progress = {}
+    for kind, qtype, tests, answered, correct, ema_accuracy in rows:
+        stats = {"tests": tests, "answered": answered, "accuracy": correct / answered, "rolling_accuracy": ema_accuracy}
+        entry = progress.setdefault(kind, {"types": []})
+        if qtype == ALL_TYPES:
+            entry.update(stats)
+        else:
+            entry["types"].append({"name": qtype, **stats})
+    for entry in progress.values():
+        entry["types"].sort(key=lambda item: item["rolling_accuracy"])
+    return progress
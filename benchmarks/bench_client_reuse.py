@@ -0,0 +1,46 @@
+"""
+Compare a fresh genai.Client per call (the old get_response) with the shared pooled client.
+
+Run from the project root: python -m benchmarks.bench_client_reuse [--calls 200] [--latency 0]
+"""
+from google import genai
+from google.genai import types
+import argparse, os, statistics, time
+import fake_gemini
+
+def run(label, call, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"{label:<22} mean {statistics.mean(timings):7.2f} ms   p50 {timings[len(timings) // 2]:7.2f} ms   p95 {timings[int(len(timings) * 0.95)]:7.2f} ms")
+    return statistics.mean(timings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated model latency in seconds")
+    args = parser.parse_args()
+
+    server, base_url = fake_gemini.start_server(latency=args.latency)
+    os.environ["GEMINI_BASE_URL"] = base_url
+    os.environ.setdefault("GEMINI_API_KEY", "fake-key")
+    import gemini_client
+
+    config = types.GenerateContentConfig(temperature=0.5)
+
+    def fresh_client():
+        client = genai.Client(api_key=os.environ["GEMINI_API_KEY"], http_options=types.HttpOptions(base_url=base_url))
+        client.models.generate_content(model="gemini-2.0-flash", contents="GRAMMAR_DATA", config=config)
+
+    def pooled_client():
+        gemini_client.generate_content(model="gemini-2.0-flash", contents="GRAMMAR_DATA", config=config)
+
+    pooled_client() # Warm up the pool so the first connection isn't counted
+    fresh = run("fresh client per call", fresh_client, args.calls)
+    pooled = run("shared pooled client", pooled_client, args.calls)
+    print(f"saved per call: {fresh - pooled:.2f} ms")
+    print(gemini_client.client_health())
+    server.shutdown()
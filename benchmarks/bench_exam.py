@@ -0,0 +1,91 @@
+"""
+Time to the first section and to the whole 100-question mock exam with its chunks generated one at a time
+against EXAM_CONCURRENCY at a time, each call answered by the fake Gemini server after --latency seconds,
+and scoring a 100-question submission with a nested loop over the items against the answer key slices.
+
+Runs against a temporary database, the project database.db is not touched.
+Run from the project root: python -m benchmarks.bench_exam [--latency 2] [--concurrency 1 3 6 11] [--repeat 2000]
+"""
+import argparse, os, random, statistics, tempfile, time
+
+def generate(exam, concurrency, run):
+    """Seconds until the first chunk and until the last one of a new exam, and the number of questions it got"""
+    exam.EXAM_CONCURRENCY = concurrency
+    start = time.perf_counter()
+    first = None
+    chunks = {}
+    for number, chunk in exam.stream_new_exam(f"bench:{concurrency}:{run}", None):
+        first = first or time.perf_counter() - start
+        chunks[number] = chunk
+    return first, time.perf_counter() - start, sum(chunk.size for chunk in chunks.values() if chunk.questions or chunk.passages)
+
+def nested_score(items, answers):
+    """Scoring as the practice tests did before answer keys: every question of every passage of every chunk"""
+    score = 0
+    position = 0
+    for chunk in items:
+        for question in chunk.questions:
+            if answers[position] < 4 and question.choices[answers[position]] == question.correct_answer:
+                score += 1
+            position += 1
+        for passage in chunk.passages:
+            for question in passage.questions:
+                if answers[position] < 4 and question.choices[answers[position]] == question.correct_answer:
+                    score += 1
+                position += 1
+    return score
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1_000_000)
+    return statistics.median(timings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=2.0, help="Seconds the fake server takes to answer each call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 3, 6, 11])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_API_KEY", "fake-key")
+    os.environ.setdefault("FLASK_SECRET_KEY", "bench")
+    os.environ["BANK_REFILL_ENABLED"] = "0"
+    os.environ["RATE_LIMITS_ENABLED"] = "0"
+    os.environ["RESPONSE_CACHE_TTL"] = "0" # Every run generates Part 5 instead of reusing the last run's questions
+    os.environ["GENERATION_POOL_SIZE"] = str(max(args.concurrency))
+    import fake_gemini
+    server, base_url = fake_gemini.start_server(latency=args.latency)
+    os.environ["GEMINI_BASE_URL"] = base_url
+    import db
+    db.db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    from question_bank import init_bank
+    from dedup import init_dedup
+    from attempts import init_attempts
+    import exam
+    from models import practice_set, parse_answers
+    init_bank()
+    init_dedup()
+    init_attempts()
+
+    print(f"100-question exam in {len(exam.EXAM_LAYOUT)} chunks, {args.latency:.1f} s per call")
+    print(f"{'concurrency':<12} {'first section':>14} {'whole exam':>12} {'questions':>10}")
+    for run, concurrency in enumerate(args.concurrency):
+        with db.connection() as conn:
+            conn.execute("DELETE FROM question_bank") # Leftovers of the last run would fill Part 5 without a call
+        first, total, questions = generate(exam, concurrency, run)
+        print(f"{concurrency:<12} {first:>12.2f} s {total:>10.2f} s {questions:>10}")
+
+    chunks = [chunk for _, chunk in sorted(exam.stream_new_exam("bench:score", None))]
+    test = practice_set("exam", chunks)
+    answers = parse_answers(random.choice(("0", "1", "2", "3", "")) for _ in range(exam.EXAM_QUESTIONS))
+    parts = exam.score_exam(test, answers)
+    assert sum(part["score"] for part in parts.values()) == nested_score(chunks, answers), "scores differ"
+    print(f"\nScoring a {exam.EXAM_QUESTIONS}-question submission, median of {args.repeat}")
+    old = timed(lambda: nested_score(chunks, answers), args.repeat)
+    new = timed(lambda: exam.score_exam(test, answers), args.repeat)
+    print(f"nested loop over the items      {old:8.1f} us")
+    print(f"answer key slices per part      {new:8.1f} us   speedup {old / new:.1f}x")
+    server.shutdown()
@@ -0,0 +1,71 @@
+"""
+Favorites page render time for a user with many saved questions: choices decoded with ast.literal_eval
+in the template on every view (the old eval filter) versus JSON decoded once in the query layer.
+
+Runs against a temporary database, the project database.db is not touched.
+Run from the project root: python -m benchmarks.bench_favorites [--favorites 1000 5000] [--renders 20]
+"""
+import argparse, ast, json, os, statistics, tempfile, time
+
+def run(label, render, renders):
+    timings = []
+    for _ in range(renders):
+        start = time.perf_counter()
+        render()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"{label:<34} mean {statistics.mean(timings):8.2f} ms   p50 {timings[len(timings) // 2]:8.2f} ms")
+    return statistics.mean(timings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--favorites", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--renders", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_API_KEY", "fake-key")
+    os.environ.setdefault("FLASK_SECRET_KEY", "bench")
+    os.environ["BANK_REFILL_ENABLED"] = "0"
+    import db
+    db.db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    from flask import render_template, session
+    from app import app
+    from db import connection
+    from favorites import store_question, toggle_favorite, list_favorites
+    import fake_gemini
+
+    # The old template, with choices parsed from a Python repr string on every render
+    app.jinja_env.filters["eval"] = ast.literal_eval
+    legacy_source = app.jinja_env.loader.get_source(app.jinja_env, "favorites.html")[0]
+    legacy_template = app.jinja_env.from_string(legacy_source.replace("{% for choice in favorite.choices %}", "{% for choice in favorite.choices|eval %}"))
+
+    added = 0
+    with connection() as conn:
+        conn.execute("INSERT INTO users (username, password) VALUES ('bench', 'x')")
+    for count in args.favorites:
+        with connection() as conn:
+            while added < count:
+                item = fake_gemini.make_question()
+                toggle_favorite(conn, 1, store_question(conn, f"{added}. {item['question']}", item["choices"], item["correct_answer"], item["explanation"]))
+                added += 1
+            # The whole list on one page, as the page showed it before it was paginated
+            legacy_rows = [dict(favorite, choices=repr(favorite["choices"])) for favorite in list_favorites(conn, 1, limit=count)[0]]
+            raw_rows = conn.execute("""
+                SELECT q.id, q.question, q.choices, q.correct_answer, q.explanation FROM favorite_questions f
+                JOIN questions q ON q.id = f.question_id WHERE f.user_id = 1 ORDER BY f.question_id
+            """).fetchall()
+
+            print(f"\n{count} favorites")
+            with app.test_request_context("/favorites"):
+                session["user_id"] = 1
+
+                def legacy():
+                    legacy_template.render(favorites=legacy_rows)
+
+                def decoded():
+                    rows = [{"id": i, "question": q, "choices": json.loads(c), "correct_answer": a, "explanation": e} for i, q, c, a, e in raw_rows]
+                    render_template("favorites.html", favorites=rows)
+
+                old = run("ast.literal_eval in template", legacy, args.renders)
+                new = run("JSON decoded in query layer", decoded, args.renders)
+                print(f"speedup: {old / new:.2f}x")
@@ -0,0 +1,84 @@
+"""
+Result page render time with every question card rendered by Jinja versus served from the fragment cache,
+and the bytes a browser downloads for the pages and static files with and without the HTTP cache:
+first visit uncompressed, first visit compressed, and a revisit that only revalidates.
+
+Runs against a temporary database, the project database.db is not touched.
+Run from the project root: python -m benchmarks.bench_http_cache [--renders 200] [--pool 50]
+"""
+import argparse, os, random, re, statistics, tempfile, time, msgspec
+
+def run(label, render, renders):
+    timings = []
+    for _ in range(renders):
+        start = time.perf_counter()
+        render()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"{label:<34} mean {statistics.mean(timings):8.3f} ms   p50 {timings[len(timings) // 2]:8.3f} ms")
+    return statistics.mean(timings)
+
+def page_bytes(client, path, headers):
+    """Bytes of a page plus the static files it links to"""
+    total = len(client.get(path, headers=headers).data)
+    # Links read from the uncompressed page
+    for url in re.findall(rb'(?:href|src)="(/static/[^"]+)"', client.get(path).data):
+        total += len(client.get(url.decode(), headers=headers).data)
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--renders", type=int, default=200)
+    parser.add_argument("--pool", type=int, default=50, help="Distinct questions result pages are drawn from, as with a question bank")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_API_KEY", "fake-key")
+    os.environ.setdefault("FLASK_SECRET_KEY", "bench")
+    os.environ["BANK_REFILL_ENABLED"] = "0"
+    import db
+    db.db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+    from flask import render_template
+    from app import app
+    from models import GrammarQuestion
+    import fake_gemini, http_cache
+
+    pool = [msgspec.convert(fake_gemini.make_question(), GrammarQuestion) for _ in range(args.pool)]
+    random.seed(1)
+    pages = []
+    for _ in range(args.renders):
+        questions = random.sample(pool, 10)
+        answers = [random.randrange(4) for _ in questions]
+        favorited = {q.question: (n, True) for n, q in enumerate(questions, 1) if random.random() < 0.2}
+        pages.append((questions, answers, favorited))
+
+    def render(n=[0]):
+        questions, answers, favorited = pages[n[0] % len(pages)]
+        n[0] += 1
+        return render_template("grammar_result.html", questions=questions, total_questions=10, user_answers=answers,
+                               score=sum(q.choices[a] == q.correct_answer for q, a in zip(questions, answers)), favorite_states=favorited)
+
+    with app.test_request_context("/grammar_test", method="POST"):
+        # Same pages either way, apart from the versions the cache adds to static URLs
+        unversioned = lambda html: re.sub(r"\?v=\w+", "", html)
+        http_cache.HTTP_CACHE_ENABLED = False
+        uncached = [render() for _ in range(len(pages))]
+        http_cache.HTTP_CACHE_ENABLED = True
+        assert [unversioned(render()) for _ in range(len(pages))] == uncached, "cached cards render differently"
+
+        print(f"Result page with 10 of {args.pool} questions, {args.renders} renders")
+        http_cache.HTTP_CACHE_ENABLED = False
+        old = run("every card rendered", render, args.renders)
+        http_cache.HTTP_CACHE_ENABLED = True
+        new = run("cards from the fragment cache", render, args.renders)
+        stats = http_cache.http_cache_stats()
+        print(f"speedup: {old / new:.2f}x, fragment hit rate {stats['fragment_hits'] / (stats['fragment_hits'] + stats['fragment_misses']):.0%}")
+
+    client = app.test_client()
+    print(f"\n{'page':<12} {'plain':>10} {'compressed':>12} {'revisit':>10}")
+    for path in ("/", "/login", "/register"):
+        plain = page_bytes(client, path, {})
+        compressed = page_bytes(client, path, {"Accept-Encoding": "br, gzip"})
+        # A revisit sends back the page's ETag, versioned static files don't need a request at all within their max-age
+        etag = client.get(path, headers={"Accept-Encoding": "br, gzip"}).headers["ETag"]
+        revisit = len(client.get(path, headers={"Accept-Encoding": "br, gzip", "If-None-Match": etag}).data)
+        print(f"{path:<12} {plain:>8} B {compressed:>10} B {revisit:>8} B")
@@ -0,0 +1,62 @@
+"""
+Parse the captured model responses in benchmarks/responses/ with the old strip-and-json.loads code
+and with parsing.extract_items, then measure the throughput of extract_items.
+
+Files are named <kind>_<failure>.txt, the *_valid.txt ones are well-formed responses.
+Run from the project root: python -m benchmarks.bench_parsing [--seconds 2]
+"""
+import argparse, contextlib, io, json, os, time
+from parsing import extract_items, DATA_KEYS
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "responses")
+
+def legacy_parse(text, kind):
+    """What fetch_grammar_questions/fetch_reading_questions did before: strip a full wrapper, then json.loads"""
+    text = text.strip()
+    if text.startswith("<json>") and text.endswith("</json>"):
+        text = text[len("<json>"):-len("</json>")].strip()
+    if text.startswith("```json") and text.endswith("```"):
+        text = text[len("```json"):-len("```")].strip()
+    return json.loads(text, strict=(kind == "grammar"))[DATA_KEYS[kind]]
+
+def count(parse, text, kind):
+    try:
+        return str(len(parse(text, kind)))
+    except Exception as e:
+        return type(e).__name__
+
+def throughput(corpus, seconds):
+    size = sum(len(text.encode("utf-8")) for _, _, text in corpus)
+    parsed = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _, kind, text in corpus:
+            try:
+                extract_items(text, kind)
+            except ValueError:
+                pass
+        parsed += 1
+    elapsed = time.perf_counter() - start
+    return parsed * len(corpus) / elapsed, parsed * size / elapsed / 1024 / 1024
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    corpus = []
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+            corpus.append((name, name.split("_")[0], f.read()))
+
+    print(f"{'response':<36} {'old':>16} {'new':>6}")
+    for name, kind, text in corpus:
+        print(f"{name:<36} {count(legacy_parse, text, kind):>16} {count(extract_items, text, kind):>6}")
+
+    # Silence the per-response "Dropped ..." messages while timing
+    valid = [entry for entry in corpus if entry[0].endswith("_valid.txt")]
+    with contextlib.redirect_stdout(io.StringIO()):
+        valid_rate, valid_mb = throughput(valid, args.seconds)
+        all_rate, all_mb = throughput(corpus, args.seconds)
+    print(f"\nwell-formed responses: {valid_rate:8.0f} responses/s  {valid_mb:6.1f} MB/s")
+    print(f"whole corpus:          {all_rate:8.0f} responses/s  {all_mb:6.1f} MB/s")
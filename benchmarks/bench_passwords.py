@@ -0,0 +1,86 @@
+"""
+Login throughput against test-page latency under mixed load, with passwords hashed in the request thread
+(PASSWORD_HASH_WORKERS=0) and in the hashing process pool.
+
+Starts the app like benchmarks/loadtest.py does, then for --seconds keeps --logins threads logging in back to back
+while --students threads reload a test page they already have, which needs no Gemini call.
+Run from the project root: python -m benchmarks.bench_passwords [--server gunicorn] [--pools 0,1,2] [--method scrypt]
+"""
+import argparse, os, statistics, tempfile, threading, time, httpx
+from benchmarks.loadtest import start_fake_gemini, start_app, percentile
+
+def run(args, hash_workers):
+    os.environ["PASSWORD_HASH_WORKERS"] = str(hash_workers)
+    os.environ["PASSWORD_HASH_METHOD"] = args.method
+    with tempfile.TemporaryDirectory() as directory:
+        gemini, gemini_url = start_fake_gemini(args)
+        app, app_url = start_app(args, gemini_url, directory)
+        try:
+            clients = []
+            for n in range(args.logins + args.students):
+                client = httpx.Client(base_url=app_url, follow_redirects=True, timeout=120)
+                client.post("/register", data={"username": f"user{n}", "password": "password", "confirm_password": "password"})
+                if n >= args.logins:
+                    client.post("/login", data={"username": f"user{n}", "password": "password"})
+                    client.get("/grammar_test")
+                clients.append(client)
+
+            logins, rejected, page_ms = [0], [0], []
+            lock = threading.Lock()
+            deadline = time.monotonic() + args.seconds
+
+            def log_in(client, n):
+                while time.monotonic() < deadline:
+                    response = client.post("/login", data={"username": f"user{n}", "password": "password"})
+                    with lock:
+                        if response.url.path == "/dashboard":
+                            logins[0] += 1
+                        else:
+                            rejected[0] += 1
+
+            def take_test(client):
+                while time.monotonic() < deadline:
+                    start = time.perf_counter()
+                    client.get("/grammar_test")
+                    with lock:
+                        page_ms.append((time.perf_counter() - start) * 1000)
+
+            threads = [threading.Thread(target=log_in, args=(client, n)) for n, client in enumerate(clients[:args.logins])]
+            threads += [threading.Thread(target=take_test, args=(client,)) for client in clients[args.logins:]]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for client in clients:
+                client.close()
+        finally:
+            app.terminate()
+            gemini.terminate()
+            app.wait()
+            gemini.wait()
+
+    label = "request thread" if hash_workers <= 0 else f"pool of {hash_workers}"
+    print(f"{label:<16} {logins[0] / args.seconds:>9.1f}/s {rejected[0]:>9} {statistics.median(page_ms):>9.0f} ms "
+          f"{percentile(page_ms, 95):>9.0f} ms {percentile(page_ms, 99):>9.0f} ms {len(page_ms) / args.seconds:>8.1f}/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=("dev", "gunicorn"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--logins", type=int, default=8, help="Threads logging in back to back")
+    parser.add_argument("--students", type=int, default=4, help="Threads reloading their test page")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--pools", default="0,1,2", help="PASSWORD_HASH_WORKERS values to compare, 0 hashes in the request thread")
+    parser.add_argument("--method", default="scrypt:32768:8:1", help="PASSWORD_HASH_METHOD")
+    args = parser.parse_args()
+    # Only what start_fake_gemini and start_app read, no Gemini call is made after the first test page
+    args.latency, args.error_rate, args.malformed_rate, args.duplicate_rate = 0.0, 0.0, 0.0, 0.0
+    args.streaming, args.bank_refill = False, False
+    args.worker_class, args.connections, args.hash_method = "gthread", 1000, None
+
+    print(f"{args.logins} login threads and {args.students} test takers for {args.seconds:.0f} s on {args.server}, "
+          f"{args.workers} worker(s) x {args.threads} threads, {args.method}, {os.cpu_count()} CPU(s)")
+    print(f"{'hashing':<16} {'logins':>11} {'rejected':>9} {'page p50':>12} {'page p95':>12} {'page p99':>12} {'pages':>10}")
+    for hash_workers in (int(value) for value in args.pools.split(",")):
+        run(args, hash_workers)
@@ -0,0 +1,79 @@
+"""
+Memory and latency of 1k-question practice sets: the nested dicts pickled into session files or stored as JSON before,
+against the PracticeSet structs stored as msgpack, and nested-loop scoring against the answer key comparison.
+
+Run from the project root: python -m benchmarks.bench_practice_sets [--questions 1000] [--repeat 50]
+"""
+import argparse, json, pickle, random, statistics, time, tracemalloc, msgspec
+import fake_gemini
+from models import practice_set, parse_answers, score_answers, questions_of, ITEM_TYPES, SET_TYPES
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def allocated(function):
+    """Bytes still allocated by the object function() returns"""
+    tracemalloc.start()
+    result = function()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+def legacy_grammar_score(questions, answers):
+    score = 0
+    for i, question in enumerate(questions):
+        if question["correct_answer"] == answers[i]:
+            score += 1
+    return score
+
+def legacy_reading_score(questions, answers):
+    score = 0
+    for i, passage in enumerate(questions):
+        for j, question in enumerate(passage["questions"]):
+            if question["correct_answer"] == answers[i][j]:
+                score += 1
+    return score
+
+def bench(kind, items, repeat):
+    test = practice_set(kind, msgspec.convert(items, list[ITEM_TYPES[kind]]))
+    as_json = json.dumps(items, ensure_ascii=False).encode("utf-8")
+    as_pickle = pickle.dumps(items)
+    as_msgpack = msgspec.msgpack.encode(test)
+    decoder = msgspec.msgpack.Decoder(SET_TYPES[kind])
+
+    # The form values each format is scored from: choice texts before, choice indexes now
+    if kind == "grammar":
+        text_answers = [random.choice(q["choices"]) for q in items]
+    else:
+        text_answers = [[random.choice(q["choices"]) for q in passage["questions"]] for passage in items]
+    flat_text = text_answers if kind == "grammar" else [answer for passage in text_answers for answer in passage]
+    answers = parse_answers(str(q.choices.index(answer)) for q, answer in zip(questions_of(kind, test.items), flat_text))
+    legacy_score = legacy_grammar_score if kind == "grammar" else legacy_reading_score
+
+    total = len(test.answer_key)
+    print(f"\n{kind}: {len(items)} items, {total} questions")
+    print(f"{'':<26} {'size':>10} {'in memory':>10} {'load':>10} {'save':>10}")
+    print(f"{'dicts, pickle (session)':<26} {len(as_pickle):>10,} {allocated(lambda: pickle.loads(as_pickle)):>10,} {timed(lambda: pickle.loads(as_pickle), repeat):>7.2f} ms {timed(lambda: pickle.dumps(items), repeat):>7.2f} ms")
+    print(f"{'dicts, JSON (test store)':<26} {len(as_json):>10,} {allocated(lambda: json.loads(as_json)):>10,} {timed(lambda: json.loads(as_json), repeat):>7.2f} ms {timed(lambda: json.dumps(items, ensure_ascii=False), repeat):>7.2f} ms")
+    print(f"{'structs, msgpack':<26} {len(as_msgpack):>10,} {allocated(lambda: decoder.decode(as_msgpack)):>10,} {timed(lambda: decoder.decode(as_msgpack), repeat):>7.2f} ms {timed(lambda: msgspec.msgpack.encode(test), repeat):>7.2f} ms")
+
+    assert legacy_score(items, text_answers) == score_answers(test.answer_key, answers)
+    old = timed(lambda: legacy_score(items, text_answers), repeat) * 1000
+    new = timed(lambda: score_answers(test.answer_key, answers), repeat) * 1000
+    print(f"scoring: nested loops {old:.1f} us, answer key {new:.1f} us")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=1000, help="Questions per practice set")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    # Round trip through JSON so every string is its own object, like items parsed from a model response
+    bench("grammar", json.loads(json.dumps(fake_gemini.make_grammar_data(args.questions)["GRAMMAR_DATA"])), args.repeat)
+    bench("reading", json.loads(json.dumps(fake_gemini.make_reading_data(args.questions // 3)["READING_DATA"])), args.repeat)
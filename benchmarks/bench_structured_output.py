@@ -0,0 +1,79 @@
+"""
+Compare the free-form few-shot prompts with structured output (trimmed prompt + response schema) per generated test:
+prompt and response tokens as reported by the API, call latency, and how many responses parse into valid items.
+
+Runs against the local fake server by default, its token counts are rough (characters / 4) and its latency is fixed,
+so use --live with GEMINI_API_KEY set for real numbers.
+Run from the project root: python -m benchmarks.bench_structured_output [--calls 10] [--live]
+"""
+import argparse, contextlib, io, os, statistics, time
+import fake_gemini
+
+def measure(generate_content, model, prompt, config, parse, calls):
+    prompt_tokens, response_tokens, latencies, parse_ms = [], [], [], []
+    failures = 0
+    for _ in range(calls):
+        start = time.perf_counter()
+        try:
+            response = generate_content(model=model, contents=prompt, config=config)
+        except Exception as e:
+            print(f"API error: {e}")
+            failures += 1
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+        usage = response.usage_metadata
+        prompt_tokens.append(usage.prompt_token_count or 0)
+        response_tokens.append(usage.candidates_token_count or 0)
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                parse(response.text)
+        except ValueError:
+            failures += 1
+        parse_ms.append((time.perf_counter() - start) * 1000)
+    return {
+        "prompt": statistics.mean(prompt_tokens) if prompt_tokens else 0,
+        "response": statistics.mean(response_tokens) if response_tokens else 0,
+        "latency": statistics.median(latencies) if latencies else 0,
+        "parse": statistics.median(parse_ms) if parse_ms else 0,
+        "failures": failures
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=10, help="Generated tests per kind and mode")
+    parser.add_argument("--live", action="store_true", help="Call the real Gemini API instead of the local fake server")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated model latency in seconds for the fake server")
+    args = parser.parse_args()
+
+    server = None
+    if not args.live:
+        server, base_url = fake_gemini.start_server(latency=args.latency)
+        os.environ["GEMINI_BASE_URL"] = base_url
+        os.environ.setdefault("GEMINI_API_KEY", "fake-key")
+    # Imported after GEMINI_BASE_URL is set, the client reads it on import
+    from gemini_client import generate_content
+    from helpers import generation_config, MODEL
+    from prompts import grammar_prompt, reading_prompt, grammar_structured_prompt, reading_structured_prompt
+    from parsing import extract_items
+    from models import decode_items, RESPONSE_SCHEMAS
+
+    modes = {
+        "free-form": {"grammar": (grammar_prompt, None), "reading": (reading_prompt, None)},
+        "structured": {"grammar": (grammar_structured_prompt, RESPONSE_SCHEMAS["grammar"]), "reading": (reading_structured_prompt, RESPONSE_SCHEMAS["reading"])}
+    }
+    parsers = {"free-form": extract_items, "structured": decode_items}
+
+    print(f"{'test':<9} {'mode':<11} {'prompt tok':>10} {'response tok':>12} {'p50 latency':>12} {'p50 parse':>10} {'failed':>7}")
+    for kind in ("grammar", "reading"):
+        results = {}
+        for mode, prompts in modes.items():
+            prompt, schema = prompts[kind]
+            parse = lambda text: parsers[mode](text, kind)
+            results[mode] = result = measure(generate_content, MODEL, prompt, generation_config(schema), parse, args.calls)
+            print(f"{kind:<9} {mode:<11} {result['prompt']:>10.0f} {result['response']:>12.0f} {result['latency']:>9.0f} ms {result['parse']:>7.2f} ms {result['failures']:>4}/{args.calls}")
+        old, new = results["free-form"], results["structured"]
+        print(f"{kind:<9} {'saved':<11} {old['prompt'] - new['prompt']:>10.0f} {old['response'] - new['response']:>12.0f} {old['latency'] - new['latency']:>9.0f} ms")
+
+    if server:
+        server.shutdown()
@@ -0,0 +1,278 @@
+"""
+Load test: run the app under the Flask dev server or gunicorn against the local fake Gemini server
+and drive complete user flows from concurrent virtual users:
+register, login, take a grammar test, submit it, favorite a question, view favorites, then retake.
+
+Reports p50/p95/p99 latency per step, throughput (user steps per second, a step may follow redirects or read a stream)
+and worker saturation (requests in flight, from Little's law, over workers x threads, or x connections for gevent workers), and appends the results with the current commit to benchmarks/results/loadtest.jsonl
+so runs of the same configuration can be compared across commits.
+
+The app runs in a temporary directory with its own database, the fake server in its own process.
+Run from the project root: python -m benchmarks.loadtest [--server gunicorn] [--users 20] [--flows 3] [--latency 1.5]
+"""
+import argparse, html, json, os, platform, random, re, socket, statistics, subprocess, sys, tempfile, threading, time, httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(ROOT, "benchmarks", "results", "loadtest.jsonl")
+STEPS = ("register", "login", "grammar_test", "retake", "submit", "favorite", "favorites")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"{url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit(f"{url} did not start within {timeout} seconds")
+
+def start_fake_gemini(args):
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "fake_gemini.py"), "--port", str(port), "--latency", str(args.latency),
+        "--error-rate", str(args.error_rate), "--malformed-rate", str(args.malformed_rate), "--duplicate-rate", str(args.duplicate_rate)
+    ], stdout=subprocess.DEVNULL)
+    # Any response, even a 404, means it is listening
+    wait_until_up(f"http://127.0.0.1:{port}/", process)
+    return process, f"http://127.0.0.1:{port}"
+
+def start_app(args, gemini_url, directory):
+    port = free_port()
+    env = {
+        **os.environ, "PYTHONPATH": ROOT, "GEMINI_BASE_URL": gemini_url, "GEMINI_API_KEY": "fake-key",
+        "FLASK_SECRET_KEY": "loadtest", "STREAMING_TESTS": "1" if args.streaming else "0",
+        "BANK_REFILL_ENABLED": "1" if args.bank_refill else "0"
+    }
+    if args.hash_method:
+        env["PASSWORD_HASH_METHOD"] = args.hash_method
+    if args.server == "gunicorn":
+        # Through gunicorn.conf.py like a deployment, which also sizes the API pools for gevent workers
+        env.update({
+            "GUNICORN_WORKER_CLASS": args.worker_class, "WEB_CONCURRENCY": str(args.workers),
+            "GUNICORN_THREADS": str(args.threads), "GUNICORN_WORKER_CONNECTIONS": str(args.connections)
+        })
+        command = [
+            sys.executable, "-m", "gunicorn", "app:app", "--config", os.path.join(ROOT, "gunicorn.conf.py"),
+            "--bind", f"127.0.0.1:{port}", "--log-level", "warning"
+        ]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port), "--with-threads", "--no-reload", "--no-debugger"]
+    # The database and everything else the app writes relative to its working directory stays in the temporary directory
+    log = open(os.path.join(directory, "app.log"), "w")
+    process = subprocess.Popen(command, cwd=directory, env=env, stdout=log, stderr=subprocess.STDOUT)
+    wait_until_up(f"http://127.0.0.1:{port}/login", process)
+    return process, f"http://127.0.0.1:{port}"
+
+class VirtualUser:
+    def __init__(self, base_url, name, record):
+        self.client = httpx.Client(base_url=base_url, follow_redirects=True, timeout=180)
+        self.name = name
+        self.record = record
+
+    def step(self, name, function):
+        """Time one step, function returns whether the response was what a browser user would expect"""
+        start = time.perf_counter()
+        try:
+            ok = function()
+        except httpx.HTTPError:
+            ok = False
+        self.record(name, time.perf_counter() - start, ok)
+        return ok
+
+    def load_test_page(self, response):
+        """Question count of a test page, reading the stream first when the page is filled in by the browser"""
+        if response.url.path != "/grammar_test":
+            return 0 # Redirected home after a generation error
+        stream_url = re.search(r'data-stream-url="([^"]+)"', response.text)
+        if stream_url:
+            body = self.client.get(html.unescape(stream_url.group(1))).text
+            return 0 if "event: failed" in body else body.count("event: question")
+        return len(set(re.findall(r'name="answers\[(\d+)\]"', response.text)))
+
+    def run(self, flows):
+        password = "loadtest-password"
+        if not self.step("register", lambda: self.client.post("/register", data={
+            "username": self.name, "password": password, "confirm_password": password
+        }).url.path == "/login"):
+            return
+        if not self.step("login", lambda: self.client.post("/login", data={"username": self.name, "password": password}).url.path == "/dashboard"):
+            return
+
+        state = {}
+        for flow in range(flows):
+            # The first test comes from the page itself, later ones from the retake button on the result page
+            request = (lambda: self.client.get("/grammar_test")) if flow == 0 else (lambda: self.client.post("/retake"))
+            def take_test():
+                state["questions"] = self.load_test_page(request())
+                return state["questions"] > 0
+            if not self.step("grammar_test" if flow == 0 else "retake", take_test):
+                continue
+
+            def submit():
+                answers = {f"answers[{i}]": str(random.randrange(4)) for i in range(state["questions"])}
+                state["result"] = self.client.post("/grammar_test", data=answers).text
+                return "data-question=" in state["result"]
+            if not self.step("submit", submit):
+                continue
+
+            card = re.search(r'data-question="([^"]*)"\s+data-choices=\'([^\']*)\'\s+data-correct="([^"]*)"\s+data-explanation="([^"]*)"', state["result"])
+            if card:
+                question, choices, correct, explanation = (html.unescape(value) for value in card.groups())
+                self.step("favorite", lambda: self.client.post("/favorite", json={
+                    "question": question, "choices": json.loads(choices), "correct_answer": correct, "explanation": explanation
+                }).status_code == 200)
+            self.step("favorites", lambda: self.client.get("/favorites").url.path == "/favorites")
+        self.client.close()
+
+def percentile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+def summarize(samples, wall_seconds, capacity):
+    steps = {}
+    for name in STEPS:
+        timings = [seconds * 1000 for step, seconds, ok in samples if step == name]
+        if not timings:
+            continue
+        steps[name] = {
+            "count": len(timings),
+            "errors": sum(1 for step, seconds, ok in samples if step == name and not ok),
+            "p50_ms": round(percentile(timings, 50), 1),
+            "p95_ms": round(percentile(timings, 95), 1),
+            "p99_ms": round(percentile(timings, 99), 1)
+        }
+    # Little's law: average requests in flight = arrival rate x time in the system
+    busy = sum(seconds for step, seconds, ok in samples) / wall_seconds
+    return {
+        "steps": steps,
+        "wall_seconds": round(wall_seconds, 2),
+        "steps_per_second": round(len(samples) / wall_seconds, 2),
+        "tests_per_minute": round(sum(1 for step, seconds, ok in samples if step == "submit" and ok) / wall_seconds * 60, 1),
+        "busy_slots": round(busy, 2),
+        "saturation": round(busy / capacity, 2) if capacity else None
+    }
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip())
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def previous_result(config):
+    """The last saved run with the same configuration, to compare against"""
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("config") == config:
+                previous = record
+    return previous
+
+def print_report(result, previous):
+    print(f"\n{'step':<14} {'count':>6} {'errors':>7} {'p50':>10} {'p95':>10} {'p99':>10}" + (f" {'p95 before':>12}" if previous else ""))
+    for name, step in result["steps"].items():
+        line = f"{name:<14} {step['count']:>6} {step['errors']:>7} {step['p50_ms']:>7.0f} ms {step['p95_ms']:>7.0f} ms {step['p99_ms']:>7.0f} ms"
+        before = previous and previous["steps"].get(name)
+        if before:
+            line += f" {before['p95_ms']:>9.0f} ms"
+        print(line)
+    # Above 100% requests are waiting for a free worker thread or connection
+    saturation = f", saturation {result['saturation']:.0%} of worker slots" if result["saturation"] is not None else ""
+    print(f"\n{result['steps_per_second']} steps/s, {result['tests_per_minute']} tests/minute over {result['wall_seconds']} s, "
+          f"{result['busy_slots']} requests in flight on average{saturation}")
+    if previous:
+        print(f"Compared with {previous['commit']} from {previous['date']}: "
+              f"{previous['steps_per_second']} steps/s, {previous['tests_per_minute']} tests/minute")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=("dev", "gunicorn"), default="dev")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per gthread worker")
+    parser.add_argument("--worker-class", choices=("gthread", "gevent"), default="gthread", help="gunicorn worker class")
+    parser.add_argument("--connections", type=int, default=1000, help="Concurrent requests per gevent worker")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--flows", type=int, default=3, help="Tests each user takes after logging in")
+    parser.add_argument("--ramp", type=float, default=2.0, help="Seconds over which the users start")
+    parser.add_argument("--latency", type=float, default=1.5, help="Fake Gemini latency per call in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--streaming", action="store_true", help="Load tests through the streaming endpoint like the browser does")
+    parser.add_argument("--bank-refill", action="store_true", help="Run the question bank refill worker during the test")
+    parser.add_argument("--hash-method", help="PASSWORD_HASH_METHOD, a cheaper one keeps registering and logging in hundreds of users from dominating")
+    parser.add_argument("--no-save", action="store_true", help="Don't append the results to benchmarks/results/loadtest.jsonl")
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key != "no_save"}
+    # Options left at what earlier runs used are left out, so their results still compare
+    if args.server == "dev" or args.worker_class == "gthread":
+        config.pop("worker_class"), config.pop("connections")
+    if args.server == "dev" or args.worker_class == "gevent":
+        config.pop("threads")
+    if args.server == "dev":
+        config.pop("workers")
+    if not args.hash_method:
+        config.pop("hash_method")
+    capacity = None
+    if args.server == "gunicorn":
+        capacity = args.workers * (args.connections if args.worker_class == "gevent" else args.threads)
+
+    samples = []
+    lock = threading.Lock()
+    def record(step, seconds, ok):
+        with lock:
+            samples.append((step, seconds, ok))
+
+    with tempfile.TemporaryDirectory() as directory:
+        gemini, gemini_url = start_fake_gemini(args)
+        app, app_url = start_app(args, gemini_url, directory)
+        try:
+            server = f"gunicorn {args.worker_class}" if args.server == "gunicorn" else args.server
+            print(f"{args.users} users x {args.flows} tests against the {server} server at {app_url}, "
+                  f"Gemini latency {args.latency}s, errors {args.error_rate:.0%}, malformed {args.malformed_rate:.0%}, duplicates {args.duplicate_rate:.0%}")
+            run_id = f"{int(time.time())}{random.randrange(1000)}"
+            users = [VirtualUser(app_url, f"load{run_id}_{n}", record) for n in range(args.users)]
+            threads = []
+            start = time.perf_counter()
+            for n, user in enumerate(users):
+                threads.append(threading.Thread(target=user.run, args=(args.flows,)))
+                threads[-1].start()
+                time.sleep(args.ramp / args.users)
+            for thread in threads:
+                thread.join()
+            wall_seconds = time.perf_counter() - start
+        finally:
+            app.terminate()
+            gemini.terminate()
+            app.wait()
+            gemini.wait()
+
+    result = summarize(samples, wall_seconds, capacity)
+    previous = previous_result(config)
+    print_report(result, previous)
+    if not args.no_save:
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        record = {
+            "commit": git_commit(), "date": time.strftime("%Y-%m-%d %H:%M:%S"), "host": platform.node(),
+            "cpus": os.cpu_count(), "config": config, **result
+        }
+        with open(RESULTS_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"Saved to {os.path.relpath(RESULTS_FILE)}")
@@ -0,0 +1,112 @@
+from flask import g
+from contextlib import contextmanager
+import os, sqlite3, threading
+from metrics import timer, METRICS_ENABLED
+
+# Configuration Constants
+BUSY_TIMEOUT_SECONDS = 5 # Wait this long for a lock held by another worker instead of failing with "database is locked"
+CACHED_STATEMENTS = 256 # Prepared statements kept per connection
+MAX_POOLED_CONNECTIONS = int(os.getenv("MAX_POOLED_CONNECTIONS", 8)) # Idle connections kept open per process
+
+# Setup database connection, create database file if it doesn't exist
+db_file = "database.db"
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports the time spent in execute calls as the sqlite stage"""
+    def execute(self, *args):
+        with timer("sqlite"):
+            return super().execute(*args)
+
+    def executemany(self, *args):
+        with timer("sqlite"):
+            return super().executemany(*args)
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose statements are timed, only used when metrics are enabled so it costs nothing otherwise"""
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        with timer("sqlite"):
+            return super().execute(*args)
+
+    def executemany(self, *args):
+        with timer("sqlite"):
+            return super().executemany(*args)
+
+_pool = []
+_pool_pid = None
+_lock = threading.Lock()
+
+def connect():
+    """
+    Open a tuned connection: WAL journal so readers don't block the writer,
+    synchronous=NORMAL (safe with WAL) and a busy timeout for concurrent gunicorn workers.
+    """
+    conn = sqlite3.connect(
+        db_file, timeout=BUSY_TIMEOUT_SECONDS, cached_statements=CACHED_STATEMENTS, check_same_thread=False,
+        factory=TimedConnection if METRICS_ENABLED else sqlite3.Connection
+    )
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_SECONDS * 1000}")
+    return conn
+
+def acquire():
+    """Take an idle connection from this process' pool, or open a new one"""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool_pid != os.getpid():
+            # Connections must never be shared with a forked parent
+            _pool = []
+            _pool_pid = os.getpid()
+        if _pool:
+            return _pool.pop()
+    return connect()
+
+def release(conn):
+    """Return a connection to the pool, keeping its prepared statement cache warm for the next request"""
+    if conn.in_transaction:
+        conn.rollback()
+    with _lock:
+        if _pool_pid == os.getpid() and len(_pool) < MAX_POOLED_CONNECTIONS:
+            _pool.append(conn)
+            return
+    conn.close()
+
+def get_db():
+    """Return the connection for the current request, borrowed on first use and given back at teardown"""
+    if "db" not in g:
+        g.db = acquire()
+    return g.db
+
+def close_db(exception=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        release(conn)
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection outside of a request, e.g. in background workers; the block runs in one transaction"""
+    conn = acquire()
+    try:
+        with conn:
+            yield conn
+    finally:
+        release(conn)
+
+def init_db(app):
+    """Create the app tables if they don't exist and give connections back to the pool after each request"""
+    with connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL UNIQUE,
+                password TEXT NOT NULL,
+                streak INTEGER DEFAULT 0,
+                last_test_date TEXT DEFAULT NULL,
+                grammar_history TEXT DEFAULT '[]',
+                reading_history TEXT DEFAULT '[]'
+            )
+        """)
+    app.teardown_appcontext(close_db)
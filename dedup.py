@@ -0,0 +1,235 @@
+from dotenv import load_dotenv, find_dotenv
+import os, re, sqlite3, threading, time, random, hashlib
+from array import array
+from collections import OrderedDict, defaultdict
+from db import connection
+from metrics import timer
+
+# Find and load environment variables
+_ = load_dotenv(find_dotenv())
+
+# Configuration Constants
+MAX_GRAMMAR_HISTORY_QUESTIONS = 20000 # Max grammar questions to remember per history scope
+MAX_READING_HISTORY_QUESTIONS = 5000 # Max reading passages to remember per history scope
+MAX_GLOBAL_HISTORY_QUESTIONS = 100000 # Max items to remember across all users
+MAX_CACHED_INDEXES = 256 # Max history indexes kept in memory per process
+NUM_PERMUTATIONS = 32 # MinHash signature length
+BANDS = 8 # LSH bands, NUM_PERMUTATIONS must be divisible by BANDS
+SHINGLE_SIZE = 3 # Words per shingle
+NEAR_DUPLICATE_THRESHOLD = 0.8 # Estimated Jaccard similarity above which two texts count as the same item
+GLOBAL_SCOPE = "*" # History scope shared by all users
+GUEST_HISTORY_TTL_SECONDS = int(os.getenv("GUEST_HISTORY_TTL", 30 * 24 * 60 * 60)) # Guest history is deleted this long after it was served
+PURGE_INTERVAL_SECONDS = 600 # How often each process deletes expired guest history
+SYNC_INTERVAL_SECONDS = 2 # Pick up history other workers served at most this often per scope
+SYNC_OVERLAP_SECONDS = 5 # Each sync re-reads this much history, for rows another worker committed after a later one
+
+HISTORY_LIMITS = {
+    "grammar": MAX_GRAMMAR_HISTORY_QUESTIONS,
+    "reading": MAX_READING_HISTORY_QUESTIONS
+}
+
+# MinHash permutations, seeded so signatures stay comparable across processes and restarts
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20250101)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+_ROWS = NUM_PERMUTATIONS // BANDS
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+_last_purge = 0
+
+def init_dedup():
+    """Create the fingerprint table if it doesn't exist, safe to call on every startup"""
+    with connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS served_fingerprints (
+                scope TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (scope, kind, fingerprint)
+            ) WITHOUT ROWID
+        """)
+        # Indexes cached in a worker pick up what other workers served by reading only the newer rows
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_served_fingerprints_created ON served_fingerprints (scope, kind, created_at)")
+
+def normalize(text):
+    """Lowercase, collapse blanks like '______' into one token, drop punctuation and extra whitespace"""
+    text = text.lower()
+    text = re.sub(r"_+", " _ ", text)
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+def fingerprint(text):
+    """Return (exact hash, MinHash signature) of the normalized text"""
+    normalized = normalize(text)
+    exact = hashlib.blake2b(normalized.encode("utf-8"), digest_size=12).hexdigest()
+
+    words = normalized.split()
+    if len(words) <= SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hashes = [_hash64(shingle) & _PRIME for shingle in shingles]
+    signature = tuple(min((a * x + b) % _PRIME for x in hashes) for a, b in _PERMUTATIONS)
+    return exact, signature
+
+def _band_keys(signature):
+    return [(band,) + signature[band * _ROWS:(band + 1) * _ROWS] for band in range(BANDS)]
+
+class DedupIndex:
+    """In-memory exact hash set plus LSH buckets over MinHash signatures for one history scope"""
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.signatures = OrderedDict() # fingerprint -> signature, oldest first
+        self.buckets = defaultdict(set) # band key -> fingerprints
+        self.synced_to = None # created_at of the newest row read from the database
+        self.synced_at = 0 # time.monotonic() of the last sync
+
+    def contains(self, exact, signature):
+        if exact in self.signatures:
+            return True
+        # Only compare against items sharing at least one band, then confirm with the estimated similarity
+        candidates = set()
+        for key in _band_keys(signature):
+            candidates.update(self.buckets.get(key, ()))
+        for candidate in candidates:
+            other = self.signatures[candidate]
+            matches = sum(1 for a, b in zip(signature, other) if a == b)
+            if matches / NUM_PERMUTATIONS >= NEAR_DUPLICATE_THRESHOLD:
+                return True
+        return False
+
+    def add(self, exact, signature):
+        """Add a fingerprint, return the fingerprints evicted to stay under max_items"""
+        if exact in self.signatures:
+            return []
+        self.signatures[exact] = signature
+        for key in _band_keys(signature):
+            self.buckets[key].add(exact)
+
+        evicted = []
+        while len(self.signatures) > self.max_items:
+            old_exact, old_signature = self.signatures.popitem(last=False)
+            for key in _band_keys(old_signature):
+                bucket = self.buckets[key]
+                bucket.discard(old_exact)
+                if not bucket:
+                    del self.buckets[key]
+            evicted.append(old_exact)
+        return evicted
+
+def _sync(index, scope, kind):
+    """
+    Add the rows written since the last sync, by this worker or any other one, all of them on first use.
+    Runs at most every SYNC_INTERVAL_SECONDS, the many lookups of one test share a sync.
+    """
+    now = time.monotonic()
+    with _lock:
+        if index.synced_to is not None and now - index.synced_at < SYNC_INTERVAL_SECONDS:
+            return
+        index.synced_at = now
+        after = index.synced_to - SYNC_OVERLAP_SECONDS if index.synced_to is not None else None
+    try:
+        with connection() as conn:
+            if after is None:
+                rows = conn.execute(
+                    "SELECT fingerprint, signature, created_at FROM served_fingerprints WHERE scope = ? AND kind = ? ORDER BY created_at",
+                    (scope, kind)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT fingerprint, signature, created_at FROM served_fingerprints WHERE scope = ? AND kind = ? AND created_at > ? ORDER BY created_at",
+                    (scope, kind, after)
+                ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return
+
+    with _lock:
+        for exact, packed, _ in rows:
+            index.add(exact, tuple(array("Q", packed)))
+        if rows:
+            index.synced_to = max(index.synced_to or 0, rows[-1][2])
+        elif index.synced_to is None:
+            index.synced_to = 0
+
+def _get_index(scope, kind):
+    """
+    The index for a scope, kept in memory for the most recently used scopes and brought up to date
+    with the database every SYNC_INTERVAL_SECONDS, so history served by other gunicorn workers counts too
+    """
+    with _lock:
+        index = _indexes.get((scope, kind))
+        if index is not None:
+            _indexes.move_to_end((scope, kind))
+    if index is None:
+        max_items = MAX_GLOBAL_HISTORY_QUESTIONS if scope == GLOBAL_SCOPE else HISTORY_LIMITS[kind]
+        index = DedupIndex(max_items)
+        with _lock:
+            index = _indexes.setdefault((scope, kind), index)
+            while len(_indexes) > MAX_CACHED_INDEXES:
+                _indexes.popitem(last=False)
+    _sync(index, scope, kind)
+    return index
+
+def is_seen(scope, kind, text):
+    """Check if the text, or a near-duplicate of it, was already served in this scope"""
+    with timer("dedup"):
+        exact, signature = fingerprint(text)
+        index = _get_index(scope, kind)
+        with _lock:
+            return index.contains(exact, signature)
+
+def mark_seen(scope, kind, texts):
+    """Remember texts as served in this scope, in memory and in the database"""
+    if not texts:
+        return
+    index = _get_index(scope, kind)
+    rows = []
+    evicted = []
+    now = time.time()
+    with timer("dedup"), _lock:
+        for text in texts:
+            exact, signature = fingerprint(text)
+            evicted.extend(index.add(exact, signature))
+            rows.append((scope, kind, exact, array("Q", signature).tobytes(), now))
+
+    try:
+        with connection() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO served_fingerprints (scope, kind, fingerprint, signature, created_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.executemany(
+                "DELETE FROM served_fingerprints WHERE scope = ? AND kind = ? AND fingerprint = ?",
+                [(scope, kind, exact) for exact in evicted]
+            )
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+    purge_expired()
+
+def purge_expired():
+    """
+    Delete guest history older than GUEST_HISTORY_TTL_SECONDS, at most once per PURGE_INTERVAL_SECONDS per process.
+    Every guest session gets its own scope, so abandoned ones would otherwise stay forever.
+    """
+    global _last_purge
+    now = time.time()
+    with _lock:
+        if now - _last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        _last_purge = now
+    try:
+        with connection() as conn:
+            # A range on the scope prefix (";" sorts right after ":"), so only the guest rows of the index are walked
+            conn.execute(
+                "DELETE FROM served_fingerprints WHERE scope >= 'guest:' AND scope < 'guest;' AND created_at < ?",
+                (now - GUEST_HISTORY_TTL_SECONDS,)
+            )
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
@@ -0,0 +1,252 @@
+from dotenv import load_dotenv, find_dotenv
+from flask import session
+from collections import namedtuple
+from concurrent.futures import wait, FIRST_COMPLETED
+from functools import partial
+import os, time
+from prompts import exam_text_completion_prompt, exam_reading_prompt, exam_documents, exam_passage_line, exam_json_instruction
+from helpers import generation_pool, get_response, response_schema, fetch_grammar_questions, draw_from_bank, cache_key, history_scope, start_streamed_test, get_current_test, PROMPTS, STRUCTURED_OUTPUT, GENERATION_TIMEOUT_SECONDS, REQUIRED_GRAMMAR_QUESTIONS
+from models import ExamChunk, ReadingPassage, decode_items, practice_set, score_answers, NO_QUESTION
+from test_store import load_test, save_test
+from question_bank import add_to_bank, return_to_bank, item_text
+from response_cache import response_cache
+from dedup import is_seen, mark_seen
+from rate_limit import allow_call, allow_exam, single_flight_stream
+from attempts import record_attempt
+from metrics import inc, log
+
+# Find and load environment variables
+_ = load_dotenv(find_dotenv())
+
+# Configuration Constants
+EXAM_CONCURRENCY = int(os.getenv("EXAM_CONCURRENCY", 6)) # Max API calls in flight for one exam
+EXAM_CHUNK_ATTEMPTS = 2 # Calls made for one chunk before it is left empty
+
+# part, questions of every passage (a Part 5 chunk is one batch of grammar questions), texts per Part 7 passage
+ChunkSpec = namedtuple("ChunkSpec", "part counts documents")
+
+# The 100 questions of the TOEIC Reading test in the order they are shown: 30 in Part 5, 16 in Part 6,
+# 29 on single and 25 on double and triple passages in Part 7. Each chunk is about one reading test's worth
+# of output, so all of them can be generated at the same time and none runs into the output limit
+EXAM_LAYOUT = [
+    *[ChunkSpec(5, (REQUIRED_GRAMMAR_QUESTIONS,), 0)] * 3,
+    *[ChunkSpec(6, (4, 4), 1)] * 2,
+    ChunkSpec(7, (2, 2, 3, 3), 1),
+    ChunkSpec(7, (3, 3, 4), 1),
+    ChunkSpec(7, (2, 3, 4), 1),
+    ChunkSpec(7, (5, 5), 2),
+    ChunkSpec(7, (5, 5), 3),
+    ChunkSpec(7, (5,), 3)
+]
+CHUNK_SIZES = [sum(spec.counts) for spec in EXAM_LAYOUT]
+CHUNK_OFFSETS = [sum(CHUNK_SIZES[:number]) for number in range(len(EXAM_LAYOUT))] # Index of the first question of every chunk
+EXAM_QUESTIONS = sum(CHUNK_SIZES)
+PART_RANGES = {
+    part: (min(CHUNK_OFFSETS[n] for n, spec in enumerate(EXAM_LAYOUT) if spec.part == part),
+           max(CHUNK_OFFSETS[n] + CHUNK_SIZES[n] for n, spec in enumerate(EXAM_LAYOUT) if spec.part == part))
+    for part in (5, 6, 7)
+}
+
+def chunk_prompt(spec):
+    passages = "\n".join(exam_passage_line.format(number=number, questions=count) for number, count in enumerate(spec.counts, 1))
+    if spec.part == 6:
+        prompt = exam_text_completion_prompt.format(count=len(spec.counts), passages=passages)
+    else:
+        prompt = exam_reading_prompt.format(count=len(spec.counts), documents=exam_documents[spec.documents], passages=passages)
+    return prompt if STRUCTURED_OUTPUT else prompt + exam_json_instruction
+
+def fetch_exam_passages(spec):
+    """
+    Generate the passages of one Part 6/7 chunk, each cut to the number of questions the layout gives it.
+    A response with fewer passages or questions than asked for is an error, the chunk is then generated again.
+    """
+    passages = decode_items(get_response(chunk_prompt(spec), response_schema("reading")), "reading")
+    if len(passages) < len(spec.counts) or any(len(passage.questions) < count for passage, count in zip(passages, spec.counts)):
+        raise ValueError(f"Part {spec.part} response has fewer questions than the {sum(spec.counts)} asked for")
+    return [ReadingPassage(passage.passage, passage.questions[:count]) for passage, count in zip(passages, spec.counts)]
+
+def exam_sections(items=None):
+    """Every chunk of the exam with where its questions start, chunk is None while it is still being generated"""
+    return [
+        {"number": number, "part": spec.part, "offset": CHUNK_OFFSETS[number], "size": CHUNK_SIZES[number], "chunk": items[number] if items else None}
+        for number, spec in enumerate(EXAM_LAYOUT)
+    ]
+
+def stream_new_exam(history, user_id):
+    """
+    Yield (chunk number, ExamChunk) for every chunk of a new exam as soon as it is ready, in whatever order they finish.
+    Part 5 is cut from the question bank and the response cache first, like a grammar test. The rest is generated
+    with up to EXAM_CONCURRENCY calls at a time, EXAM_CHUNK_ATTEMPTS per chunk. A chunk that still fails is yielded
+    empty at the end, so the chunks around it keep their question numbers.
+    """
+    if not allow_exam(history):
+        raise ValueError("Too many exams started, please try again later")
+
+    part5 = [number for number, spec in enumerate(EXAM_LAYOUT) if spec.part == 5]
+    required = len(part5) * REQUIRED_GRAMMAR_QUESTIONS
+    skip = lambda q: is_seen(history, "grammar", item_text("grammar", q))
+    grammar = draw_from_bank("grammar", required, skip, user_id)
+    if len(grammar) < required:
+        grammar += response_cache.take(cache_key(PROMPTS["grammar"]), required - len(grammar), skip)
+    mark_seen(history, "grammar", [item_text("grammar", q) for q in grammar])
+
+    pending = list(range(len(EXAM_LAYOUT))) # Chunks not yielded yet, in exam order
+    attempts = dict.fromkeys(pending, 0)
+    started = {} # future -> (chunk number, start time)
+    unsent = [] # (chunk number, ExamChunk) ready but not yielded yet
+    last_error = None
+    generated = 0
+
+    def cut_grammar():
+        """Part 5 chunks still pending that the grammar questions collected so far can fill, in exam order"""
+        ready = []
+        for number in [n for n in pending if n in part5]:
+            if len(grammar) < REQUIRED_GRAMMAR_QUESTIONS:
+                break
+            ready.append((number, ExamChunk(5, CHUNK_SIZES[number], questions=grammar[:REQUIRED_GRAMMAR_QUESTIONS])))
+            del grammar[:REQUIRED_GRAMMAR_QUESTIONS]
+            pending.remove(number)
+        return ready
+
+    def bank_leftover(future):
+        if not future.cancelled() and future.exception() is None:
+            add_to_bank("grammar", future.result())
+
+    def submit_more():
+        for number in pending:
+            if len(started) >= EXAM_CONCURRENCY:
+                return
+            if attempts[number] >= EXAM_CHUNK_ATTEMPTS or any(n == number for n, _ in started.values()):
+                continue
+            # The exam as a whole was paid for above, its calls only count against the limit of the whole app
+            if not allow_call(history, "exam", per_user=False):
+                return
+            if attempts[number]:
+                inc("generation_retries_total", kind="exam")
+            spec = EXAM_LAYOUT[number]
+            fetch = fetch_grammar_questions if spec.part == 5 else partial(fetch_exam_passages, spec)
+            started[generation_pool.submit(fetch)] = (number, time.monotonic())
+            attempts[number] += 1
+
+    try:
+        unsent += cut_grammar()
+        while unsent:
+            number, chunk = unsent.pop(0)
+            generated += 1
+            yield number, chunk
+
+        submit_more()
+        while started:
+            timeout = min(start for _, start in started.values()) + GENERATION_TIMEOUT_SECONDS - time.monotonic()
+            done, _ = wait(list(started), timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                number, _ = started.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    log("generation_error", kind="exam", part=EXAM_LAYOUT[number].part, error=e)
+                    last_error = e
+                    continue
+                if EXAM_LAYOUT[number].part == 5:
+                    # Any batch can fill any Part 5 chunk, questions served before are skipped like in a grammar test
+                    for q in result:
+                        if skip(q):
+                            inc("duplicates_rejected_total", kind="grammar", scope="user")
+                        else:
+                            grammar.append(q)
+                            mark_seen(history, "grammar", [item_text("grammar", q)])
+                    ready = cut_grammar()
+                elif number in pending:
+                    pending.remove(number)
+                    ready = [(number, ExamChunk(EXAM_LAYOUT[number].part, CHUNK_SIZES[number], passages=result))]
+                else:
+                    ready = []
+                unsent += ready
+                while unsent:
+                    number, chunk = unsent.pop(0)
+                    generated += 1
+                    yield number, chunk
+
+            # Give up on calls that ran past the timeout, they count as a failed attempt
+            # One still queued in the shared pool is cancelled, it would otherwise spend an API call nobody waits for
+            now = time.monotonic()
+            for future, (number, start) in list(started.items()):
+                if now - start >= GENERATION_TIMEOUT_SECONDS:
+                    log("generation_timeout", kind="exam", seconds=GENERATION_TIMEOUT_SECONDS)
+                    inc("generation_timeouts_total", kind="exam")
+                    del started[future]
+                    if not future.cancel() and EXAM_LAYOUT[number].part == 5:
+                        future.add_done_callback(bank_leftover)
+
+            submit_more()
+
+        if not generated:
+            raise last_error or ValueError("Too many new tests requested, please try again in a minute")
+        for number in list(pending):
+            log("exam_chunk_failed", part=EXAM_LAYOUT[number].part, attempts=attempts[number])
+            inc("exam_chunks_failed_total", part=EXAM_LAYOUT[number].part)
+            yield number, ExamChunk(EXAM_LAYOUT[number].part, CHUNK_SIZES[number])
+    finally:
+        # Runs on completion, on error and when the user leaves mid-way: calls still running feed the question bank
+        for future, (number, _) in started.items():
+            if not future.cancel() and EXAM_LAYOUT[number].part == 5:
+                future.add_done_callback(bank_leftover)
+        # Unused Part 5 questions may have come from the bank, add_to_bank would drop those as already banked
+        return_to_bank("grammar", grammar + [q for _, chunk in unsent for q in chunk.questions])
+
+def stream_exam(test_id):
+    """
+    Yield (chunk number, ExamChunk) for every chunk of the exam as soon as it is ready.
+    When done the test store holds the exam under test_id, answer key included.
+    """
+    current_exam = load_test(test_id)
+    if current_exam:
+        yield from enumerate(current_exam.items)
+        return
+
+    # Another tab of the same user generating an exam right now shares its chunks, each tab stores its own copy
+    history = history_scope()
+    user_id = session.get("user_id")
+    chunks = [None] * len(EXAM_LAYOUT)
+    for number, chunk in single_flight_stream(("exam", history), lambda: stream_new_exam(history, user_id)):
+        chunks[number] = chunk
+        yield number, chunk
+    if not any(chunks):
+        raise ValueError("Failed to generate any valid questions after multiple attempts")
+
+    # A tab that joined a generation the other tab abandoned keeps the chunks that were ready
+    save_test("exam", [chunk or ExamChunk(spec.part, CHUNK_SIZES[number]) for number, (chunk, spec) in enumerate(zip(chunks, EXAM_LAYOUT))], test_id)
+
+def generate_exam():
+    """The user's exam in progress, or a new one generated in full before the page is shown, without streaming"""
+    current_exam = get_current_test("exam")
+    if current_exam and not session.get("exam_test_completed"):
+        return current_exam
+    start_streamed_test("exam")
+    for _ in stream_exam(session["current_exam_test_id"]):
+        pass
+    return get_current_test("exam")
+
+def score_exam(test, answers):
+    """
+    The score and number of questions of every part of a submitted exam. Each part is a slice of the answer key
+    compared with the same slice of the answers in one C-level pass, questions that couldn't be generated don't count.
+    """
+    parts = {}
+    for part, (start, end) in PART_RANGES.items():
+        key = test.answer_key[start:end]
+        parts[part] = {"score": score_answers(key, answers[start:end]), "total": len(key) - key.count(NO_QUESTION)}
+    return parts
+
+def record_exam(conn, user_id, test, answers):
+    """Log Part 5 with the grammar tests and Parts 6 and 7 with the reading tests, so the exam counts toward progress"""
+    for kind, field, parts in (("grammar", "questions", (5,)), ("reading", "passages", (6, 7))):
+        items = []
+        kind_answers = []
+        for chunk, offset in zip(test.items, CHUNK_OFFSETS):
+            if chunk.part in parts and getattr(chunk, field):
+                items += getattr(chunk, field)
+                kind_answers.append(answers[offset:offset + chunk.size])
+        if items:
+            record_attempt(conn, user_id, kind, practice_set(kind, items), b"".join(kind_answers))
@@ -0,0 +1,176 @@
+"""
+A local stand-in for the Gemini generateContent endpoint, used by benchmarks and offline runs.
+
+Run it with `python fake_gemini.py --port 8765` and start the app with GEMINI_BASE_URL=http://127.0.0.1:8765
+Faults can be mixed in: --error-rate answers with a 503, --malformed-rate cuts the JSON off part way,
+--duplicate-rate repeats an earlier response so the dedup paths get exercised.
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import deque
+import argparse, json, random, re, threading, time
+from prompts import GRAMMAR_CONCEPTS, READING_QUESTION_TYPES
+
+VOCABULARY = """
+account agenda analyst annual approve arrange assign audit branch budget candidate client colleague committee
+conference confirm contract customer deadline delivery department deposit director discount document employee
+estimate expand facility feedback finance forecast headquarters hire inventory invoice itinerary launch lease
+manager marketing meeting merger negotiate office order organize payment policy proposal purchase quarter receipt
+recruit refund register reimburse renovate report request reservation revenue review salary schedule seminar
+shipment shipping staff submit supervisor supplier survey training transfer update vendor warehouse workshop
+""".split()
+
+def random_sentence(words=14):
+    return " ".join(random.choice(VOCABULARY) for _ in range(words)).capitalize() + "."
+
+def make_question():
+    choices = random.sample(VOCABULARY, 4)
+    return {
+        "question": random_sentence(6) + " __________ " + random_sentence(6),
+        "choices": choices,
+        "correct_answer": random.choice(choices),
+        "concept": random.choice(GRAMMAR_CONCEPTS),
+        "explanation": "Giải thích: " + random_sentence(20)
+    }
+
+def make_reading_question():
+    question = make_question()
+    del question["concept"]
+    question["question_type"] = random.choice(READING_QUESTION_TYPES)
+    return question
+
+def make_grammar_data(count=10):
+    return {"GRAMMAR_DATA": [make_question() for _ in range(count)]}
+
+def make_reading_data(count=3, questions=None):
+    """count passages with 3 questions each, or one passage per entry of questions with that many questions"""
+    return {"READING_DATA": [
+        {"passage": "\n".join(random_sentence(18) for _ in range(6)), "questions": [make_reading_question() for _ in range(number)]}
+        for number in questions or [3] * count
+    ]}
+
+def make_response_text(prompt, config=None):
+    """
+    Answer like the real model does: bare JSON when the request sets a response schema,
+    otherwise a JSON document wrapped in the <json> tag the prompts ask for
+    """
+    config = config or {}
+    schema = json.dumps(config.get("responseSchema", {}))
+    # Mock exam prompts list the number of questions of every passage they ask for
+    questions = [int(number) for number in re.findall(r"^Passage \d+: (\d+) questions$", prompt, re.M)]
+    data = make_reading_data(questions=questions) if "READING_DATA" in prompt or "READING_DATA" in schema else make_grammar_data()
+    if config.get("responseMimeType") == "application/json":
+        return json.dumps(data, ensure_ascii=False)
+    return "<json>\n" + json.dumps(data, ensure_ascii=False) + "\n</json>"
+
+def prompt_text(body):
+    return "".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+
+def prompt_tokens(body):
+    """Rough prompt size in tokens: the prompt, the system instruction and the response schema all count"""
+    system = "".join(part.get("text", "") for part in body.get("systemInstruction", {}).get("parts", []))
+    schema = json.dumps(body.get("generationConfig", {}).get("responseSchema", ""))
+    return (len(prompt_text(body)) + len(system) + len(schema)) // 4
+
+# Recent responses per (kind, format), for --duplicate-rate
+_recent = {}
+_recent_lock = threading.Lock()
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real API
+    disable_nagle_algorithm = True
+    latency = 0.0
+    error_rate = 0.0 # Share of calls answered with a 503
+    malformed_rate = 0.0 # Share of responses cut off part way through the JSON
+    duplicate_rate = 0.0 # Share of responses repeating an earlier one of the same kind
+
+    def response_text(self, body):
+        config = body.get("generationConfig") or {}
+        text = make_response_text(prompt_text(body), config)
+        key = ("READING_DATA" in text[:30], config.get("responseMimeType"))
+        with _recent_lock:
+            recent = _recent.setdefault(key, deque(maxlen=20))
+            if recent and random.random() < self.duplicate_rate:
+                text = random.choice(recent)
+            else:
+                recent.append(text)
+        if random.random() < self.malformed_rate:
+            text = text[:random.randint(len(text) // 4, len(text) - 2)]
+        return text
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if ":generateContent" not in self.path and ":streamGenerateContent" not in self.path:
+            self.send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+            return
+        if random.random() < self.error_rate:
+            time.sleep(self.latency / 4)
+            self.send_json(503, {"error": {"code": 503, "message": "The model is overloaded", "status": "UNAVAILABLE"}})
+            return
+        if ":streamGenerateContent" in self.path:
+            self.send_stream(self.response_text(body))
+            return
+
+        time.sleep(self.latency)
+        text = self.response_text(body)
+        self.send_json(200, {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": prompt_tokens(body), "candidatesTokenCount": len(text) // 4}
+        })
+
+    def send_stream(self, text, pieces=20):
+        """Send the text as server-sent events spread over the configured latency, like streamGenerateContent?alt=sse"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        size = max(1, len(text) // pieces + 1)
+        for start in range(0, len(text), size):
+            time.sleep(self.latency / pieces)
+            event = {"candidates": [{"content": {"parts": [{"text": text[start:start + size]}], "role": "model"}, "index": 0}]}
+            data = f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass # The app stops reading a stream once it has enough questions
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port=0, latency=0.0, error_rate=0.0, malformed_rate=0.0, duplicate_rate=0.0):
+    """Start the fake server in a background thread, return (server, base_url)"""
+    handler = type("ConfiguredHandler", (FakeGeminiHandler,), {
+        "latency": latency, "error_rate": error_rate, "malformed_rate": malformed_rate, "duplicate_rate": duplicate_rate
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Gemini server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering each call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls that fail with a 503")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of responses with truncated JSON")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="Share of responses repeating an earlier one")
+    args = parser.parse_args()
+    server, base_url = start_server(args.port, args.latency, args.error_rate, args.malformed_rate, args.duplicate_rate)
+    print(f"Fake Gemini listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,199 @@
+import ast, json, hashlib
+from db import connection
+
+# Configuration Constants
+FAVORITES_PAGE_SIZE = 20 # Favorites per page, the favorites page loads more as the user scrolls
+CONTENT_HASH_SIZE = 20 # Bytes of the shared question key, other than question_hash() so old keys can be told apart
+
+def init_favorites():
+    """
+    Create the shared question table and the favorites join table if they don't exist,
+    and move rows from the old per-user favorites table into them, safe to call on every startup
+    """
+    with connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                hash TEXT NOT NULL UNIQUE,
+                question TEXT NOT NULL,
+                choices TEXT NOT NULL,
+                correct_answer TEXT NOT NULL,
+                explanation TEXT NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS favorite_questions (
+                user_id INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                PRIMARY KEY (user_id, question_id),
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (question_id) REFERENCES questions (id)
+            ) WITHOUT ROWID
+        """)
+
+        legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'favorites'").fetchone()
+        if legacy:
+            rows = conn.execute("SELECT user_id, question, choices, correct_answer, explanation FROM favorites ORDER BY id").fetchall()
+            for user_id, question, choices, correct_answer, explanation in rows:
+                choices = parse_choices(choices) or _literal_choices(choices)
+                question_id = _get_or_create_question(conn, question, choices, correct_answer, explanation)
+                conn.execute("INSERT OR IGNORE INTO favorite_questions (user_id, question_id) VALUES (?, ?)", (user_id, question_id))
+            conn.execute("DROP TABLE favorites")
+            print(f"Migrated {len(rows)} favorites to the shared question table")
+
+        # Choices used to be saved as Python repr strings, convert them to JSON once
+        rows = conn.execute("SELECT id, choices FROM questions WHERE json_valid(choices) = 0").fetchall()
+        for question_id, choices in rows:
+            conn.execute("UPDATE questions SET choices = ? WHERE id = ?", (encode_choices(_literal_choices(choices)), question_id))
+        if rows:
+            print(f"Converted choices of {len(rows)} questions to JSON")
+
+        # Rows used to be keyed by question_hash(), which left out the choices and explanation, key them by all of it
+        rows = conn.execute("SELECT id, question, choices, correct_answer, explanation FROM questions WHERE length(hash) != ?", (CONTENT_HASH_SIZE * 2,)).fetchall()
+        for question_id, question, choices, correct_answer, explanation in rows:
+            conn.execute("UPDATE questions SET hash = ? WHERE id = ?", (content_hash(question, json.loads(choices), correct_answer, explanation), question_id))
+        if rows:
+            print(f"Rehashed {len(rows)} shared questions by their full content")
+
+        # Full-text index over the shared questions, kept in sync by triggers and filled once when first created
+        has_index = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'questions_fts'").fetchone()
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(question, explanation, content='questions', content_rowid='id')")
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+                INSERT INTO questions_fts (rowid, question, explanation) VALUES (new.id, new.question, new.explanation);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN
+                INSERT INTO questions_fts (questions_fts, rowid, question, explanation) VALUES ('delete', old.id, old.question, old.explanation);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF question, explanation ON questions BEGIN
+                INSERT INTO questions_fts (questions_fts, rowid, question, explanation) VALUES ('delete', old.id, old.question, old.explanation);
+                INSERT INTO questions_fts (rowid, question, explanation) VALUES (new.id, new.question, new.explanation);
+            END
+        """)
+        if not has_index:
+            conn.execute("INSERT INTO questions_fts (questions_fts) VALUES ('rebuild')")
+
+def question_hash(question, correct_answer):
+    """Content address of a question, the question text and its answer identify it regardless of how choices were serialized"""
+    raw = f"{question.strip()}\x1f{correct_answer.strip()}"
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+def content_hash(question, choices, correct_answer, explanation):
+    """Key of a shared question, everything shown on its card so two versions of a question never share a row"""
+    raw = encode_choices([question.strip(), *choices, correct_answer.strip(), explanation.strip()])
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=CONTENT_HASH_SIZE).hexdigest()
+
+def _literal_choices(text):
+    """Parse a legacy Python repr choices string, only used by the one-time migration"""
+    try:
+        choices = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        print(f"Unreadable choices, saving as empty: {text!r}")
+        return []
+    return choices if isinstance(choices, list) else []
+
+def parse_choices(choices):
+    """Accept choices as a list or a JSON array string, return them as a list of strings or None if invalid"""
+    if isinstance(choices, str):
+        try:
+            choices = json.loads(choices)
+        except ValueError:
+            return None
+    if not isinstance(choices, list) or not all(isinstance(choice, str) for choice in choices):
+        return None
+    return choices
+
+def encode_choices(choices):
+    return json.dumps(choices, ensure_ascii=False, separators=(",", ":"))
+
+def _get_or_create_question(conn, question, choices, correct_answer, explanation):
+    key = content_hash(question, choices, correct_answer, explanation)
+    row = conn.execute("SELECT id FROM questions WHERE hash = ?", (key,)).fetchone()
+    if row:
+        return row[0]
+    cursor = conn.execute(
+        "INSERT INTO questions (hash, question, choices, correct_answer, explanation) VALUES (?, ?, ?, ?, ?)",
+        (key, question, encode_choices(choices), correct_answer, explanation)
+    )
+    return cursor.lastrowid
+
+def store_question(conn, question, choices, correct_answer, explanation):
+    """
+    Return the id of the question in the shared table, adding it the first time any user favorites it.
+    Only called with questions from a stored test, never with text sent by the browser.
+    """
+    with conn:
+        return _get_or_create_question(conn, question, choices, correct_answer, explanation)
+
+def toggle_favorite(conn, user_id, question_id):
+    """
+    Add the question to the user's favorites or remove it if already there, return True if it is now a favorite,
+    or None if there is no question with that id
+    """
+    with conn:
+        if not conn.execute("SELECT 1 FROM questions WHERE id = ?", (question_id,)).fetchone():
+            return None
+        # Both statements are point lookups on the (user_id, question_id) primary key
+        removed = conn.execute(
+            "DELETE FROM favorite_questions WHERE user_id = ? AND question_id = ?", (user_id, question_id)
+        ).rowcount
+        if removed:
+            return False
+        conn.execute("INSERT INTO favorite_questions (user_id, question_id) VALUES (?, ?)", (user_id, question_id))
+        return True
+
+def favorite_states(conn, user_id, questions):
+    """
+    Return {question text: (question id, favorited)} for the given questions already in the shared table,
+    so their cards toggle by id. Questions no user has favorited yet are left out.
+    """
+    hashes = {content_hash(item.question, item.choices, item.correct_answer, item.explanation): item.question for item in questions}
+    if not hashes:
+        return {}
+    placeholders = ", ".join("?" * len(hashes))
+    rows = conn.execute(f"""
+        SELECT q.hash, q.id, f.user_id IS NOT NULL FROM questions q
+        LEFT JOIN favorite_questions f ON f.question_id = q.id AND f.user_id = ?
+        WHERE q.hash IN ({placeholders})
+    """, (user_id, *hashes)).fetchall()
+    return {hashes[content_hash]: (question_id, bool(favorited)) for content_hash, question_id, favorited in rows}
+
+def search_terms(text):
+    """Quote each word so user input is matched literally instead of as FTS5 query syntax, as a prefix so partial words match"""
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in text.split())
+
+def list_favorites(conn, user_id, after=0, search=None, limit=FAVORITES_PAGE_SIZE):
+    """
+    Return one page of the user's favorites with question id greater than `after`, in the order the questions were first stored,
+    and the cursor for the next page (None on the last page). Keyset pagination on the (user_id, question_id) primary key
+    keeps every page a range scan, however far the user scrolls. Choices are decoded here once, so templates get a list.
+    """
+    if search and search.split():
+        rows = conn.execute("""
+            SELECT q.id, q.question, q.choices, q.correct_answer, q.explanation FROM questions_fts
+            JOIN favorite_questions f ON f.question_id = questions_fts.rowid
+            JOIN questions q ON q.id = f.question_id
+            WHERE questions_fts MATCH ? AND f.user_id = ? AND f.question_id > ?
+            ORDER BY f.question_id
+            LIMIT ?
+        """, (search_terms(search), user_id, after, limit + 1)).fetchall()
+    else:
+        rows = conn.execute("""
+            SELECT q.id, q.question, q.choices, q.correct_answer, q.explanation FROM favorite_questions f
+            JOIN questions q ON q.id = f.question_id
+            WHERE f.user_id = ? AND f.question_id > ?
+            ORDER BY f.question_id
+            LIMIT ?
+        """, (user_id, after, limit + 1)).fetchall()
+
+    # One extra row is fetched only to know whether there is a next page
+    next_after = rows[limit - 1][0] if len(rows) > limit else None
+    favorites = [
+        {"id": question_id, "question": question, "choices": json.loads(choices), "correct_answer": correct_answer, "explanation": explanation}
+        for question_id, question, choices, correct_answer, explanation in rows[:limit]
+    ]
+    return favorites, next_after
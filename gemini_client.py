@@ -0,0 +1,135 @@
+from google import genai
+from google.genai import types
+from dotenv import load_dotenv, find_dotenv
+import os, threading, time, httpx
+
+# Find and load environment variables
+_ = load_dotenv(find_dotenv())
+
+# Configuration Constants
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL") # Point the client at another server, e.g. the local fake_gemini.py
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT", 60)) # HTTP timeout for a single API call
+MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", 20)) # Connections kept open to the API per process
+KEEPALIVE_EXPIRY_SECONDS = 120 # Close idle connections after this long
+
+# One client per process, created on first use
+_client = None
+_client_pid = None
+_transport = None
+_lock = threading.Lock()
+_health = {"created_at": None, "calls": 0, "errors": 0, "reconnects": 0, "last_error": None}
+
+def configure_transport(transport=None):
+    """
+    Plug in a custom httpx transport (e.g. httpx.MockTransport in tests), None restores the default network transport.
+    The current client is dropped so the next call picks up the new transport.
+    """
+    global _transport
+    with _lock:
+        _transport = transport
+    reset_client()
+
+def _build_client():
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("API key not found in environment variables")
+
+    # Share one keep-alive connection pool across all calls instead of a new TLS handshake per call
+    http_client = httpx.Client(
+        transport=_transport,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS
+        ),
+        timeout=GEMINI_TIMEOUT_SECONDS
+    )
+    http_options = types.HttpOptions(
+        base_url=GEMINI_BASE_URL,
+        timeout=int(GEMINI_TIMEOUT_SECONDS * 1000),
+        httpx_client=http_client
+    )
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+def get_client():
+    """Return the process-wide client, creating it lazily so gunicorn workers never share one across a fork"""
+    global _client, _client_pid
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = _build_client()
+            _client_pid = os.getpid()
+            _health["created_at"] = time.time()
+        return _client
+
+def reset_client():
+    """Drop the current client, the next get_client() call builds a fresh one"""
+    global _client, _client_pid
+    with _lock:
+        client, owner_pid = _client, _client_pid
+        _client = None
+        _client_pid = None
+    # Only close connections owned by this process, a forked child must not touch its parent's sockets
+    if client is not None and owner_pid == os.getpid():
+        try:
+            client.close()
+        except Exception as e:
+            print(f"Error closing Gemini client: {e}")
+
+def generate_content(**kwargs):
+    """
+    Call models.generate_content on the shared client.
+    On a connection-level failure the pool is rebuilt once and the call retried, API errors are raised as is.
+    """
+    client = get_client()
+    try:
+        response = client.models.generate_content(**kwargs)
+    except httpx.TransportError as e:
+        print(f"Gemini connection error, reconnecting: {e}")
+        with _lock:
+            _health["reconnects"] += 1
+            _health["last_error"] = str(e)
+        reset_client()
+        response = get_client().models.generate_content(**kwargs)
+    except Exception as e:
+        with _lock:
+            _health["errors"] += 1
+            _health["last_error"] = str(e)
+        raise
+    with _lock:
+        _health["calls"] += 1
+    return response
+
+def generate_content_stream(**kwargs):
+    """
+    Call models.generate_content_stream on the shared client and yield the response chunks.
+    A connection-level failure before the first chunk rebuilds the pool and retries once.
+    """
+    received = False
+    try:
+        for chunk in get_client().models.generate_content_stream(**kwargs):
+            received = True
+            yield chunk
+    except httpx.TransportError as e:
+        if received:
+            raise
+        print(f"Gemini connection error, reconnecting: {e}")
+        with _lock:
+            _health["reconnects"] += 1
+            _health["last_error"] = str(e)
+        reset_client()
+        yield from get_client().models.generate_content_stream(**kwargs)
+    except Exception as e:
+        with _lock:
+            _health["errors"] += 1
+            _health["last_error"] = str(e)
+        raise
+    with _lock:
+        _health["calls"] += 1
+
+def client_health():
+    """Connection pool state for monitoring"""
+    with _lock:
+        return {"connected": _client is not None and _client_pid == os.getpid(), "pid": os.getpid(), **_health}
+
+# Forked children start without a client instead of inheriting the parent's open connections (or a held lock)
+os.register_at_fork(after_in_child=lambda: globals().update(_client=None, _client_pid=None, _lock=threading.Lock()))
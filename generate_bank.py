@@ -0,0 +1,179 @@
+"""
+Build the question bank offline, so tests are served from the bank instead of waiting on Gemini during class hours.
+
+Generate 500 grammar sets and 200 reading sets with 4 parallel calls, resumable after a crash or Ctrl+C:
+    python generate_bank.py generate --grammar 500 --reading 200 --concurrency 4 --output bank.jsonl.gz
+
+Benchmark against the local fake model instead of the real API:
+    python generate_bank.py generate --grammar 100 --mock --mock-latency 2
+
+Load the file into the web app's question bank:
+    python generate_bank.py import bank.jsonl.gz
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import argparse, gzip, json, os, sys, time, msgspec
+from dedup import DedupIndex, fingerprint
+from models import ITEM_TYPES
+
+MAX_FAILED_CALLS = 20 # Give up after this many failed API calls in a row
+ITEMS_PER_SET = {"grammar": 10, "reading": 3} # Same as REQUIRED_GRAMMAR_QUESTIONS / REQUIRED_READING_QUESTIONS
+
+def item_text(kind, item):
+    return item.question if kind == "grammar" else item.passage
+
+def read_checkpoint(path):
+    """The saved progress, or None when there is no checkpoint yet"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_checkpoint(path, checkpoint):
+    # Write to a temporary file first so a crash never leaves a half written checkpoint
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+def read_bank_file(path):
+    """Yield (kind, typed item) from a bank file, stopping quietly at a truncated last record"""
+    try:
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                record = msgspec.json.decode(line)
+                try:
+                    yield record["kind"], msgspec.convert(record["item"], ITEM_TYPES[record["kind"]])
+                except msgspec.ValidationError as e:
+                    print(f"Skipping invalid {record['kind']} record: {e}")
+    except (EOFError, gzip.BadGzipFile) as e:
+        print(f"Stopped at a truncated record: {e}")
+
+def generate(args):
+    # The model client reads GEMINI_BASE_URL when it is imported, so start the fake model first
+    if args.mock:
+        import fake_gemini
+        server, base_url = fake_gemini.start_server(latency=args.mock_latency)
+        os.environ["GEMINI_BASE_URL"] = base_url
+        os.environ.setdefault("GEMINI_API_KEY", "fake-key")
+    from helpers import fetch_grammar_questions, fetch_reading_questions
+    fetchers = {"grammar": fetch_grammar_questions, "reading": fetch_reading_questions}
+
+    checkpoint_path = args.output + ".checkpoint"
+    checkpoint = read_checkpoint(checkpoint_path)
+
+    # A bank file without a checkpoint wasn't written by an unfinished run, only replace it when asked to
+    if checkpoint is None and os.path.exists(args.output):
+        if not args.overwrite:
+            sys.exit(f"{args.output} already exists and has no checkpoint, pass --overwrite to replace it or choose another --output")
+        os.remove(args.output)
+    checkpoint = checkpoint or {"offset": 0, "done": {"grammar": 0, "reading": 0}}
+
+    # Resume: drop anything written after the last checkpoint and rebuild the dedup index from what is kept
+    indexes = {kind: DedupIndex(max_items=sys.maxsize) for kind in ITEMS_PER_SET}
+    if os.path.exists(args.output):
+        with open(args.output, "r+b") as f:
+            f.truncate(checkpoint["offset"])
+        for kind, item in read_bank_file(args.output):
+            indexes[kind].add(*fingerprint(item_text(kind, item)))
+        print(f"Resuming: {checkpoint['done']['grammar']} grammar and {checkpoint['done']['reading']} reading sets already done")
+
+    targets = {"grammar": args.grammar, "reading": args.reading}
+    pending_items = {kind: [] for kind in ITEMS_PER_SET} # Unique items not yet grouped into a full set
+    stats = {"calls": 0, "failed_calls": 0, "duplicates": 0}
+    failed_in_a_row = 0
+    started = time.time()
+
+    def remaining(kind):
+        return targets[kind] - checkpoint["done"][kind]
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool, open(args.output, "ab") as output:
+        running = {}
+
+        def submit_more():
+            for kind in ITEMS_PER_SET:
+                # Only keep as many calls in flight as there are sets left to build
+                in_flight = sum(1 for k in running.values() if k == kind)
+                while remaining(kind) - in_flight > 0 and len(running) < args.concurrency:
+                    running[pool.submit(fetchers[kind])] = kind
+                    in_flight += 1
+
+        submit_more()
+        while running:
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                kind = running.pop(future)
+                stats["calls"] += 1
+                try:
+                    items = future.result()
+                    failed_in_a_row = 0
+                except Exception as e:
+                    print(f"Generation error ({kind}): {e}")
+                    stats["failed_calls"] += 1
+                    failed_in_a_row += 1
+                    continue
+
+                for item in items:
+                    exact, signature = fingerprint(item_text(kind, item))
+                    if indexes[kind].contains(exact, signature):
+                        stats["duplicates"] += 1
+                        continue
+                    indexes[kind].add(exact, signature)
+                    pending_items[kind].append(item)
+
+                # Write complete sets as their own gzip member, then move the checkpoint past them
+                while len(pending_items[kind]) >= ITEMS_PER_SET[kind] and remaining(kind) > 0:
+                    batch = pending_items[kind][:ITEMS_PER_SET[kind]]
+                    pending_items[kind] = pending_items[kind][ITEMS_PER_SET[kind]:]
+                    lines = b"".join(msgspec.json.encode({"kind": kind, "item": item}) + b"\n" for item in batch)
+                    output.write(gzip.compress(lines))
+                    output.flush()
+                    checkpoint["done"][kind] += 1
+                    checkpoint["offset"] = output.tell()
+                    write_checkpoint(checkpoint_path, checkpoint)
+
+            if failed_in_a_row >= MAX_FAILED_CALLS:
+                print(f"Stopping after {failed_in_a_row} failed calls in a row, run the same command again to resume")
+                break
+            submit_more()
+
+    elapsed = time.time() - started
+    print(f"Done: {checkpoint['done']['grammar']}/{args.grammar} grammar and {checkpoint['done']['reading']}/{args.reading} reading sets")
+    print(f"{stats['calls']} calls ({stats['failed_calls']} failed), {stats['duplicates']} duplicates rejected, {elapsed:.1f}s")
+    if elapsed > 0:
+        print(f"Throughput: {stats['calls'] / elapsed:.2f} calls/s")
+
+def import_bank(args):
+    from question_bank import init_bank, add_to_bank
+    from dedup import init_dedup
+    init_bank()
+    init_dedup()
+    batches = {"grammar": [], "reading": []}
+    added = 0
+    for kind, item in read_bank_file(args.file):
+        batches[kind].append(item)
+        if len(batches[kind]) >= 500:
+            added += add_to_bank(kind, batches[kind])
+            batches[kind] = []
+    for kind, items in batches.items():
+        added += add_to_bank(kind, items)
+    print(f"Imported {added} new items into the question bank")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-build TOEIC questions in bulk")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser("generate", help="Generate question sets into a bank file")
+    generate_parser.add_argument("--grammar", type=int, default=0, help="Number of grammar sets (10 questions each)")
+    generate_parser.add_argument("--reading", type=int, default=0, help="Number of reading sets (3 passages each)")
+    generate_parser.add_argument("--concurrency", type=int, default=4, help="Max API calls in flight")
+    generate_parser.add_argument("--output", default="bank.jsonl.gz", help="Bank file, appended to when resuming")
+    generate_parser.add_argument("--overwrite", action="store_true", help="Replace an existing bank file that has no checkpoint")
+    generate_parser.add_argument("--mock", action="store_true", help="Use the local fake model instead of the Gemini API")
+    generate_parser.add_argument("--mock-latency", type=float, default=1.0, help="Seconds per fake model call")
+    generate_parser.set_defaults(handler=generate)
+
+    import_parser = commands.add_parser("import", help="Load a bank file into the app's question bank")
+    import_parser.add_argument("file")
+    import_parser.set_defaults(handler=import_bank)
+
+    args = parser.parse_args()
+    args.handler(args)
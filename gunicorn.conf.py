@@ -0,0 +1,42 @@
+"""
+gunicorn settings: gunicorn -c gunicorn.conf.py app:app
+
+A test page spends seconds waiting on Gemini and milliseconds on everything else. With the default gthread
+workers each of those waits holds one of WEB_CONCURRENCY x GUNICORN_THREADS slots, so a few dozen students
+generating tests at once queue up everyone else. GUNICORN_WORKER_CLASS=gevent serves each request in a
+greenlet instead: a worker holds up to GUNICORN_WORKER_CONNECTIONS requests and a request waiting on the API
+costs little more than its socket. Password hashing already runs in other processes (passwords.py).
+SQLite calls stay on the event loop: they take well under a millisecond, and a transaction that never yields
+can't be left holding the write lock while other greenlets run.
+"""
+import os
+
+# Configuration Constants
+WORKER_CLASS = os.getenv("GUNICORN_WORKER_CLASS", "gthread") # gthread, or gevent for many concurrent tests (pip install gevent)
+GEVENT_POOL_SIZE = 200 # API calls in flight and connections kept open to Gemini per gevent worker, unless set in the environment
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_class = WORKER_CLASS
+threads = int(os.getenv("GUNICORN_THREADS", 4)) # Per gthread worker
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000)) # Concurrent requests per gevent worker
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120)) # A test generated without streaming can take this long on a slow API day
+graceful_timeout = 30
+keepalive = 5
+
+if WORKER_CLASS == "gevent":
+    # Sized for threads by default; greenlets are cheap, so let a worker have as many calls in flight as it has
+    # requests waiting on them. The per-user and global rate limits still bound what reaches the API.
+    os.environ.setdefault("GENERATION_POOL_SIZE", str(GEVENT_POOL_SIZE))
+    os.environ.setdefault("GEMINI_MAX_CONNECTIONS", str(GEVENT_POOL_SIZE))
+    # A thread worker never has more sign-ins in flight than threads, a gevent worker takes them all at once
+    os.environ.setdefault("PASSWORD_HASH_QUEUE", "64")
+    os.environ.setdefault("MAX_POOLED_CONNECTIONS", "32")
+    # httpcore imports trio when it is installed, whose epoll backend can't be imported once gevent has patched
+    # select in the worker, so import it here in the master first; the workers inherit it already imported
+    import httpcore
+
+def post_worker_init(worker):
+    """Runs in each worker once the app is loaded, before it accepts requests"""
+    from passwords import start_pool
+    start_pool()
@@ -1,103 +1,356 @@
-from google import genai
 from google.genai import types
 from google.genai import errors
 from dotenv import load_dotenv, find_dotenv
 from flask import session, redirect, flash
 from functools import wraps
-import os, json, sqlite3
+import os, sqlite3, uuid, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
-from prompts import grammar_prompt, reading_prompt
+from prompts import grammar_prompt, reading_prompt, grammar_structured_prompt, reading_structured_prompt, grammar_focus_instruction
+from gemini_client import generate_content, generate_content_stream
+from parsing import ArrayItemParser, VALIDATORS
+from models import decode_items, convert_items, RESPONSE_SCHEMAS
+from db import get_db
+from test_store import save_test, load_test, delete_test, new_test_id
+from response_cache import response_cache
+from question_bank import draw_questions, add_to_bank, return_to_bank, item_text, CONCEPT_KINDS
+from adaptive import assemble_test
+from dedup import DedupIndex, fingerprint, is_seen, mark_seen
+from rate_limit import allow_call, single_flight, single_flight_stream
+from speculative import speculate, wait_for, record_use, cancel
+from metrics import timer, inc, log
 
 # Configuration Constants
 REQUIRED_GRAMMAR_QUESTIONS = 10
 REQUIRED_READING_QUESTIONS = 3
 MAX_GENERATION_RETRIES = 3 # Max retries to generate questions
-MAX_GRAMMAR_HISTORY_QUESTIONS = 50 # Max grammar questions to keep in session history
-MAX_READING_HISTORY_QUESTIONS = 20 # Max reading questions to keep in session history
 
 # Find and load environment variables
 _ = load_dotenv(find_dotenv())
 
-# Setup database connection, create database file if it doesn't exist
-db_file = "database.db"
-conn = None
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", 2)) # Max API calls in flight for one test
+GENERATION_TIMEOUT_SECONDS = float(os.getenv("GENERATION_TIMEOUT", 30)) # Stop waiting for a single API call after this
+GENERATION_POOL_SIZE = int(os.getenv("GENERATION_POOL_SIZE", 8)) # Max API calls in flight for the whole process
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "1") != "0" # Constrain the model to the JSON schemas in models.py, 0 for the free-form prompts
+
+# With structured output the schema describes the JSON, so the prompts drop their worked examples
+PROMPTS = {
+    "grammar": grammar_structured_prompt if STRUCTURED_OUTPUT else grammar_prompt,
+    "reading": reading_structured_prompt if STRUCTURED_OUTPUT else reading_prompt
+}
+
+# Shared thread pool for API calls, threads are only created on first use so it is safe to fork before that
+generation_pool = ThreadPoolExecutor(max_workers=GENERATION_POOL_SIZE, thread_name_prefix="generation")
 
 # Set up model
 MODEL = "gemini-2.0-flash"
+TEMPERATURE = 0.5
 SYSTEM_INSTRUCTION = """
 You are a helpful Vietnamese teacher who teaches English to Vietnamese students. 
 You are helping them to improve their TOEIC score.
 """
 
-def get_response(prompt):
+def response_schema(kind):
+    """The schema a response for `kind` must follow, None when structured output is turned off"""
+    return RESPONSE_SCHEMAS[kind] if STRUCTURED_OUTPUT else None
+
+def generation_config(schema=None):
+    """With a schema the model answers with bare JSON matching it, instead of free-form text"""
+    if schema is None:
+        return types.GenerateContentConfig(system_instruction = SYSTEM_INSTRUCTION, temperature = TEMPERATURE)
+    return types.GenerateContentConfig(
+        system_instruction = SYSTEM_INSTRUCTION,
+        temperature = TEMPERATURE,
+        response_mime_type = "application/json",
+        response_schema = schema
+    )
+
+def get_response(prompt, schema=None):
     """A helper function to generate an optimized prompt using the Gemini API from user input."""
     try:
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("API key not found in environment variables")
-        
-        client = genai.Client(api_key = api_key)
-
-        response = client.models.generate_content(
-            model = MODEL,
-            contents = prompt,
-            config = types.GenerateContentConfig(
-                system_instruction = SYSTEM_INSTRUCTION,
-                temperature = 0.5
+        # The client and its connection pool are shared across calls, see gemini_client.py
+        with timer("gemini"):
+            response = generate_content(
+                model = MODEL,
+                contents = prompt,
+                config = generation_config(schema)
             )
-        )
         return response.text
     except ValueError as e:
         print(f"Config or value error: {e}")
+        inc("gemini_errors_total", error="config")
         raise
     except errors.APIError as e:
         print(f"Gemini API error: {e}")
+        inc("gemini_errors_total", error="api")
         raise
     except Exception as e:
         print(f"Unexpected error: {e}")
+        inc("gemini_errors_total", error="other")
+        raise
+
+def get_response_stream(prompt, schema=None):
+    """Same as get_response, but yield the text as the model produces it"""
+    try:
+        with timer("gemini_stream"):
+            for chunk in generate_content_stream(
+                model = MODEL,
+                contents = prompt,
+                config = generation_config(schema)
+            ):
+                if chunk.text:
+                    yield chunk.text
+    except errors.APIError as e:
+        print(f"Gemini API error: {e}")
+        inc("gemini_errors_total", error="api")
         raise
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        inc("gemini_errors_total", error="other")
+        raise
+
+def cache_key(prompt):
+    """Response cache key covering everything that determines the model output for a prompt"""
+    return response_cache.make_key(MODEL, prompt, SYSTEM_INSTRUCTION, {"temperature": TEMPERATURE, "structured": STRUCTURED_OUTPUT})
+
+def fetch_grammar_questions(concepts=None):
+    """
+    Generate one batch of grammar questions, doesn't touch the session so it can run in a background worker.
+    If concepts are given the batch only covers those, used to refill concept buckets of the question bank.
+    """
+    prompt = PROMPTS["grammar"]
+    if concepts:
+        prompt += grammar_focus_instruction.format(concepts="\n".join(f"- {concept}" for concept in concepts))
+    questions = decode_items(get_response(prompt, response_schema("grammar")), "grammar")
+    response_cache.put(cache_key(prompt), questions)
+    return questions
+
+def fetch_reading_questions():
+    """Generate one batch of reading passages, doesn't touch the session so it can run in a background worker"""
+    prompt = PROMPTS["reading"]
+    questions = decode_items(get_response(prompt, response_schema("reading")), "reading")
+    response_cache.put(cache_key(prompt), questions)
+    return questions
+
+def history_scope():
+    """
+    The scope previously served questions are remembered under.
+    Logged in users keep their history across devices, guests get a random ID stored in the session.
+    """
+    if session.get("user_id"):
+        return f"user:{session['user_id']}"
+    if not session.get("history_scope"):
+        session["history_scope"] = uuid.uuid4().hex
+    return f"guest:{session['history_scope']}"
+
+def draw_from_bank(kind, count, skip, user_id=None):
+    """Grammar tests are assembled toward the user's weakest concepts, reading passages are drawn oldest first"""
+    if kind in CONCEPT_KINDS:
+        return assemble_test(kind, count, user_id, skip)
+    return draw_questions(kind, count, skip)
+
+def fetch_concurrently(kind, fetch, merge, required, scope):
+    """
+    Call fetch() in parallel, at most GENERATION_CONCURRENCY at a time and MAX_GENERATION_RETRIES in total.
+    merge(items) is called in the request thread as each call finishes and returns the number of unique items so far.
+    Stops as soon as `required` items are collected; calls still running are abandoned
+    and their results go to the question bank instead of being wasted.
+    No more calls are made once the rate limits of the history scope or the whole app are reached.
+    """
+    def bank_leftover(future):
+        if not future.cancelled() and future.exception() is None:
+            add_to_bank(kind, future.result())
+
+    submitted = 0
+    collected = merge([]) # What the question bank and response cache already provided
+    started = {}
+    last_error = None
+    rate_limited = False
+
+    def submit_more():
+        nonlocal submitted, rate_limited
+        while submitted < MAX_GENERATION_RETRIES and len(started) < GENERATION_CONCURRENCY:
+            if not allow_call(scope, kind):
+                rate_limited = True
+                return
+            if submitted:
+                inc("generation_retries_total", kind=kind)
+            started[generation_pool.submit(fetch)] = time.monotonic()
+            submitted += 1
+
+    submit_more()
+    while started and collected < required:
+        timeout = min(started.values()) + GENERATION_TIMEOUT_SECONDS - time.monotonic()
+        done, _ = wait(list(started), timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            del started[future]
+            try:
+                collected = merge(future.result())
+            except Exception as e:
+                log("generation_error", kind=kind, error=e)
+                last_error = e
+            log("generation_attempt", kind=kind, attempt=submitted - len(started), unique=collected)
+
+        # Give up on calls that ran past the timeout, they count as a failed attempt
+        # One still queued in the shared pool is cancelled, it would otherwise spend an API call nobody waits for
+        now = time.monotonic()
+        for future, start in list(started.items()):
+            if now - start >= GENERATION_TIMEOUT_SECONDS:
+                log("generation_timeout", kind=kind, seconds=GENERATION_TIMEOUT_SECONDS)
+                inc("generation_timeouts_total", kind=kind)
+                del started[future]
+                if not future.cancel():
+                    future.add_done_callback(bank_leftover)
+
+        if collected < required:
+            submit_more()
+
+    for future in started:
+        if not future.cancel():
+            future.add_done_callback(bank_leftover)
+
+    if not collected and last_error:
+        raise last_error
+    if not collected and rate_limited:
+        raise ValueError("Too many new tests requested, please try again in a minute")
+
+def assemble_new_test(kind, history, user_id, speculative=False):
+    """
+    The questions of a new grammar or reading test for a history scope, doesn't touch the session so it can run
+    in a background worker: drawn from the question bank and the response cache first, the rest generated with the API.
+    A speculative test isn't shown yet, its questions are marked as seen in the history only once it is swapped in.
+    """
+    required, fetch = {
+        "grammar": (REQUIRED_GRAMMAR_QUESTIONS, fetch_grammar_questions),
+        "reading": (REQUIRED_READING_QUESTIONS, fetch_reading_questions)
+    }[kind]
+
+    picked = DedupIndex(max_items=required) # The test's own questions, so it has no near-duplicates while the history isn't marked
+    def seen(q):
+        text = item_text(kind, q)
+        return picked.contains(*fingerprint(text)) or is_seen(history, kind, text)
+    def pick(questions):
+        for q in questions:
+            picked.add(*fingerprint(item_text(kind, q)))
+        if not speculative:
+            mark_seen(history, kind, [item_text(kind, q) for q in questions])
+
+    # Draw from the pre-generated question bank first, only call the API if the bank runs dry
+    unique_questions = draw_from_bank(kind, required, seen, user_id)
+    # Then reuse questions generated recently for other users that this user hasn't seen
+    if len(unique_questions) < required:
+        unique_questions += response_cache.take(cache_key(PROMPTS[kind]), required - len(unique_questions), seen)
+    pick(unique_questions)
+
+    # Merge each generated batch as it arrives, skipping questions served before
+    # Questions beyond what this test needs go to the question bank for the next user
+    overflow = []
+    def merge(questions):
+        for q in questions:
+            if len(unique_questions) >= required:
+                overflow.append(q)
+            elif not seen(q):
+                unique_questions.append(q)
+                pick([q])
+            else:
+                inc("duplicates_rejected_total", kind=kind, scope="user")
+        return len(unique_questions)
+
+    if len(unique_questions) < required:
+        with timer("generation", kind=kind):
+            fetch_concurrently(kind, fetch, merge, required, history)
+        add_to_bank(kind, overflow)
+    return unique_questions
+
+def get_current_test(kind):
+    """
+    The user's current grammar or reading test as a PracticeSet (items and answer key), or None.
+    The session only holds the test ID, the questions themselves live in the test store.
+    """
+    session.pop(f"current_{kind}_test", None) # Drop the full test kept in sessions from before the test store
+    return load_test(session.get(f"current_{kind}_test_id"))
+
+def set_current_test(kind, questions, test_id=None):
+    """Store a new test and make it the user's current one"""
+    session[f"current_{kind}_test_id"] = save_test(kind, questions, test_id)
+    session[f"{kind}_test_completed"] = False
+
+def clear_current_test(kind):
+    delete_test(session.pop(f"current_{kind}_test_id", None))
+    session.pop(f"{kind}_test_completed", None)
+
+def pregenerate_next_test(kind):
+    """
+    Start generating the user's next test of this kind in the background while they read their results,
+    so a retake can start right away. The session keeps its ID, the test goes to the test store when done.
+    """
+    next_id = session.get(f"next_{kind}_test_id")
+    if next_id and load_test(next_id):
+        return # The last one hasn't been used yet
+    history = history_scope()
+    user_id = session.get("user_id")
+    required = {"grammar": REQUIRED_GRAMMAR_QUESTIONS, "reading": REQUIRED_READING_QUESTIONS}[kind]
+    test_id = new_test_id()
+
+    def build(cancelled):
+        questions = assemble_new_test(kind, history, user_id, speculative=True)[:required]
+        if not questions:
+            raise ValueError("Failed to generate any valid questions after multiple attempts")
+        if cancelled():
+            return_to_bank(kind, questions) # The user left, the questions can still serve someone else
+        else:
+            save_test(kind, questions, test_id)
+
+    if speculate(kind, history, test_id, build):
+        session[f"next_{kind}_test_id"] = test_id
+
+def use_pregenerated_test(kind):
+    """
+    Make the test pre-generated after the last submission the current one, unless a test is still in progress.
+    If it is still being generated in this process wait for it a little, that is still faster than starting over.
+    """
+    test_id = session.get(f"next_{kind}_test_id")
+    if not test_id or (session.get(f"current_{kind}_test_id") and not session.get(f"{kind}_test_completed")):
+        return False
+    session.pop(f"next_{kind}_test_id")
+    waited = wait_for(test_id)
+    test = load_test(test_id)
+    record_use(kind, test is not None, waited)
+    if test is None:
+        cancel(history_scope(), kind) # Generated from scratch now, don't let the late one go to waste
+        return False
+    # The user sees the questions from now on, not when they were generated
+    mark_seen(history_scope(), kind, [item_text(kind, q) for q in test.items])
+    clear_current_test(kind)
+    session[f"current_{kind}_test_id"] = test_id
+    session[f"{kind}_test_completed"] = False
+    return True
+
+def discard_pregenerated_tests():
+    """Stop the user's next tests, e.g. on logout, and give the questions of finished ones back to the question bank"""
+    cancel(history_scope())
+    for kind in ("grammar", "reading"):
+        test_id = session.pop(f"next_{kind}_test_id", None)
+        test = load_test(test_id)
+        if test:
+            return_to_bank(kind, test.items)
+            delete_test(test_id)
 
 # Generate grammar questions function and parse the response
 def generate_grammar_questions():
     # Check if the session has current test data and if the test is not completed to avoid calling API again
-    if session.get("current_grammar_test") and not session.get("grammar_test_completed"):
-        return session["current_grammar_test"]["GRAMMAR_DATA"]
+    current_test = get_current_test("grammar")
+    if current_test and not session.get("grammar_test_completed"):
+        return current_test.items
     else:
-        unique_questions = []
+        # Track previous questions to avoid duplicates, the fingerprint index replaces the old session list
+        session.pop("previous_grammar_questions", None)
+        history = history_scope()
+        user_id = session.get("user_id")
 
-        for attempt in range(MAX_GENERATION_RETRIES):
-            try:
-                # Track previous questions to avoid duplicates
-                if not session.get("previous_grammar_questions"):
-                    session["previous_grammar_questions"] = []
-
-                # Generate questions, parse the JSON response, clean json XML tag or Markdown tag if found
-                response = get_response(grammar_prompt)
-                response = response.strip()
-                if response.startswith("<json>") and response.endswith("</json>"):
-                    response = response[len("<json>"):-len("</json>")].strip()
-                if response.startswith("```json") and response.endswith("```"):
-                    response = response[len("```json"):-len("```")].strip()
-                questions = json.loads(response)
-
-                # Check for duplicates against previous questions
-                for q in questions["GRAMMAR_DATA"]:
-                    question_text = q["question"].lower()
-                    if not any(question_text in prev.lower() for prev in session["previous_grammar_questions"]):
-                        unique_questions.append(q)
-                        session["previous_grammar_questions"].append(question_text)
-
-                # If we have enough unique questions, break the loop
-                if len(unique_questions) >= REQUIRED_GRAMMAR_QUESTIONS:
-                    break
-                print(f"Attempt {attempt + 1}: Got {len(unique_questions)} unique questions so far...")
-            
-            except json.JSONDecodeError as e:
-                print(f"JSON Decode error: {e}")
-                raise
-            except Exception as e:
-                print(f"Unexpected error: {e}")
-                raise
+        # Another tab of the same user opening a grammar test right now shares its questions instead of generating its own
+        unique_questions = single_flight(("grammar", history), lambda: assemble_new_test("grammar", history, user_id))
 
         # If we don't have enough unique questions after max retries, show whatever we have
         if unique_questions:
@@ -105,14 +358,10 @@ def generate_grammar_questions():
                 print(f"Warning: Only got {len(unique_questions)} unique questions after {MAX_GENERATION_RETRIES} attempts.")
                 flash(f"Generated {len(unique_questions)} unique questions", "warning")
             
-            # Keep only the last N questions in history
-            session["previous_grammar_questions"] = session["previous_grammar_questions"][-MAX_GRAMMAR_HISTORY_QUESTIONS:]
-            
-            # Store questions in session
-            questions = {"GRAMMAR_DATA": unique_questions[:REQUIRED_GRAMMAR_QUESTIONS]}
-            session["current_grammar_test"] = questions
-            session["grammar_test_completed"] = False
-            return questions["GRAMMAR_DATA"]
+            # Store questions in the test store, the session only keeps the test ID
+            questions = unique_questions[:REQUIRED_GRAMMAR_QUESTIONS]
+            set_current_test("grammar", questions)
+            return questions
         else:
             # If we couldn't generate any valid questions at all
             raise ValueError("Failed to generate any valid questions after multiple attempts")
@@ -120,44 +369,17 @@ def generate_grammar_questions():
 # Generate reading questions function and parse the response
 def generate_reading_questions():
     # Check if the session has current test data and if the test is not completed to avoid calling API again
-    if session.get("current_reading_test") and not session.get("reading_test_completed"):
-        return session["current_reading_test"]["READING_DATA"]
+    current_test = get_current_test("reading")
+    if current_test and not session.get("reading_test_completed"):
+        return current_test.items
     else:
-        unique_questions = []
+        # Track previous questions to avoid duplicates, the fingerprint index replaces the old session list
+        session.pop("previous_reading_questions", None)
+        history = history_scope()
+        user_id = session.get("user_id")
 
-        for attempt in range(MAX_GENERATION_RETRIES):
-            try:
-                # Track previous questions to avoid duplicates
-                if not session.get("previous_reading_questions"):
-                    session["previous_reading_questions"] = []
-
-                # Generate questions, parse the JSON response, clean \n, json XML tag or Markdown tag if found
-                response = get_response(reading_prompt)
-                response = response.strip()
-                if response.startswith("<json>") and response.endswith("</json>"):
-                    response = response[len("<json>"):-len("</json>")].strip()
-                if response.startswith("```json") and response.endswith("```"):
-                    response = response[len("```json"):-len("```")].strip()
-                questions = json.loads(response, strict=False) # force strict=False to handle any unexpected formatting
-
-                # Check for duplicates against previous questions
-                for q in questions["READING_DATA"]:
-                    passage_text = q["passage"].lower()
-                    if not any(passage_text in prev.lower() for prev in session["previous_reading_questions"]):
-                        unique_questions.append(q)
-                        session["previous_reading_questions"].append(passage_text)
-
-                # If we have enough unique questions, break the loop
-                if len(unique_questions) >= REQUIRED_READING_QUESTIONS:
-                    break
-                print(f"Attempt {attempt + 1}: Got {len(unique_questions)} unique questions so far...")
-            
-            except json.JSONDecodeError as e:
-                print(f"JSON Decode error: {e}")
-                raise
-            except Exception as e:
-                print(f"Unexpected error: {e}")
-                raise
+        # Another tab of the same user opening a reading test right now shares its questions instead of generating its own
+        unique_questions = single_flight(("reading", history), lambda: assemble_new_test("reading", history, user_id))
 
         # If we don't have enough unique questions after max retries, show whatever we have
         if unique_questions:
@@ -165,18 +387,107 @@ def generate_reading_questions():
                 print(f"Warning: Only got {len(unique_questions)} unique questions after {MAX_GENERATION_RETRIES} attempts.")
                 flash(f"Generated {len(unique_questions)} unique questions", "warning")
             
-            # Keep only the last N questions in history
-            session["previous_reading_questions"] = session["previous_reading_questions"][-MAX_READING_HISTORY_QUESTIONS:]
-            
-            # Store questions in session
-            questions = {"READING_DATA": unique_questions[:REQUIRED_READING_QUESTIONS]}
-            session["current_reading_test"] = questions
-            session["reading_test_completed"] = False
-            return questions["READING_DATA"]
+            # Store questions in the test store, the session only keeps the test ID
+            questions = unique_questions[:REQUIRED_READING_QUESTIONS]
+            set_current_test("reading", questions)
+            return questions
         else:
             # If we couldn't generate any valid questions at all
             raise ValueError("Failed to generate any valid questions after multiple attempts")
 
+def start_streamed_test(kind):
+    """
+    Reserve the test ID before the stream starts, so the session is saved with the page response
+    and the stream only has to write the finished test to the test store.
+    """
+    session.pop(f"current_{kind}_test", None)
+    session.pop(f"previous_{kind}_questions", None)
+    session[f"current_{kind}_test_id"] = new_test_id()
+    session[f"{kind}_test_completed"] = False
+    history_scope() # Make sure a guest's history scope is in the session too
+
+def stream_questions(kind, test_id):
+    """
+    Yield the questions of a new grammar or reading test one at a time, as soon as each one is available:
+    first whatever the question bank and the response cache have, then items parsed out of the streamed model response.
+    When done the test store holds the test under test_id, like after generate_grammar_questions()/generate_reading_questions().
+    """
+    required = {"grammar": REQUIRED_GRAMMAR_QUESTIONS, "reading": REQUIRED_READING_QUESTIONS}[kind]
+
+    # A test that was already generated but not submitted is sent again as is, like the non-streaming path does
+    current_test = load_test(test_id)
+    if current_test:
+        yield from current_test.items
+        return
+
+    # Another tab of the same user streaming a test of this kind right now shares its questions, each tab stores its own copy
+    history = history_scope()
+    questions = []
+    user_id = session.get("user_id")
+    for q in single_flight_stream((kind, history), lambda: stream_new_questions(kind, history, user_id)):
+        questions.append(q)
+        yield q
+    if not questions:
+        raise ValueError("Failed to generate any valid questions after multiple attempts")
+
+    save_test(kind, questions[:required], test_id)
+
+def stream_new_questions(kind, history, user_id):
+    """
+    The questions of a new test for the history scope as they become available:
+    first whatever the question bank and the response cache have, then items parsed out of the streamed model response.
+    """
+    data_key, required = {
+        "grammar": ("GRAMMAR_DATA", REQUIRED_GRAMMAR_QUESTIONS),
+        "reading": ("READING_DATA", REQUIRED_READING_QUESTIONS)
+    }[kind]
+    prompt = PROMPTS[kind]
+
+    unique_questions = draw_from_bank(kind, required, lambda q: is_seen(history, kind, item_text(kind, q)), user_id)
+    if len(unique_questions) < required:
+        unique_questions += response_cache.take(cache_key(prompt), required - len(unique_questions), lambda q: is_seen(history, kind, item_text(kind, q)))
+    mark_seen(history, kind, [item_text(kind, q) for q in unique_questions])
+    yield from unique_questions
+
+    last_error = None
+    for attempt in range(MAX_GENERATION_RETRIES):
+        if len(unique_questions) >= required:
+            break
+        # Serve what the bank and the cache gave once the user or the whole app is over its rate limit
+        if not allow_call(history, kind):
+            if not unique_questions:
+                last_error = last_error or ValueError("Too many new tests requested, please try again in a minute")
+            break
+        if attempt:
+            inc("generation_retries_total", kind=kind)
+        parser = ArrayItemParser(data_key)
+        generated = []
+        overflow = []
+        try:
+            for chunk in get_response_stream(prompt, response_schema(kind)):
+                for q in convert_items(kind, filter(None, map(VALIDATORS[kind], parser.feed(chunk)))):
+                    generated.append(q)
+                    if len(unique_questions) >= required:
+                        overflow.append(q)
+                    elif not is_seen(history, kind, item_text(kind, q)):
+                        unique_questions.append(q)
+                        mark_seen(history, kind, [item_text(kind, q)])
+                        yield q
+                    else:
+                        inc("duplicates_rejected_total", kind=kind, scope="user")
+                # Stop reading the stream once the test is full, no need to wait for the rest of the response
+                if len(unique_questions) >= required:
+                    break
+        except Exception as e:
+            log("generation_error", kind=kind, error=e)
+            last_error = e
+        response_cache.put(cache_key(prompt), generated)
+        add_to_bank(kind, overflow)
+        log("generation_attempt", kind=kind, attempt=attempt + 1, unique=len(unique_questions))
+
+    if not unique_questions:
+        raise last_error or ValueError("Failed to generate any valid questions after multiple attempts")
+
 def validate_environment():
     """Validate required environment variables exist."""
     required_vars = ["GEMINI_API_KEY", "FLASK_SECRET_KEY"]
@@ -199,7 +510,7 @@ def login_required(func):
 
 def get_username(user_id):
     try:
-        conn = sqlite3.connect(db_file)
+        conn = get_db()
         with conn:
             cursor = conn.cursor()
             cursor.execute("SELECT username FROM users WHERE id = ?", (user_id,))
@@ -211,12 +522,10 @@ def get_username(user_id):
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         return "Guest"
-    finally:
-        conn.close()
 
 def update_user_streak(user_id):
     try:
-        conn = sqlite3.connect(db_file)
+        conn = get_db()
         with conn:
             cursor = conn.cursor()
             cursor.execute("SELECT streak, last_test_date FROM users WHERE id = ?", (user_id,))
@@ -248,6 +557,4 @@ def update_user_streak(user_id):
     except sqlite3.Error as e:
         print(f"Database error: {e}")
     except Exception as e:
-        print(f"Unexpected error: {e}")
-    finally:
-        conn.close()
\ No newline at end of file
+        print(f"Unexpected error: {e}")
\ No newline at end of file
@@ -0,0 +1,169 @@
+from dotenv import load_dotenv, find_dotenv
+from collections import OrderedDict
+from flask import Response, current_app, request, render_template, send_from_directory, session
+from markupsafe import Markup
+import os, gzip, hashlib, mimetypes, threading, time, msgspec
+
+try:
+    import brotli # Optional, pip install brotli
+except ImportError:
+    brotli = None
+
+# Find and load environment variables
+_ = load_dotenv(find_dotenv())
+
+# Configuration Constants
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE", "1") == "1" # 0 renders every page and card and serves static files as Flask does
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", 5000)) # Rendered question cards kept per process
+ASSET_MAX_AGE = 365 * 24 * 3600 # Versioned static URLs never change, browsers may keep them this long
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESS_BYTES = 256 # Smaller files aren't worth the Content-Encoding header
+
+_encoder = msgspec.msgpack.Encoder()
+_assets = {} # static filename -> Variants
+_pages = {} # (template, logged in) -> Variants
+_fragments = OrderedDict() # (template, card hash, position, answer, question id, favorited) -> Markup, least recently used first
+_lock = threading.Lock()
+_stats = {"fragment_hits": 0, "fragment_misses": 0, "page_renders": 0, "page_hits": 0, "not_modified": 0, "compressed_bytes_saved": 0}
+
+class Variants:
+    """One response body with its precompressed encodings, compressed once instead of on every request"""
+    __slots__ = ("bodies", "etag", "mimetype", "last_modified")
+
+    def __init__(self, body, mimetype, last_modified):
+        self.etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.mimetype = mimetype
+        self.last_modified = last_modified
+        self.bodies = {"identity": body}
+        if len(body) >= MIN_COMPRESS_BYTES and mimetype.startswith(COMPRESSIBLE_TYPES):
+            compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(body, quality=11)
+            self.bodies.update((encoding, data) for encoding, data in compressed.items() if len(data) < len(body))
+
+    def respond(self, cache_control):
+        """The best encoding the browser accepts, or 304 Not Modified if its copy has the same ETag or date"""
+        encoding = next((e for e in ("br", "gzip") if e in self.bodies and request.accept_encodings[e]), "identity")
+        body = self.bodies[encoding]
+        response = Response(body, mimetype=self.mimetype)
+        # Each encoding is a different representation and needs its own strong ETag
+        response.set_etag(self.etag if encoding == "identity" else f"{self.etag}-{encoding}")
+        response.last_modified = self.last_modified
+        response.headers["Cache-Control"] = cache_control
+        response.vary.add("Accept-Encoding")
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.make_conditional(request)
+        with _lock:
+            if response.status_code == 304:
+                _stats["not_modified"] += 1
+            else:
+                _stats["compressed_bytes_saved"] += len(self.bodies["identity"]) - len(body)
+        return response
+
+def init_http_cache(app):
+    """
+    Load the static files into memory with their content hashes and compressed variants, version their URLs
+    (url_for('static', ...) adds ?v=<hash>) and register the question card template functions
+    """
+    app.add_template_global(question_card)
+    app.add_template_global(reading_question_card)
+    if not HTTP_CACHE_ENABLED:
+        return
+    for root, _, files in os.walk(app.static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, app.static_folder).replace(os.sep, "/")
+            mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            with open(path, "rb") as f:
+                _assets[filename] = Variants(f.read(), mimetype, os.path.getmtime(path))
+
+    @app.url_defaults
+    def version_static_urls(endpoint, values):
+        if endpoint == "static" and _caching(app):
+            asset = _assets.get(values.get("filename"))
+            if asset is not None:
+                values.setdefault("v", asset.etag)
+
+    def serve_static(filename):
+        asset = _assets.get(filename) if _caching(app) else None
+        if asset is None:
+            # Added after startup, missing, or edited while debugging: served from disk as before
+            return send_from_directory(app.static_folder, filename)
+        if request.args.get("v") == asset.etag:
+            return asset.respond(f"public, max-age={ASSET_MAX_AGE}, immutable")
+        return asset.respond("public, no-cache")
+
+    app.view_functions["static"] = serve_static
+
+def _caching(app):
+    # Templates reloaded on change (debug mode) must not be served from a cache
+    return HTTP_CACHE_ENABLED and not app.jinja_env.auto_reload
+
+def cached_page(template):
+    """
+    Render a page that only changes on deploy, like the login form, once per login state and answer
+    later requests for it from memory, with 304 Not Modified when the browser's copy is still current.
+    A page with flashed messages is rendered as usual and not cached, the messages show only once.
+    """
+    app = current_app._get_current_object()
+    if not _caching(app) or session.get("_flashes"):
+        response = Response(render_template(template), mimetype="text/html")
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    key = (template, bool(session.get("user_id")))
+    with _lock:
+        page = _pages.get(key)
+        _stats["page_hits" if page is not None else "page_renders"] += 1
+    if page is None:
+        # The ETag is the same in every worker that renders the same page, so browsers revalidate against any of them
+        page = Variants(render_template(template).encode("utf-8"), "text/html", time.time())
+        with _lock:
+            _pages[key] = page
+    # The header differs with the login state, which only the session cookie tells
+    response = page.respond("private, no-cache")
+    response.vary.add("Cookie")
+    return response
+
+def _card_hash(question):
+    """Hash of everything a question card shows, a regenerated question with the same text but other choices gets its own card"""
+    return hashlib.blake2b(_encoder.encode(question), digest_size=16).digest()
+
+def _fragment(template, question, key, **context):
+    app = current_app._get_current_object()
+    if not _caching(app):
+        return Markup(app.jinja_env.get_template(template).render(**context))
+    key = (template, _card_hash(question), *key)
+    with _lock:
+        html = _fragments.get(key)
+        if html is not None:
+            _fragments.move_to_end(key)
+            _stats["fragment_hits"] += 1
+            return html
+        _stats["fragment_misses"] += 1
+    # Rendered outside of render_template, a card is part of the page render and timed with it
+    html = Markup(app.jinja_env.get_template(template).render(**context))
+    with _lock:
+        _fragments[key] = html
+        while len(_fragments) > FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+    return html
+
+def question_card(item, question_num, user_answer, question_id, favorited):
+    """A grammar question on the result page, the same question answered the same way renders the same card"""
+    return _fragment("partials/question_card.html", item, (question_num, user_answer, question_id, favorited),
+                     item=item, question_num=question_num, user_answer=user_answer, question_id=question_id, favorited=favorited)
+
+def reading_question_card(q, question_num, user_answer):
+    """A question under a passage on the reading result page"""
+    return _fragment("partials/reading_question_card.html", q, (question_num, user_answer),
+                     q=q, question_num=question_num, user_answer=user_answer)
+
+def http_cache_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["fragments"] = len(_fragments)
+        stats["pages"] = len(_pages)
+    stats["assets"] = {filename: {"version": asset.etag, "bytes": {e: len(b) for e, b in asset.bodies.items()}} for filename, asset in _assets.items()}
+    stats["brotli"] = brotli is not None
+    return stats
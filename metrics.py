@@ -0,0 +1,206 @@
+from dotenv import load_dotenv, find_dotenv
+from bisect import bisect_left
+from contextvars import ContextVar
+import os, json, threading, time
+
+# Find and load environment variables, this module is imported before helpers loads them
+_ = load_dotenv(find_dotenv())
+
+# Configuration Constants
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1" # 0 turns every timer and counter into a no-op
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text") # "json" writes one JSON object per log line
+METRIC_PREFIX = "toeic_"
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # Seconds
+
+# Time spent per stage in the request being handled, for the request log line
+_request_stages = ContextVar("request_stages", default=None)
+_lock = threading.Lock()
+_histograms = {} # (name, labels) -> Histogram
+_counters = {} # (name, labels) -> value
+_help = {}
+_collectors = []
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1) # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+def describe(name, text):
+    """Set the HELP text of a metric"""
+    _help[name] = text
+
+def observe(name, seconds, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram.sum += seconds
+        histogram.count += 1
+
+def inc(name, amount=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def _add_stage(stage, seconds, labels):
+    observe("stage_seconds", seconds, stage=stage, **labels)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0) + seconds
+
+class _Timer:
+    __slots__ = ("stage", "labels", "start")
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _add_stage(self.stage, time.perf_counter() - self.start, self.labels)
+        return False
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_no_timer = _NoTimer()
+
+def timer(stage, **labels):
+    """
+    Time a block: `with timer("parse", kind="grammar"): ...` adds to the stage_seconds histogram
+    and to the stage breakdown of the current request. A shared no-op when metrics are disabled.
+    """
+    if not METRICS_ENABLED:
+        return _no_timer
+    return _Timer(stage, labels)
+
+def log(event, **fields):
+    """One log line per event, as JSON when LOG_FORMAT=json, otherwise as key=value pairs"""
+    if LOG_FORMAT == "json":
+        print(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False, default=str), flush=True)
+    else:
+        print(event, " ".join(f"{key}={value}" for key, value in fields.items()))
+
+def register_collector(collect):
+    """
+    Add values computed at scrape time, e.g. from stats other modules already keep.
+    collect() returns (name, type, help, labels, value) tuples, type being "counter" or "gauge".
+    """
+    _collectors.append(collect)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format, for this process only"""
+    with _lock:
+        histograms = {key: (list(h.counts), h.sum, h.count) for key, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    described = set()
+    def header(name, kind, text=None):
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {METRIC_PREFIX}{name} {text or _help.get(name, name)}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+
+    for (name, labels), (counts, total, count) in sorted(histograms.items()):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, bucket in zip((*LATENCY_BUCKETS, "+Inf"), counts):
+            cumulative += bucket
+            lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels((*labels, ('le', bound)))} {cumulative}")
+        lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {count}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}")
+
+    # Samples of one metric must be listed together, collectors may interleave them
+    families = {} # name -> (type, help, sample lines)
+    for collect in _collectors:
+        try:
+            samples = list(collect())
+        except Exception as e:
+            print(f"Metrics collector error: {e}")
+            continue
+        for name, kind, text, labels, value in samples:
+            family = families.setdefault(name, (kind, text, []))
+            family[2].append(f"{METRIC_PREFIX}{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+    for name, (kind, text, samples) in families.items():
+        header(name, kind, text)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+def instrument_app(app):
+    """Time every request and template render, and write one log line per request with its stage breakdown"""
+    if not METRICS_ENABLED:
+        return
+    from flask import g, request, before_render_template, template_rendered
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_stages = {}
+        _request_stages.set(g.metrics_stages)
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or "unknown"
+        observe("request_seconds", elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        stages = g.pop("metrics_stages", {})
+        _request_stages.set(None)
+        log("request", method=request.method, path=request.path, status=response.status_code, ms=round(elapsed * 1000, 1),
+            **{f"{stage}_ms": round(seconds * 1000, 1) for stage, seconds in stages.items()})
+        return response
+
+    def render_started(sender, template, context, **extra):
+        g.metrics_render_start = time.perf_counter()
+
+    def render_finished(sender, template, context, **extra):
+        start = g.pop("metrics_render_start", None)
+        if start is not None:
+            _add_stage("render", time.perf_counter() - start, {})
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+describe("stage_seconds", "Time spent per stage: gemini, gemini_stream, parse, dedup, sqlite, render, password_hash")
+describe("request_seconds", "Time to produce the response per endpoint, excluding streamed bodies")
+describe("generation_retries_total", "Gemini calls made after the first one for the same test")
+describe("duplicates_rejected_total", "Generated items rejected as (near-)duplicates, scope user or bank")
+describe("parse_failures_total", "Model responses without a single valid item")
+describe("parse_fallbacks_total", "Model responses that needed the tolerant parser instead of a typed decode")
+describe("gemini_errors_total", "Failed Gemini calls")
+describe("generation_timeouts_total", "Gemini calls abandoned after GENERATION_TIMEOUT seconds")
+describe("rate_limited_total", "Gemini calls not made because the user or global rate limit was reached")
+describe("speculative_tests_total", "Next tests generated in the background by outcome: started, skipped, ready, failed, cancelled, hits, late_hits, misses")
+describe("password_hash_rejected_total", "Password hashes turned away because PASSWORD_HASH_QUEUE were already queued")
+describe("single_flight_shared_total", "Test generations shared with a concurrent request of the same user")
@@ -0,0 +1,186 @@
+from google.genai import types
+from typing import Annotated, Generic, TypeVar
+import operator, msgspec
+from prompts import GRAMMAR_CONCEPTS, READING_QUESTION_TYPES
+from parsing import extract_items, DATA_KEYS, NUM_CHOICES
+from metrics import timer, inc
+
+# Configuration Constants
+UNANSWERED = 255 # Answer index stored for a question the user didn't answer
+NO_QUESTION = 254 # Answer key byte for a mock exam question that couldn't be generated, no answer ever matches it
+
+Choices = Annotated[list[str], msgspec.Meta(min_length=NUM_CHOICES, max_length=NUM_CHOICES)]
+
+def _check_answer(question):
+    if len(set(question.choices)) != NUM_CHOICES:
+        raise ValueError("choices must be distinct")
+    if question.correct_answer not in question.choices:
+        raise ValueError("correct_answer must be one of the choices")
+
+class GrammarQuestion(msgspec.Struct, gc=False):
+    question: str
+    choices: Choices
+    correct_answer: str
+    explanation: str
+    concept: str = ""
+
+    def __post_init__(self):
+        _check_answer(self)
+
+class ReadingQuestion(msgspec.Struct, gc=False):
+    question: str
+    choices: Choices
+    correct_answer: str
+    explanation: str
+    question_type: str = ""
+
+    def __post_init__(self):
+        _check_answer(self)
+
+class ReadingPassage(msgspec.Struct, gc=False):
+    passage: str
+    questions: Annotated[list[ReadingQuestion], msgspec.Meta(min_length=1)]
+
+class GrammarData(msgspec.Struct):
+    GRAMMAR_DATA: list[GrammarQuestion]
+
+class ReadingData(msgspec.Struct):
+    READING_DATA: list[ReadingPassage]
+
+class ExamChunk(msgspec.Struct, gc=False):
+    """
+    One independently generated piece of a mock exam: Part 5 questions or Part 6/7 passages.
+    size is the number of questions it stands for in the answer key, also when it couldn't be generated and is empty.
+    """
+    part: int
+    size: int
+    questions: list[GrammarQuestion] = []
+    passages: list[ReadingPassage] = []
+
+Item = TypeVar("Item")
+
+class PracticeSet(msgspec.Struct, Generic[Item], gc=False):
+    """The items of a test as shown to the user, with the index of the correct choice of every question in order"""
+    items: list[Item]
+    answer_key: bytes
+
+ITEM_TYPES = {"grammar": GrammarQuestion, "reading": ReadingPassage, "exam": ExamChunk}
+DATA_TYPES = {"grammar": GrammarData, "reading": ReadingData}
+SET_TYPES = {"grammar": PracticeSet[GrammarQuestion], "reading": PracticeSet[ReadingPassage], "exam": PracticeSet[ExamChunk]}
+
+def _question_schema(tag_field, tags):
+    fields = ["question", "choices", "correct_answer", tag_field, "explanation"]
+    return types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "question": types.Schema(type=types.Type.STRING),
+            "choices": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING), min_items=NUM_CHOICES, max_items=NUM_CHOICES),
+            "correct_answer": types.Schema(type=types.Type.STRING),
+            tag_field: types.Schema(type=types.Type.STRING, enum=tags),
+            "explanation": types.Schema(type=types.Type.STRING, description="In Vietnamese")
+        },
+        required=fields,
+        property_ordering=fields # Explanation last, so the model picks the answer before justifying it
+    )
+
+def _data_schema(key, item_schema):
+    return types.Schema(
+        type=types.Type.OBJECT,
+        properties={key: types.Schema(type=types.Type.ARRAY, items=item_schema)},
+        required=[key]
+    )
+
+# Structured output schemas, the model can only answer with JSON of this shape
+RESPONSE_SCHEMAS = {
+    "grammar": _data_schema("GRAMMAR_DATA", _question_schema("concept", GRAMMAR_CONCEPTS)),
+    "reading": _data_schema("READING_DATA", types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "passage": types.Schema(type=types.Type.STRING),
+            "questions": types.Schema(type=types.Type.ARRAY, items=_question_schema("question_type", READING_QUESTION_TYPES))
+        },
+        required=["passage", "questions"],
+        property_ordering=["passage", "questions"]
+    ))
+}
+
+def questions_of(kind, items):
+    """Every question of a list of items in the order they are shown, reading passages are flattened"""
+    if kind == "grammar":
+        return items
+    if kind == "exam":
+        return [question for chunk in items for question in chunk.questions + questions_of("reading", chunk.passages)]
+    return [question for passage in items for question in passage.questions]
+
+def question_at(test, index):
+    """The question at a position of a test's answer key, None past the end or in an exam chunk that couldn't be generated"""
+    for item in test.items:
+        if isinstance(item, ExamChunk):
+            questions, size = questions_of("exam", [item]), item.size
+        elif isinstance(item, ReadingPassage):
+            questions, size = item.questions, len(item.questions)
+        else:
+            questions, size = [item], 1
+        if 0 <= index < size:
+            return questions[index] if index < len(questions) else None
+        index -= size
+    return None
+
+def _answer_key(questions):
+    return bytes(question.choices.index(question.correct_answer) for question in questions)
+
+def practice_set(kind, items):
+    """Pair the items with their answer key, computed once when the test is created instead of on every submit"""
+    if kind == "exam":
+        # An empty chunk keeps its place in the key, so the question numbers of the chunks after it don't move
+        return SET_TYPES[kind](items, b"".join(
+            _answer_key(questions_of("exam", [chunk])) if chunk.questions or chunk.passages else bytes([NO_QUESTION]) * chunk.size
+            for chunk in items
+        ))
+    return SET_TYPES[kind](items, _answer_key(questions_of(kind, items)))
+
+def parse_answers(values):
+    """Turn submitted choice indexes into a byte string like the answer key, anything invalid becomes UNANSWERED"""
+    return bytes(int(value) if value in ("0", "1", "2", "3") else UNANSWERED for value in values)
+
+def score_answers(answer_key, answers):
+    """Number of correct answers, one C-level pass comparing the two byte strings"""
+    return sum(map(operator.eq, answer_key, answers))
+
+def split_answers(passages, answers):
+    """The flat answers of a reading test grouped per passage, for the result template"""
+    grouped = []
+    start = 0
+    for passage in passages:
+        grouped.append(answers[start:start + len(passage.questions)])
+        start += len(passage.questions)
+    return grouped
+
+def convert_items(kind, items):
+    """Turn parsed dicts into typed items, dropping the ones that don't fit the type"""
+    typed = []
+    for item in items:
+        try:
+            typed.append(msgspec.convert(item, ITEM_TYPES[kind]))
+        except msgspec.ValidationError as e:
+            print(f"Skipping invalid {kind} item: {e}")
+    return typed
+
+def decode_items(text, kind):
+    """
+    Decode a model response straight into typed items. A structured-output response decodes in one pass,
+    anything else (free-form text, a truncated or partly invalid response) goes through the tolerant parser.
+    """
+    with timer("parse", kind=kind):
+        try:
+            items = getattr(msgspec.json.decode(text, type=DATA_TYPES[kind]), DATA_KEYS[kind])
+        except msgspec.DecodeError:
+            inc("parse_fallbacks_total", kind=kind)
+            try:
+                items = convert_items(kind, extract_items(text, kind))
+            except ValueError:
+                items = []
+    if not items:
+        inc("parse_failures_total", kind=kind)
+        raise ValueError(f"No valid {kind} items in the model response")
+    return items
@@ -0,0 +1,148 @@
+import json
+
+class ArrayItemParser:
+    """
+    Incrementally pull complete items out of the `"KEY": [ {...}, {...} ]` array in a streamed model response.
+    Feed text chunks as they arrive, every fully closed object in the array is returned as soon as its brace closes.
+    Anything around the JSON (the <json> tag, a Markdown fence, a preamble) is ignored.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.buffer = ""
+        self.position = 0 # Next character to scan
+        self.in_array = False
+        self.finished = False
+        self.depth = 0 # Nesting depth inside the array, 1 means directly inside an item
+        self.in_string = False
+        self.escaped = False
+        self.item_start = None
+
+    def feed(self, chunk):
+        """Add a chunk of text, return the list of items completed by it"""
+        self.buffer += chunk
+        items = []
+        if self.finished:
+            return items
+
+        if not self.in_array:
+            key_at = self.buffer.find(f'"{self.key}"')
+            if key_at == -1:
+                return items
+            bracket_at = self.buffer.find("[", key_at)
+            if bracket_at == -1:
+                return items
+            self.in_array = True
+            self.position = bracket_at + 1
+
+        buffer = self.buffer
+        for i in range(self.position, len(buffer)):
+            char = buffer[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                if self.depth == 0:
+                    self.item_start = i
+                self.depth += 1
+            elif char in "}]":
+                if self.depth == 0:
+                    # The array itself closed
+                    self.finished = True
+                    self.position = i + 1
+                    return items
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        items.append(json.loads(buffer[self.item_start:i + 1], strict=False))
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping malformed item: {e}")
+                    self.item_start = None
+        self.position = len(buffer)
+
+        # Drop text that has been fully consumed to keep the buffer small
+        if self.item_start is None:
+            self.buffer = ""
+            self.position = 0
+        else:
+            self.buffer = buffer[self.item_start:]
+            self.position -= self.item_start
+            self.item_start = 0
+        return items
+
+DATA_KEYS = {"grammar": "GRAMMAR_DATA", "reading": "READING_DATA"}
+NUM_CHOICES = 4
+
+_decoder = json.JSONDecoder(strict=False) # Models sometimes put raw newlines inside strings
+
+def validate_question(item):
+    """
+    Return the question cleaned up if it is usable: text fields present, exactly NUM_CHOICES distinct choices
+    and the correct answer among them. Return None otherwise.
+    """
+    if not isinstance(item, dict):
+        return None
+    question, choices, correct_answer, explanation = (item.get(field) for field in ("question", "choices", "correct_answer", "explanation"))
+    if not all(isinstance(value, str) and value.strip() for value in (question, correct_answer, explanation)):
+        return None
+    if not isinstance(choices, list) or not all(isinstance(choice, str) for choice in choices):
+        return None
+    choices = [choice.strip() for choice in choices]
+    correct_answer = correct_answer.strip()
+    if len(choices) != NUM_CHOICES or len(set(choices)) != NUM_CHOICES or correct_answer not in choices:
+        return None
+    return {**item, "question": question.strip(), "choices": choices, "correct_answer": correct_answer, "explanation": explanation.strip()}
+
+def validate_passage(item):
+    """Return the passage with only its valid questions, or None if it has no text or no valid question left"""
+    if not isinstance(item, dict) or not isinstance(item.get("passage"), str) or not item["passage"].strip():
+        return None
+    questions = item.get("questions")
+    if not isinstance(questions, list):
+        return None
+    valid = [question for question in map(validate_question, questions) if question]
+    if not valid:
+        return None
+    return {**item, "passage": item["passage"].strip(), "questions": valid}
+
+VALIDATORS = {"grammar": validate_question, "reading": validate_passage}
+
+def _outermost_object(text, key):
+    """Decode the first JSON object in the text that holds the key, skipping any preamble, wrapper or trailing chatter"""
+    start = text.find("{")
+    while start != -1:
+        try:
+            data, _ = _decoder.raw_decode(text, start)
+            if isinstance(data, dict) and isinstance(data.get(key), list):
+                return data
+        except json.JSONDecodeError:
+            pass
+        start = text.find("{", start + 1)
+        # Only objects that can still contain the key are worth trying
+        if start != -1 and text.find(f'"{key}"', start) == -1:
+            return None
+    return None
+
+def extract_items(text, kind):
+    """
+    Pull the valid items of a grammar or reading generation out of the raw model text.
+    The outermost JSON object is decoded when the response is well formed. Otherwise, e.g. when the output
+    was cut off or one item is broken, every well-formed item of the array is recovered on its own.
+    Items failing validation are dropped and the rest are kept. Raise ValueError if nothing usable is left.
+    """
+    key = DATA_KEYS[kind]
+    data = _outermost_object(text, key)
+    items = data[key] if data is not None else ArrayItemParser(key).feed(text)
+
+    validate = VALIDATORS[kind]
+    valid = [item for item in map(validate, items) if item]
+    if len(valid) < len(items):
+        print(f"Dropped {len(items) - len(valid)} invalid {kind} items")
+    if not valid:
+        raise ValueError(f"No valid {kind} items in the model response")
+    return valid
@@ -0,0 +1,103 @@
+from dotenv import load_dotenv, find_dotenv
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+import os, threading, multiprocessing
+from metrics import timer, inc, log
+
+# Find and load environment variables
+_ = load_dotenv(find_dotenv())
+
+# Configuration Constants
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1") # Any werkzeug method, e.g. scrypt:16384:8:1 or pbkdf2:sha256:600000
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2))) # Processes hashing passwords per app process, 0 hashes in the request thread
+MAX_QUEUED_HASHES = int(os.getenv("PASSWORD_HASH_QUEUE", 16)) # Hashes waiting or running per app process, more are turned away
+HASH_TIMEOUT_SECONDS = 30 # Give up on a hash that waited this long
+
+# One pool per process, started on first use so gunicorn workers never share one across a fork
+_pool = None
+_pool_pid = None
+_queued = 0
+_lock = threading.Lock()
+
+class HashQueueFull(Exception):
+    """Too many passwords are being hashed already, the request should be retried a little later"""
+    def __init__(self):
+        super().__init__("Too many sign-ins at the moment, please try again in a few seconds")
+
+def _get_pool():
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # The fork server is a fresh interpreter, the hashing processes never inherit the app's threads or connections
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["werkzeug.security"])
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=context)
+            _pool_pid = os.getpid()
+        return _pool
+
+def _reset_pool():
+    """Drop a broken pool so the next call starts a new one, other threads may already have done it"""
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def start_pool():
+    """
+    Start the hashing processes now rather than on the first sign-ins, e.g. before a gunicorn worker takes requests:
+    starting them blocks the calling thread, and under gevent every request of the worker with it
+    """
+    if HASH_WORKERS <= 0:
+        return
+    pool = _get_pool()
+    for future in [pool.submit(int) for _ in range(HASH_WORKERS)]:
+        future.result()
+
+def _run(operation, function, *args):
+    """Run function in the hashing pool, at most MAX_QUEUED_HASHES at a time, or inline if the pool is turned off"""
+    global _queued
+    with timer("password_hash", operation=operation):
+        if HASH_WORKERS <= 0:
+            return function(*args)
+        with _lock:
+            if _queued >= MAX_QUEUED_HASHES:
+                inc("password_hash_rejected_total", operation=operation)
+                raise HashQueueFull()
+            _queued += 1
+        try:
+            try:
+                return _get_pool().submit(function, *args).result(timeout=HASH_TIMEOUT_SECONDS)
+            except BrokenProcessPool as e:
+                # A hashing process died (OOM kill, crash) and took the pool with it, start a new one and retry once
+                log("password_hash_pool_broken", operation=operation, error=e)
+                inc("password_hash_pool_restarts_total", operation=operation)
+                _reset_pool()
+                return _get_pool().submit(function, *args).result(timeout=HASH_TIMEOUT_SECONDS)
+        finally:
+            with _lock:
+                _queued -= 1
+
+def hash_password(password):
+    return _run("hash", generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(pwhash, password):
+    return _run("verify", check_password_hash, pwhash, password)
+
+def needs_rehash(pwhash):
+    """Whether a stored hash was made with another method or cost than PASSWORD_HASH_METHOD, e.g. before it changed"""
+    return pwhash.split("$", 1)[0] != _stored_method()
+
+_method_prefix = None
+
+def _stored_method():
+    """How werkzeug writes the configured method into a hash, with its default cost filled in (scrypt -> scrypt:32768:8:1)"""
+    global _method_prefix
+    if _method_prefix is None:
+        _method_prefix = generate_password_hash("", PASSWORD_HASH_METHOD).split("$", 1)[0]
+    return _method_prefix
+
+def hash_queue_stats():
+    with _lock:
+        return {"method": PASSWORD_HASH_METHOD, "workers": HASH_WORKERS, "queued": _queued, "max_queued": MAX_QUEUED_HASHES}
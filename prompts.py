@@ -6,6 +6,7 @@ For each question:
 2. Provide 4 multiple-choice options to fill the blank
 3. Include only one correct answer, and it's positioned randomly among the choices
 4. Write a detailed explanation for why the correct answer is correct and why the other options are incorrect (in Vietnamese)
+5. Tag the question with the grammatical concept it tests, using exactly one of the concept names listed below
 
 The grammar questions should test various grammatical concepts commonly found in TOEIC tests:
 - Verb tenses and forms
@@ -38,18 +39,21 @@ The response should be in JSON format with the following structure:
             "question": "The candidate __________ resume impressed the entire hiring committee had five years of experience in international sales.",
             "choices": ["who", "whose", "which", "whom"],
             "correct_answer": "whose",
+            "concept": "Relative clauses",
             "explanation": "Trong câu này cần một đại từ quan hệ sở hữu để nối 'candidate' với 'resume'. 'Whose' là đại từ quan hệ sở hữu đúng, dùng để chỉ sự sở hữu của 'candidate' đối với 'resume'. 'Who' dùng cho chủ ngữ người nhưng không thể hiện quan hệ sở hữu. 'Which' dùng cho vật, không phù hợp khi nói về người. 'Whom' là đại từ quan hệ tân ngữ, không dùng để thể hiện sự sở hữu."
         },
         {
             "question": "The CEO decided __________ the expansion plan after reviewing the market forecast.",
             "choices": ["to approve", "approving", "approve", "to approving"],
             "correct_answer": "to approve",
+            "concept": "Gerunds and infinitives",
             "explanation": "Sau động từ 'decided', ta dùng động từ nguyên mẫu có 'to' (to-infinitive). 'To approve' là dạng đúng. 'Approving' là dạng gerund (V-ing), không phù hợp sau 'decided'. 'Approve' là nguyên thể nhưng thiếu 'to'. 'To approving' là sai ngữ pháp vì không tồn tại cấu trúc này sau 'decided'."
         },
         {
             "question": "The manager said that the final report __________ before the end of the week.",
             "choices": ["will be submitted", "was submitted", "is submitted", "would be submitted"],
             "correct_answer": "would be submitted",
+            "concept": "Reported speech",
             "explanation": "Câu này là câu tường thuật (reported speech) với động từ tường thuật 'said' ở thì quá khứ. Vì vậy, mệnh đề sau phải lùi thì theo quy tắc. 'Will be submitted' là thì tương lai đơn, không lùi thì nên sai. 'Would be submitted' là thì tương lai trong quá khứ (future in the past), đúng cấu trúc khi lùi thì từ 'will be submitted'. 'Is submitted' là hiện tại đơn bị động, sai vì không lùi thì. 'Was submitted' là quá khứ đơn bị động, không phù hợp vì nói về hành động tương lai (trước cuối tuần), không phải đã xảy ra trong quá khứ."
         }
     ]
@@ -71,8 +75,9 @@ For each passage:
    - Inference questions
    - Vocabulary questions
    - Purpose questions
-6. Use only standard line breaks \n for formatting
-7. Keep all text within valid JSON string format
+6. Tag each question with its question type, using exactly one of: Main idea, Detail, Inference, Vocabulary, Purpose
+7. Use only standard line breaks \n for formatting
+8. Keep all text within valid JSON string format
 
 The passages should cover different professional contexts such as:
 - Office communications (emails, memos)
@@ -94,18 +99,21 @@ The response should be in JSON format with the following structure:
                     "question": "What is the main purpose of this message?",
                     "choices": ["To describe the Mountain View Resort", "To announce a company event", "To request vacation time", "To explain transportation options"],
                     "correct_answer": "To announce a company event",
+                    "question_type": "Main idea",
                     "explanation": "Mục đích chính của văn bản là thông báo về sự kiện công ty thường niên (company retreat), không phải để mô tả khu nghỉ dưỡng, yêu cầu thời gian nghỉ phép hay giải thích các phương tiện đi lại."
                 },
                 {
                     "question": "By what date must employees confirm their attendance?",
                     "choices": ["September 30", "October 15", "October 17", "Next week"],
                     "correct_answer": "September 30",
+                    "question_type": "Detail",
                     "explanation": "Theo văn bản, nhân viên phải xác nhận tham dự với trưởng phòng trước ngày 30 tháng 9 (Please confirm your attendance with your department head by September 30)."
                 },
                 {
                     "question": "What will happen next week according to the message?",
                     "choices": ["The retreat will begin", "Parking passes will be distributed", "The agenda will be shared", "Department heads will meet"],
                     "correct_answer": "The agenda will be shared",
+                    "question_type": "Detail",
                     "explanation": "Theo thông báo, lịch trình chi tiết sẽ được phân phát vào tuần tới (The detailed agenda will be distributed next week). Không có thông tin nào cho thấy kỳ nghỉ sẽ bắt đầu, vé đậu xe sẽ được phát hoặc trưởng phòng sẽ họp vào tuần tới."
                 }
             ]
@@ -113,4 +121,102 @@ The response should be in JSON format with the following structure:
     ]
 }
 </json>
-"""
\ No newline at end of file
+"""
+
+# Concepts and question types the prompts ask the model to tag questions with, used to track progress per area
+GRAMMAR_CONCEPTS = [
+    "Verb tenses and forms",
+    "Subject-verb agreement",
+    "Modal verbs",
+    "Prepositions",
+    "Articles",
+    "Pronouns",
+    "Conjunctions",
+    "Conditionals",
+    "Passive voice",
+    "Reported speech",
+    "Relative clauses",
+    "Gerunds and infinitives"
+]
+
+READING_QUESTION_TYPES = ["Main idea", "Detail", "Inference", "Vocabulary", "Purpose"]
+
+# Appended to grammar_prompt when the question bank runs low on specific concepts
+grammar_focus_instruction = """
+For this set, only test the following grammatical concepts, spread evenly across the questions:
+{concepts}
+"""
+
+# Trimmed prompts for structured output, the response schema (see models.py) describes the JSON shape
+# and the allowed concept/question type names, so the worked JSON examples above aren't needed
+grammar_structured_prompt = """
+Generate 10 grammar questions for a TOEIC mock test.
+
+For each question:
+1. Write a short business or professional text (1-3 sentences) with a blank (__________) where a grammatical element should go
+2. Give 4 choices to fill the blank, only one of them correct, at a random position
+3. Tag it with the grammatical concept it tests, covering a variety of concepts across the set
+4. Explain in Vietnamese why the correct answer is correct and why the other choices are wrong
+
+Use professional contexts such as office communications, meetings, customer service, business travel and corporate policies.
+"""
+
+reading_structured_prompt = """
+Generate 3 reading comprehension passages with questions for a TOEIC mock test.
+
+For each passage:
+1. Write an authentic business or professional text (100-200 words), using \\n for line breaks
+2. Write 3 multiple-choice questions about it with 4 choices each, only one of them correct, at a random position
+3. Tag each question with its question type, varying the types across the set
+4. Explain in Vietnamese why the correct answer is correct and why the other choices are wrong
+
+Cover different contexts such as emails, memos, business articles, product descriptions, job advertisements, company announcements and travel information.
+"""
+
+# Mock exam chunks, each one a separate call small enough to come back in a few seconds.
+# Part 5 chunks use the grammar prompts above. {passages} lists the number of questions of every passage,
+# the fake server in fake_gemini.py reads the counts from these lines.
+exam_text_completion_prompt = """
+Generate {count} text completion passages for Part 6 of a TOEIC reading mock test.
+
+For each passage:
+1. Write a short business text (80-150 words) such as an email, memo, notice or advertisement, using \\n for line breaks
+2. Leave numbered blanks in the text written as (1), (2), (3) and so on, numbered from 1 in each passage
+3. Write one question per blank with the question text "Blank (n)", and 4 choices to fill it, only one of them correct, at a random position
+4. Test word forms, verb tenses, vocabulary and connecting words; one blank per passage should be a whole sentence to insert
+5. Tag the questions with Vocabulary for word choice, Detail for grammar and Inference for the sentence to insert
+6. Explain in Vietnamese why the correct answer is correct and why the other choices are wrong
+
+The number of blanks of each passage:
+{passages}
+"""
+
+exam_reading_prompt = """
+Generate {count} reading comprehension sets for Part 7 of a TOEIC reading mock test.
+
+For each set:
+1. {documents}
+2. Use \\n for line breaks
+3. Write multiple-choice questions about it with 4 choices each, only one of them correct, at a random position
+4. Tag each question with its question type, varying the types across the set
+5. Explain in Vietnamese why the correct answer is correct and why the other choices are wrong
+
+Use a different context for every set, such as emails, memos, articles, advertisements, schedules, invoices, forms and text message chains.
+
+The number of questions of each set:
+{passages}
+"""
+
+exam_documents = {
+    1: "Write one authentic business or professional text (100-200 words) as the passage",
+    2: "Write two related texts (80-150 words each), e.g. an email and the schedule it refers to, as one passage with a line of --- between them. At least one question must need information from both",
+    3: "Write three related texts (60-120 words each), e.g. an advertisement, an order form and a complaint, as one passage with a line of --- between them. At least two questions must combine information from different texts"
+}
+
+exam_passage_line = "Passage {number}: {questions} questions"
+
+# Added to the exam prompts when structured output is off, the worked example in reading_prompt shows the shape
+exam_json_instruction = """
+The response should be in JSON format, wrapped in <json></json> tags, with a "READING_DATA" list of objects
+each holding a "passage" string and a "questions" list of objects with "question", "choices", "correct_answer", "question_type" and "explanation".
+"""
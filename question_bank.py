@@ -0,0 +1,339 @@
+from dotenv import load_dotenv, find_dotenv
+import os, sqlite3, threading, time, msgspec
+from collections import deque
+from dedup import is_seen, mark_seen, GLOBAL_SCOPE
+from db import connection
+from attempts import question_type, QUESTION_TYPES
+from models import ITEM_TYPES
+from rate_limit import allow_call
+from metrics import inc
+
+# Find and load environment variables, this module is imported before helpers loads them
+_ = load_dotenv(find_dotenv())
+
+# Configuration Constants
+BANK_HIGH_WATER = {
+    "grammar": int(os.getenv("GRAMMAR_BANK_HIGH_WATER", 200)), # Refill grammar questions up to this many items
+    "reading": int(os.getenv("READING_BANK_HIGH_WATER", 60)) # Refill reading passages up to this many items
+}
+BANK_LOW_WATER = {
+    "grammar": int(os.getenv("GRAMMAR_BANK_LOW_WATER", 100)), # Start refilling when the pool drops below this
+    "reading": int(os.getenv("READING_BANK_LOW_WATER", 30))
+}
+REFILL_INTERVAL_SECONDS = int(os.getenv("BANK_REFILL_INTERVAL", 30)) # How often the worker checks pool depth
+REFILL_RATE_WINDOW_SECONDS = 300 # Sliding window used to compute the refill rate
+DRAW_SCAN_FACTOR = 5 # Scan this many candidates per requested item when skipping already seen items
+DRAW_ROUNDS = 3 # Scan further this many times when other workers took the items a draw had picked
+CONCEPT_LOW_WATER = int(os.getenv("CONCEPT_BANK_LOW_WATER", 10)) # Ask the model for a grammar concept when its bucket drops below this
+CONCEPTS_PER_REFILL = 3 # Concepts a targeted refill call asks for at once
+CONCEPT_KINDS = ("grammar",) # Kinds whose bank items are bucketed by concept
+CONCEPT_BACKOFF_SECONDS = 600 # Pause targeted refills this long when the model ignores the requested concepts
+
+# Background worker state, one worker per process
+_worker = None
+_worker_pid = None
+_wake = threading.Event()
+_lock = threading.Lock()
+_concept_backoff_until = {}
+_encoder = msgspec.msgpack.Encoder()
+_decoders = {kind: msgspec.msgpack.Decoder(item_type) for kind, item_type in ITEM_TYPES.items()}
+_stats = {
+    kind: {"served": 0, "refilled": 0, "misses": 0, "refill_errors": 0, "last_error": None, "refill_times": deque()}
+    for kind in BANK_HIGH_WATER
+}
+
+def init_bank():
+    """Create the question bank table if it doesn't exist, safe to call on every startup"""
+    with connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS question_bank (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                content_key TEXT NOT NULL UNIQUE,
+                data BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_question_bank_kind ON question_bank (kind, id)")
+
+        # Concept tag of each item, added after the table was first created
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(question_bank)")]
+        if "concept" not in columns:
+            conn.execute("ALTER TABLE question_bank ADD COLUMN concept TEXT")
+            updates = []
+            for row_id, kind, data in conn.execute("SELECT id, kind, data FROM question_bank").fetchall():
+                item = load_item(kind, data)
+                if item:
+                    updates.append((item_concept(kind, item), row_id))
+            conn.executemany("UPDATE question_bank SET concept = ? WHERE id = ?", updates)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_question_bank_concept ON question_bank (kind, concept)")
+
+def load_item(kind, data):
+    """
+    Decode a bank row into a typed item, None if it doesn't fit the type.
+    Items are stored as msgpack, rows banked before that hold JSON text.
+    """
+    try:
+        if isinstance(data, str):
+            return msgspec.json.decode(data, type=ITEM_TYPES[kind])
+        return _decoders[kind].decode(data)
+    except msgspec.DecodeError as e:
+        print(f"Skipping unreadable {kind} bank item: {e}")
+        return None
+
+def item_text(kind, item):
+    """The question for grammar, the passage for reading"""
+    return item.question if kind == "grammar" else item.passage
+
+def content_key(kind, item):
+    """The text used to identify an item in the bank"""
+    return item_text(kind, item).lower()
+
+def item_concept(kind, item):
+    """The grammar concept a bank item is bucketed under, None for kinds without concept buckets"""
+    return question_type(kind, item) if kind in CONCEPT_KINDS else None
+
+def bank_depth(kind):
+    """Number of items waiting in the bank for the given kind"""
+    try:
+        with connection() as conn:
+            row = conn.execute("SELECT COUNT(*) FROM question_bank WHERE kind = ?", (kind,)).fetchone()
+            return row[0]
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return 0
+
+def add_to_bank(kind, items):
+    """Store generated items in the bank, skip near-duplicates of anything banked before, return how many were added"""
+    fresh = []
+    for item in items:
+        key = content_key(kind, item)
+        if not is_seen(GLOBAL_SCOPE, kind, key):
+            fresh.append(item)
+            mark_seen(GLOBAL_SCOPE, kind, [key])
+    inc("duplicates_rejected_total", len(items) - len(fresh), kind=kind, scope="bank")
+
+    added = _insert(kind, fresh)
+    with _lock:
+        stats = _stats[kind]
+        stats["refilled"] += added
+        now = time.time()
+        stats["refill_times"].extend([now] * added)
+    return added
+
+def return_to_bank(kind, items):
+    """
+    Put back items drawn for a test that was never shown, return how many were put back.
+    Items from the bank are already in its fingerprint index, so unlike add_to_bank there is no near-duplicate check.
+    """
+    mark_seen(GLOBAL_SCOPE, kind, [content_key(kind, item) for item in items])
+    returned = _insert(kind, items)
+    inc("bank_returned_total", returned, kind=kind)
+    return returned
+
+def _insert(kind, items):
+    added = 0
+    try:
+        with connection() as conn:
+            for item in items:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO question_bank (kind, content_key, data, created_at, concept) VALUES (?, ?, ?, ?, ?)",
+                    (kind, content_key(kind, item), _encoder.encode(item), time.time(), item_concept(kind, item))
+                )
+                added += cursor.rowcount
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+    return added
+
+def draw_questions(kind, count, skip=None):
+    """
+    Take up to `count` items out of the bank, oldest first.
+    Items for which skip(item) returns True are left in the bank for other users.
+    """
+    taken = []
+    after = 0
+    try:
+        with connection() as conn:
+            for _ in range(DRAW_ROUNDS):
+                limit = (count - len(taken)) * DRAW_SCAN_FACTOR
+                rows = conn.execute(
+                    "SELECT id, data FROM question_bank WHERE kind = ? AND id > ? ORDER BY id LIMIT ?", (kind, after, limit)
+                ).fetchall()
+                taken += [item for _, item in _take(conn, _unskipped(kind, rows, skip), count - len(taken))]
+                if len(taken) >= count or len(rows) < limit:
+                    break
+                after = rows[-1][0]
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        taken = []
+
+    record_draw(kind, len(taken), count)
+    return taken
+
+def claim_questions(kind, ids, skip=None):
+    """
+    Take the bank items with the given IDs, e.g. picked by the adaptive assembler.
+    Items for which skip(item) returns True are left in the bank for other users.
+    Return the taken items and the IDs that are no longer in the bank (taken, or already gone).
+    """
+    if not ids:
+        return [], []
+    gone = set(ids)
+    try:
+        with connection() as conn:
+            placeholders = ", ".join("?" * len(ids))
+            rows = conn.execute(
+                f"SELECT id, data FROM question_bank WHERE kind = ? AND id IN ({placeholders})", (kind, *ids)
+            ).fetchall()
+            candidates = _unskipped(kind, rows, skip)
+            gone.difference_update(row_id for row_id, _ in rows)
+            gone.update(row_id for row_id, _ in candidates) # Taken now, or by another worker since the read
+            taken = [item for _, item in _take(conn, candidates, len(ids))]
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return [], []
+    return taken, list(gone)
+
+def _unskipped(kind, rows, skip):
+    """
+    Decode bank rows into (id, item), leaving out the items skip(item) rejects.
+    Unreadable rows are kept with item None so they are deleted too.
+    """
+    candidates = []
+    for row_id, data in rows:
+        item = load_item(kind, data)
+        if not (item and skip and skip(item)):
+            candidates.append((row_id, item))
+    return candidates
+
+def _take(conn, candidates, count):
+    """
+    Delete candidates from the bank in order until `count` readable items are taken, return those (id, item).
+    The skip checks ran before, the write lock is only held for the deletes. A row another worker deleted
+    since it was read is not taken, so two workers never hand out the same item.
+    """
+    taken = []
+    conn.execute("BEGIN IMMEDIATE")
+    for row_id, item in candidates:
+        if len(taken) >= count:
+            break
+        deleted = conn.execute("DELETE FROM question_bank WHERE id = ?", (row_id,)).rowcount
+        if deleted and item:
+            taken.append((row_id, item))
+    conn.commit()
+    return taken
+
+def record_draw(kind, served, wanted):
+    """Count a draw from the bank and wake the worker early instead of waiting for the next interval"""
+    with _lock:
+        _stats[kind]["served"] += served
+        if served < wanted:
+            _stats[kind]["misses"] += 1
+    _wake.set()
+
+def concept_depths(kind):
+    """Number of items waiting in the bank per concept"""
+    try:
+        with connection() as conn:
+            rows = conn.execute("SELECT concept, COUNT(*) FROM question_bank WHERE kind = ? GROUP BY concept", (kind,)).fetchall()
+            return {concept: count for concept, count in rows}
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return {}
+
+def refill(kind, fetch):
+    """Call fetch() until the bank for `kind` reaches its high-water mark"""
+    depth = bank_depth(kind)
+    if depth >= BANK_LOW_WATER[kind]:
+        return
+    while depth < BANK_HIGH_WATER[kind]:
+        # Refills share the global quota with the users, once it is used up they wait for the next cycle
+        if not allow_call(GLOBAL_SCOPE, kind, per_user=False):
+            return
+        try:
+            added = add_to_bank(kind, fetch())
+        except Exception as e:
+            print(f"Refill error ({kind}): {e}")
+            with _lock:
+                _stats[kind]["refill_errors"] += 1
+                _stats[kind]["last_error"] = str(e)
+            return
+        if not added:
+            # The model only returned items already in the bank, try again on the next cycle
+            return
+        depth += added
+
+def refill_concepts(kind, fetch):
+    """
+    Ask fetch(concepts) for the concepts whose bucket dropped below CONCEPT_LOW_WATER, emptiest first.
+    Backs off for a while if the model didn't return any question of the requested concepts.
+    """
+    if time.time() < _concept_backoff_until.get(kind, 0):
+        return
+    depths = concept_depths(kind)
+    low = sorted((concept for concept in QUESTION_TYPES[kind] if depths.get(concept, 0) < CONCEPT_LOW_WATER), key=lambda concept: depths.get(concept, 0))[:CONCEPTS_PER_REFILL]
+    if not low or not allow_call(GLOBAL_SCOPE, kind, per_user=False):
+        return
+    try:
+        items = fetch(low)
+    except Exception as e:
+        print(f"Refill error ({kind}): {e}")
+        with _lock:
+            _stats[kind]["refill_errors"] += 1
+            _stats[kind]["last_error"] = str(e)
+        return
+    add_to_bank(kind, items)
+    if not any(item_concept(kind, item) in low for item in items):
+        _concept_backoff_until[kind] = time.time() + CONCEPT_BACKOFF_SECONDS
+
+def _refill_loop(fetchers):
+    while True:
+        for kind, fetch in fetchers.items():
+            refill(kind, fetch)
+            if kind in CONCEPT_KINDS:
+                refill_concepts(kind, fetch)
+        _wake.wait(REFILL_INTERVAL_SECONDS)
+        _wake.clear()
+
+def start_refill_worker(fetchers):
+    """
+    Start the background thread that keeps the bank topped up.
+    fetchers maps each kind to a function returning a freshly generated list of items,
+    for kinds in CONCEPT_KINDS it must also accept a list of concepts to focus on.
+    Threads don't survive a fork, so the worker is (re)started lazily in each gunicorn worker process.
+    """
+    global _worker, _worker_pid
+    if os.getenv("BANK_REFILL_ENABLED", "1") == "0":
+        return
+    with _lock:
+        if _worker is not None and _worker_pid == os.getpid() and _worker.is_alive():
+            return
+        _worker = threading.Thread(target=_refill_loop, args=(fetchers,), name="question-bank-refill", daemon=True)
+        _worker_pid = os.getpid()
+        _worker.start()
+
+def bank_stats():
+    """Pool depth and refill metrics per kind, used to size the bank against peak traffic"""
+    result = {}
+    now = time.time()
+    for kind in BANK_HIGH_WATER:
+        depth = bank_depth(kind)
+        with _lock:
+            stats = _stats[kind]
+            refill_times = stats["refill_times"]
+            while refill_times and refill_times[0] < now - REFILL_RATE_WINDOW_SECONDS:
+                refill_times.popleft()
+            result[kind] = {
+                "depth": depth,
+                "high_water": BANK_HIGH_WATER[kind],
+                "low_water": BANK_LOW_WATER[kind],
+                "served": stats["served"],
+                "refilled": stats["refilled"],
+                "misses": stats["misses"],
+                "refill_errors": stats["refill_errors"],
+                "last_error": stats["last_error"],
+                "refill_rate_per_minute": round(len(refill_times) * 60 / REFILL_RATE_WINDOW_SECONDS, 2)
+            }
+        if kind in CONCEPT_KINDS:
+            result[kind]["concepts"] = concept_depths(kind)
+    return result
@@ -0,0 +1,177 @@
+from dotenv import load_dotenv, find_dotenv
+import os, random, threading, time
+from db import connection
+from metrics import inc
+
+# Find and load environment variables
+_ = load_dotenv(find_dotenv())
+
+# Configuration Constants
+RATE_LIMITS_ENABLED = os.getenv("RATE_LIMITS_ENABLED", "1") == "1" # 0 lets every request call the API
+USER_RATE_PER_MINUTE = float(os.getenv("GENERATION_USER_RATE", 6)) # Gemini calls a user can make per minute on average, 0 for no limit
+USER_BURST = float(os.getenv("GENERATION_USER_BURST", 6)) # Gemini calls a user can make back to back
+GLOBAL_RATE_PER_MINUTE = float(os.getenv("GENERATION_GLOBAL_RATE", 120)) # Gemini calls per minute for all users and workers together, 0 for no limit
+GLOBAL_BURST = float(os.getenv("GENERATION_GLOBAL_BURST", 30)) # Gemini calls all users can make back to back
+EXAM_RATE_PER_HOUR = float(os.getenv("EXAM_USER_RATE", 2)) # Mock exams with generated sections a user can start per hour on average, 0 for no limit
+EXAM_BURST = float(os.getenv("EXAM_USER_BURST", 2)) # Mock exams a user can start back to back
+PRUNE_PROBABILITY = 0.01 # Share of calls that also delete buckets of users who have been idle long enough to be full again
+
+# Concurrent generations per (kind, history scope) in this process
+_flights = {}
+_flights_lock = threading.Lock()
+
+def init_rate_limits():
+    """Create the token bucket table if it doesn't exist, safe to call on every startup"""
+    with connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+def _take(conn, key, rate_per_minute, burst, now):
+    """
+    Take one token from the bucket in a single statement, so workers racing for the last token can't both get it.
+    A missing bucket starts full, a bucket without a whole token is left unchanged and nothing is returned.
+    """
+    if rate_per_minute <= 0:
+        return True
+    row = conn.execute("""
+        INSERT INTO rate_limits (key, tokens, updated_at) VALUES (:key, :burst - 1, :now)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = min(:burst, tokens + (:now - updated_at) * :rate) - 1,
+            updated_at = :now
+        WHERE min(:burst, tokens + (:now - updated_at) * :rate) >= 1
+        RETURNING tokens
+    """, {"key": key, "burst": burst, "now": now, "rate": rate_per_minute / 60}).fetchone()
+    return row is not None
+
+def _prune(conn, prefix, rate_per_minute, burst, now):
+    """Delete the buckets of scopes that have been idle long enough to be full again"""
+    if random.random() < PRUNE_PROBABILITY and rate_per_minute > 0:
+        conn.execute("DELETE FROM rate_limits WHERE key LIKE ? AND updated_at < ?", (f"{prefix}:%", now - burst / rate_per_minute * 60))
+
+def allow_call(scope, kind, per_user=True):
+    """
+    Whether the history scope (user or guest) may make one more Gemini call right now, taking a token from
+    both its own bucket and the global one. When either is empty nothing is taken and the caller serves
+    what the question bank and response cache have instead.
+    per_user=False only takes from the global bucket, for calls already paid for as a whole, like a mock exam.
+    """
+    if not RATE_LIMITS_ENABLED:
+        return True
+    now = time.time()
+    with connection() as conn:
+        if per_user and not _take(conn, f"user:{scope}", USER_RATE_PER_MINUTE, USER_BURST, now):
+            limit = "user"
+        elif not _take(conn, "global", GLOBAL_RATE_PER_MINUTE, GLOBAL_BURST, now):
+            conn.rollback() # Give the user's token back
+            limit = "global"
+        else:
+            limit = None
+        _prune(conn, "user", USER_RATE_PER_MINUTE, USER_BURST, now)
+    if limit:
+        inc("rate_limited_total", kind=kind, limit=limit)
+    return limit is None
+
+def allow_exam(scope):
+    """
+    Whether the history scope may start a mock exam that needs generated sections. An exam makes more calls
+    than a user's per-minute burst allows, so it takes one token from a slower bucket of its own instead
+    and each of its calls then only counts against the global limit.
+    """
+    if not RATE_LIMITS_ENABLED:
+        return True
+    now = time.time()
+    with connection() as conn:
+        allowed = _take(conn, f"exam:{scope}", EXAM_RATE_PER_HOUR / 60, EXAM_BURST, now)
+        _prune(conn, "exam", EXAM_RATE_PER_HOUR / 60, EXAM_BURST, now)
+    if not allowed:
+        inc("rate_limited_total", kind="exam", limit="user")
+    return allowed
+
+class _Flight:
+    __slots__ = ("items", "result", "error", "done", "condition")
+
+    def __init__(self):
+        self.items = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.condition = threading.Condition()
+
+def _join(key):
+    """Return (flight, True) for the first caller with this key, (flight, False) for callers that join it"""
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            inc("single_flight_shared_total", kind=key[0])
+            return flight, False
+        flight = _flights[key] = _Flight()
+        return flight, True
+
+def _finish(key, flight):
+    with _flights_lock:
+        del _flights[key]
+    with flight.condition:
+        flight.done = True
+        flight.condition.notify_all()
+
+def single_flight(key, function):
+    """
+    Run function() once for concurrent callers with the same key, e.g. two tabs of one user opening a test:
+    the first caller runs it and the others wait for its result or exception. Only within this process:
+    with several gunicorn workers, tabs whose requests land on different workers each generate their own test.
+    """
+    flight, leader = _join(key)
+    if leader:
+        try:
+            flight.result = function()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            _finish(key, flight)
+
+    with flight.condition:
+        flight.condition.wait_for(lambda: flight.done)
+    if flight.error is not None:
+        raise flight.error
+    return flight.result
+
+def single_flight_stream(key, generate):
+    """
+    Same as single_flight for generators: callers that join get every item the first caller's generator
+    has yielded so far and then each new one as it is yielded. If the first caller disconnects
+    the others end with the items generated until then. Only within this process, like single_flight.
+    """
+    flight, leader = _join(key)
+    if leader:
+        try:
+            for item in generate():
+                with flight.condition:
+                    flight.items.append(item)
+                    flight.condition.notify_all()
+                yield item
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            _finish(key, flight)
+        return
+
+    sent = 0
+    while True:
+        with flight.condition:
+            flight.condition.wait_for(lambda: flight.done or len(flight.items) > sent)
+            items = flight.items[sent:]
+            done = flight.done
+        yield from items
+        sent += len(items)
+        if done and sent == len(flight.items):
+            break
+    if flight.error is not None:
+        raise flight.error
@@ -0,0 +1,126 @@
+from dotenv import load_dotenv, find_dotenv
+import os, json, threading, time, hashlib, msgspec
+from collections import OrderedDict
+
+# Find and load environment variables
+_ = load_dotenv(find_dotenv())
+
+# Configuration Constants
+CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL", 30 * 60)) # Generated items are reused for this long
+CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 8 * 1024 * 1024)) # Memory cap for all cached items
+CACHE_MAX_ENTRIES = 64 # Max distinct prompts/configs cached
+MAX_ITEMS_PER_ENTRY = 500 # Oldest items of an entry are dropped beyond this
+MAX_SERVES_PER_ITEM = int(os.getenv("RESPONSE_CACHE_MAX_SERVES", 20)) # An item is retired after being served this many times
+
+_encoder = msgspec.msgpack.Encoder()
+
+class CachedItem:
+    __slots__ = ("data", "size", "serves", "expires_at")
+
+    def __init__(self, data, expires_at):
+        self.data = data
+        self.size = len(_encoder.encode(data)) # Roughly the memory the item's strings take
+        self.serves = 0
+        self.expires_at = expires_at
+
+class ResponseCache:
+    """
+    Parsed question sets from earlier generations, keyed on everything that determines the model output.
+    Each user gets items they haven't seen yet, least-served first, so one generation serves many users.
+    Entries are evicted least recently used first once the memory cap is reached, items expire after a TTL.
+    """
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> list of CachedItem
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "partial_hits": 0, "misses": 0, "items_stored": 0, "items_served": 0, "evictions": 0, "expirations": 0}
+
+    @staticmethod
+    def make_key(model, prompt, system_instruction, config):
+        raw = json.dumps([model, prompt, system_instruction, config], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _drop(self, items, index):
+        item = items.pop(index)
+        self.size -= item.size
+
+    def put(self, key, items):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.setdefault(key, [])
+            self.entries.move_to_end(key)
+            for data in items:
+                item = CachedItem(data, now + self.ttl)
+                entry.append(item)
+                self.size += item.size
+                self.stats["items_stored"] += 1
+            while len(entry) > MAX_ITEMS_PER_ENTRY:
+                self._drop(entry, 0)
+
+            # Evict whole entries, least recently used first, to stay under the caps
+            while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+                old_key, old_entry = next(iter(self.entries.items()))
+                if old_key == key and len(self.entries) == 1:
+                    # Only the current entry is left, trim its oldest items instead
+                    while self.size > self.max_bytes and old_entry:
+                        self._drop(old_entry, 0)
+                        self.stats["evictions"] += 1
+                    break
+                self.entries.pop(old_key)
+                self.size -= sum(item.size for item in old_entry)
+                self.stats["evictions"] += len(old_entry)
+
+    def take(self, key, count, skip=None):
+        """Return up to `count` cached items for which skip(item) is False, least-served first"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                self.stats["misses"] += 1
+                return []
+            self.entries.move_to_end(key)
+
+            # Drop expired and worn out items first
+            for index in range(len(entry) - 1, -1, -1):
+                item = entry[index]
+                if item.expires_at <= now or item.serves >= MAX_SERVES_PER_ITEM:
+                    self._drop(entry, index)
+                    self.stats["expirations"] += 1
+
+            candidates = sorted(entry, key=lambda item: item.serves)
+        # Run the skip check outside the lock, it may hit the dedup index
+        taken = []
+        for item in candidates:
+            if len(taken) >= count:
+                break
+            if skip and skip(item.data):
+                continue
+            taken.append(item)
+
+        with self.lock:
+            for item in taken:
+                item.serves += 1
+            self.stats["items_served"] += len(taken)
+            if len(taken) >= count:
+                self.stats["hits"] += 1
+            elif taken:
+                self.stats["partial_hits"] += 1
+            else:
+                self.stats["misses"] += 1
+        return [item.data for item in taken]
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                **self.stats,
+                "entries": len(self.entries),
+                "items": sum(len(entry) for entry in self.entries.values()),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes
+            }
+
+# One cache per process
+response_cache = ResponseCache()
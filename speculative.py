@@ -0,0 +1,107 @@
+from dotenv import load_dotenv, find_dotenv
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import os, threading
+from metrics import inc, log
+
+# Find and load environment variables
+_ = load_dotenv(find_dotenv())
+
+# Configuration Constants
+SPECULATION_ENABLED = os.getenv("SPECULATIVE_TESTS", "1") == "1" # 0 generates the next test only when the user asks for it
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", 2)) # Next tests generated at the same time per process
+MAX_PENDING = int(os.getenv("SPECULATIVE_QUEUE", 16)) # Next tests waiting or running per process, more submissions are skipped
+WAIT_SECONDS = float(os.getenv("SPECULATIVE_WAIT", 15)) # How long a retake waits for a next test still being generated in this process
+
+# Threads are only created on first use so it is safe to fork before that
+_pool = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative")
+_jobs = {} # test ID -> Job, while waiting or running
+_lock = threading.Lock()
+_stats = {"started": 0, "skipped": 0, "ready": 0, "failed": 0, "cancelled": 0, "hits": 0, "late_hits": 0, "misses": 0}
+
+class Job:
+    __slots__ = ("kind", "scope", "future", "cancelled")
+
+    def __init__(self, kind, scope):
+        self.kind = kind
+        self.scope = scope
+        self.future = None
+        self.cancelled = threading.Event()
+
+def _count(name, kind):
+    with _lock:
+        _stats[name] += 1
+    inc("speculative_tests_total", kind=kind, outcome=name)
+
+def speculate(kind, scope, test_id, build):
+    """
+    Generate the next test of a history scope in the background under test_id.
+    build(cancelled) does the work and gets a function telling whether the job was cancelled meanwhile.
+    Returns False without starting anything when speculation is off, the queue is full
+    or a next test of this kind is already being generated for the scope.
+    """
+    if not SPECULATION_ENABLED:
+        return False
+    job = Job(kind, scope)
+    with _lock:
+        busy = len(_jobs) >= MAX_PENDING or any(j.kind == kind and j.scope == scope for j in _jobs.values())
+        if not busy:
+            _jobs[test_id] = job
+    if busy:
+        _count("skipped", kind)
+        return False
+
+    def run():
+        try:
+            if job.cancelled.is_set():
+                _count("cancelled", kind)
+                return
+            build(job.cancelled.is_set)
+            _count("cancelled" if job.cancelled.is_set() else "ready", kind)
+        except Exception as e:
+            log("speculative_test_error", kind=kind, error=e)
+            _count("failed", kind)
+        finally:
+            with _lock:
+                _jobs.pop(test_id, None)
+
+    job.future = _pool.submit(run)
+    _count("started", kind)
+    return True
+
+def wait_for(test_id, timeout=WAIT_SECONDS):
+    """
+    Wait for the job generating test_id if it still runs in this process.
+    Returns True if it was still running, the test may then be ready now or have failed.
+    """
+    with _lock:
+        job = _jobs.get(test_id)
+    if job is None or job.future is None:
+        return False
+    try:
+        job.future.result(timeout=timeout)
+    except FutureTimeoutError:
+        pass
+    return True
+
+def record_use(kind, ready, waited):
+    """Count whether a retake found its next test ready (a hit), ready after waiting for it, or not at all"""
+    _count("misses" if not ready else "late_hits" if waited else "hits", kind)
+
+def cancel(scope, kind=None):
+    """Stop the next tests of a history scope, e.g. on logout. Jobs not started yet are dropped, running ones don't save"""
+    with _lock:
+        jobs = [(test_id, job) for test_id, job in _jobs.items() if job.scope == scope and kind in (None, job.kind)]
+    for test_id, job in jobs:
+        job.cancelled.set()
+        if job.future is not None and job.future.cancel():
+            with _lock:
+                _jobs.pop(test_id, None)
+            _count("cancelled", job.kind)
+
+def speculation_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["pending"] = len(_jobs)
+    used = stats["hits"] + stats["late_hits"] + stats["misses"]
+    stats["hit_rate"] = round((stats["hits"] + stats["late_hits"]) / used, 3) if used else None
+    return stats
@@ -58,6 +58,21 @@ document.addEventListener('DOMContentLoaded', function() {
         loadingText: 'Generating...'
     });
 
+    setupButtonLoading('exam-form', 'exam-button', {
+        iconSelector: '[aria-label="books"]',
+        loadingText: 'Generating...'
+    });
+
+    setupButtonLoading('dashboard-exam-form', 'dashboard-exam-button', {
+        iconSelector: '[aria-label="books"]',
+        loadingText: 'Generating...'
+    });
+
+    setupButtonLoading('new-exam-form', 'new-exam-button', {
+        iconSelector: '[aria-label="refresh"]',
+        loadingText: 'Generating...'
+    });
+
 
     // --- Subtle animation for flash messages ---
     const flashMessages = document.querySelectorAll('[role="alert"].animate-fade-in'); // Target only alerts meant to fade in
@@ -123,65 +138,307 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // --- Create an element with classes and text, used to build server-style markup ---
+    function createElement(tag, className, text) {
+        const el = document.createElement(tag);
+        if (className) el.className = className;
+        if (text !== undefined) el.textContent = text;
+        return el;
+    }
+
+    // --- Build the same markup as the server-rendered questions in grammar_test.html / reading_test.html / exam.html ---
+    function createChoices(name, idPrefix, choices, required = true) {
+        const wrapper = document.createDocumentFragment();
+        choices.forEach((choice, index) => {
+            const row = createElement('div', 'flex items-center');
+            const input = createElement('input', 'mr-3 h-5 w-5 text-blue-600 focus:ring-blue-500 border-gray-300 cursor-pointer');
+            input.type = 'radio';
+            input.name = name;
+            input.value = index;
+            input.id = `${idPrefix}-${index + 1}`;
+            input.required = required;
+            const label = createElement('label', 'text-lg text-gray-700 cursor-pointer hover:text-blue-700', choice);
+            label.htmlFor = input.id;
+            row.append(input, label);
+            wrapper.appendChild(row);
+        });
+        return wrapper;
+    }
+
+    function createQuestionHeading(tag, className, number, text) {
+        const heading = createElement(tag, className);
+        heading.append(createElement('span', 'text-blue-600 font-bold', `Question ${number}:`), ` ${text}`);
+        return heading;
+    }
+
+    // --- Replace a stream's progress message with an error and a link to start over ---
+    function showStreamError(status, message) {
+        const reload = createElement('a', 'underline ml-1 cursor-pointer', 'Reload to try again.');
+        reload.href = window.location.pathname;
+        status.replaceChildren(`${message} `, reload);
+        status.className = 'text-center text-red-600 font-medium';
+    }
+
+    // --- Stream test questions into the page as they are generated ---
+    const streamForm = document.getElementById('stream-test-form');
+    if (streamForm) {
+        const container = document.getElementById('stream-questions');
+        const status = document.getElementById('stream-status');
+        const submitButton = document.getElementById('stream-submit-button');
+        const kind = streamForm.dataset.testKind;
+
+        function renderGrammar(item, index) {
+            const card = createElement('div', 'border border-gray-200 p-6 rounded-lg shadow-sm hover:shadow-md transition-shadow duration-300');
+            card.appendChild(createQuestionHeading('h3', 'text-xl font-semibold text-gray-800 mb-4', index + 1, item.question));
+            const choices = createElement('div', 'space-y-3 pl-4');
+            choices.appendChild(createChoices(`answers[${index}]`, `q${index + 1}`, item.choices));
+            card.appendChild(choices);
+            return card;
+        }
+
+        function renderReading(item, index) {
+            const card = createElement('div', 'border border-gray-200 p-6 rounded-lg shadow-sm hover:shadow-md transition-shadow duration-300');
+            card.appendChild(createElement('h2', 'text-xl font-bold text-blue-800 mb-4', `Passage ${index + 1}`));
+            card.appendChild(createElement('div', 'text-gray-700 mb-6 whitespace-pre-line leading-relaxed', item.passage));
+            const questions = createElement('div', 'space-y-3 pl-4');
+            item.questions.forEach((q, j) => {
+                questions.appendChild(createQuestionHeading('h3', 'text-lg font-semibold text-gray-800 mb-2', j + 1, q.question));
+                questions.appendChild(createChoices(`answers[${index}][${j}]`, `q${index + 1}-${j + 1}`, q.choices));
+            });
+            card.appendChild(questions);
+            return card;
+        }
+
+        const source = new EventSource(streamForm.dataset.streamUrl);
+        const rendered = new Set(); // Indexes already on the page, a question is never added twice under the same answers[i] name
+
+        source.addEventListener('question', function(event) {
+            const data = JSON.parse(event.data);
+            if (rendered.has(data.index)) return;
+            rendered.add(data.index);
+            const render = kind === 'reading' ? renderReading : renderGrammar;
+            container.appendChild(render(data.item, data.index));
+        });
+
+        // Without this the browser reconnects on its own and the server starts generating a different test
+        source.onerror = function() {
+            source.close();
+            showStreamError(status, 'The connection was lost while generating questions.');
+        };
+
+        source.addEventListener('done', function() {
+            source.close();
+            status.remove();
+            submitButton.disabled = false;
+        });
+
+        source.addEventListener('failed', function(event) {
+            source.close();
+            const data = JSON.parse(event.data);
+            status.textContent = `Error generating questions: ${data.error}`;
+            status.className = 'text-center text-red-600 font-medium';
+        });
+    }
+
+    // --- Fill in the chunks of a mock exam as they are generated, in whatever order they finish ---
+    const examForm = document.getElementById('stream-exam-form');
+    if (examForm) {
+        const status = document.getElementById('stream-status');
+        const submitButton = document.getElementById('stream-submit-button');
+        const cardClass = 'border border-gray-200 p-6 rounded-lg shadow-sm hover:shadow-md transition-shadow duration-300';
+
+        // Questions are numbered across the whole exam, answers[n] is the n-th question of the answer key
+        function renderChunk(data) {
+            const container = document.getElementById(`exam-chunk-${data.number}`);
+            const chunk = data.chunk;
+            let number = data.offset;
+            container.replaceChildren();
+            if (!chunk.questions.length && !chunk.passages.length) {
+                container.appendChild(createElement('p', 'text-center text-red-600 font-medium',
+                    `Questions ${number + 1}-${number + chunk.size} couldn't be generated and don't count toward your score.`));
+                return;
+            }
+            chunk.questions.forEach(q => {
+                const card = createElement('div', cardClass);
+                const body = createElement('div', 'space-y-3');
+                body.appendChild(createQuestionHeading('h3', 'text-xl font-semibold text-gray-800 mb-4', number + 1, q.question));
+                body.appendChild(createChoices(`answers[${number}]`, `e${number + 1}`, q.choices, false));
+                card.appendChild(body);
+                container.appendChild(card);
+                number += 1;
+            });
+            chunk.passages.forEach(passage => {
+                const card = createElement('div', cardClass);
+                card.appendChild(createElement('h3', 'text-lg font-bold text-blue-800 mb-4',
+                    `Questions ${number + 1}-${number + passage.questions.length} refer to the following text.`));
+                card.appendChild(createElement('div', 'text-gray-700 mb-6 whitespace-pre-line leading-relaxed', passage.passage));
+                const questions = createElement('div', 'space-y-3 pl-4');
+                passage.questions.forEach(q => {
+                    questions.appendChild(createQuestionHeading('h3', 'text-lg font-semibold text-gray-800 mb-2', number + 1, q.question));
+                    questions.appendChild(createChoices(`answers[${number}]`, `e${number + 1}`, q.choices, false));
+                    number += 1;
+                });
+                card.appendChild(questions);
+                container.appendChild(card);
+            });
+        }
+
+        const source = new EventSource(examForm.dataset.streamUrl);
+        const rendered = new Set(); // Chunk numbers already on the page
+
+        source.addEventListener('chunk', function(event) {
+            const data = JSON.parse(event.data);
+            if (rendered.has(data.number)) return;
+            rendered.add(data.number);
+            renderChunk(data);
+        });
+
+        // Without this the browser reconnects on its own and the server starts generating a different exam
+        source.onerror = function() {
+            source.close();
+            examForm.querySelectorAll('.exam-chunk-status').forEach(el => el.remove());
+            showStreamError(status, 'The connection was lost while generating the exam.');
+        };
+
+        source.addEventListener('done', function() {
+            source.close();
+            status.remove();
+            submitButton.disabled = false;
+        });
+
+        source.addEventListener('failed', function(event) {
+            source.close();
+            const data = JSON.parse(event.data);
+            examForm.querySelectorAll('.exam-chunk-status').forEach(el => el.remove());
+            status.textContent = `Error generating the exam: ${data.error}`;
+            status.className = 'text-center text-red-600 font-medium';
+        });
+    }
+
     // --- Add to favorites function ---
-    const favoriteButtons = document.querySelectorAll('.favorite-btn');
-    
-    favoriteButtons.forEach(btn => {
-        btn.addEventListener('click', async function(e) {
-            e.preventDefault(); // Prevent any default action
-            
-            // Log that the button was clicked (for debugging)
-            console.log('Favorite button clicked');
-            
+    // Delegated from the document so favorite cards loaded later by infinite scroll work too
+    document.addEventListener('click', async function(e) {
+        const btn = e.target.closest('.favorite-btn');
+        if (!btn) return;
+        e.preventDefault(); // Prevent any default action
+
+        // Log that the button was clicked (for debugging)
+        console.log('Favorite button clicked');
+
+        try {
+            // Toggle by the shared question id, a question no one has favorited yet is found by its place in the stored test
+            const data = btn.dataset.questionId ? { question_id: Number(btn.dataset.questionId) } : {
+                test_id: btn.closest('[data-test-id]').dataset.testId,
+                index: Number(btn.dataset.index)
+            };
+
+            console.log('Sending data:', data);
+
+            const response = await fetch('/favorite', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify(data)
+            });
+
+            const result = await response.json();
+            console.log('Response received:', result);
+
+            if (response.ok) {
+                // Later clicks on this card toggle by id
+                btn.dataset.questionId = result.question_id;
+
+                // Toggle the heart icon's color and fill
+                btn.classList.toggle('text-red-500');
+                const svg = btn.querySelector('svg');
+                const currentFill = svg.getAttribute('fill');
+                svg.setAttribute('fill', currentFill === 'none' ? 'currentColor' : 'none');
+
+                // Show feedback to user with a temporary message
+                const feedbackMsg = document.createElement('div');
+                feedbackMsg.className = 'absolute top-0 left-0 bg-blue-500 text-white px-2 py-1 rounded-md text-xs';
+                feedbackMsg.style.transform = 'translateY(-100%)';
+                feedbackMsg.textContent = result.message;
+                btn.style.position = 'relative';
+                btn.appendChild(feedbackMsg);
+
+                // Remove feedback message after 2 seconds
+                setTimeout(() => {
+                    feedbackMsg.remove();
+                }, 2000);
+            } else {
+                throw new Error(result.error || 'Failed to update favorites');
+            }
+        } catch (error) {
+            console.error('Error:', error);
+            alert('Failed to update favorites. Please try again.');
+        }
+    });
+
+    // --- Load more favorites as the user scrolls ---
+    const favoritesMore = document.getElementById('favorites-more');
+    if (favoritesMore) {
+        const list = document.getElementById('favorites-list');
+        // Every card has the same layout, so new cards are copies of the first server-rendered one
+        const cardTemplate = list.firstElementChild.cloneNode(true);
+        let count = list.children.length;
+        let loading = false;
+
+        function renderFavorite(favorite) {
+            const card = cardTemplate.cloneNode(true);
+            count += 1;
+            card.querySelector('h3').replaceChildren(createElement('span', 'text-blue-600 font-bold', `Question ${count}:`), ` ${favorite.question}`);
+
+            const button = card.querySelector('.favorite-btn');
+            button.dataset.questionId = favorite.id;
+            button.classList.add('text-red-500');
+            button.querySelector('svg').setAttribute('fill', 'currentColor');
+
+            const choices = card.querySelector('.space-y-3');
+            choices.replaceChildren(...favorite.choices.map(choice => {
+                const correct = choice === favorite.correct_answer;
+                const row = createElement('div', `flex items-center p-2 rounded ${correct ? 'bg-green-50 border-l-4 border-green-400' : 'bg-gray-50'}`);
+                row.appendChild(createElement('span', 'text-lg text-gray-700 flex-grow', choice));
+                if (correct) row.appendChild(createElement('span', 'ml-4 text-green-600 font-semibold', '✓ Correct Answer'));
+                return row;
+            }));
+
+            card.querySelector('.bg-blue-50 .text-gray-700').textContent = favorite.explanation;
+            return card;
+        }
+
+        async function loadMore() {
+            if (loading) return;
+            loading = true;
             try {
-                // Parse the data attributes directly without JSON.parse
-                // This helps avoid issues if the data is already parsed or has special characters
-                const data = {
-                    question: this.getAttribute('data-question'),
-                    choices: this.getAttribute('data-choices'),
-                    correct_answer: this.getAttribute('data-correct'),
-                    explanation: this.getAttribute('data-explanation')
-                };
-                
-                console.log('Sending data:', data);
-                
-                const response = await fetch('/favorite', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify(data)
-                });
-                
+                const response = await fetch(favoritesMore.dataset.nextUrl);
                 const result = await response.json();
-                console.log('Response received:', result);
-                
-                if (response.ok) {
-                    // Toggle the heart icon's color and fill
-                    this.classList.toggle('text-red-500');
-                    const svg = this.querySelector('svg');
-                    const currentFill = svg.getAttribute('fill');
-                    svg.setAttribute('fill', currentFill === 'none' ? 'currentColor' : 'none');
-                    
-                    // Show feedback to user with a temporary message
-                    const feedbackMsg = document.createElement('div');
-                    feedbackMsg.className = 'absolute top-0 left-0 bg-blue-500 text-white px-2 py-1 rounded-md text-xs';
-                    feedbackMsg.style.transform = 'translateY(-100%)';
-                    feedbackMsg.textContent = result.message;
-                    this.style.position = 'relative';
-                    this.appendChild(feedbackMsg);
-                    
-                    // Remove feedback message after 2 seconds
-                    setTimeout(() => {
-                        feedbackMsg.remove();
-                    }, 2000);
-                } else {
-                    throw new Error(result.error || 'Failed to update favorites');
+                if (!response.ok) {
+                    throw new Error(result.error || 'Failed to load favorites');
                 }
+                result.favorites.forEach(favorite => list.appendChild(renderFavorite(favorite)));
+                if (!result.next) {
+                    observer.disconnect();
+                    favoritesMore.remove();
+                    return;
+                }
+                favoritesMore.dataset.nextUrl = result.next;
             } catch (error) {
                 console.error('Error:', error);
-                alert('Failed to update favorites. Please try again.');
+                favoritesMore.textContent = 'Failed to load more favorites. Scroll to try again.';
+            } finally {
+                loading = false;
             }
-        });
-    });
+            // The observer only fires on changes, keep loading while the end of the list is still on screen
+            if (favoritesMore.isConnected && favoritesMore.getBoundingClientRect().top < window.innerHeight) {
+                loadMore();
+            }
+        }
+
+        const observer = new IntersectionObserver(entries => {
+            if (entries[0].isIntersecting) loadMore();
+        }, { rootMargin: '400px' });
+        observer.observe(favoritesMore);
+    }
 });
\ No newline at end of file
@@ -0,0 +1,132 @@
+from dotenv import load_dotenv, find_dotenv
+import os, sqlite3, threading, time, uuid, hashlib, msgspec
+from collections import OrderedDict
+from db import connection
+from models import practice_set, ITEM_TYPES, SET_TYPES
+
+# Find and load environment variables
+_ = load_dotenv(find_dotenv())
+
+# Configuration Constants
+TEST_TTL_SECONDS = int(os.getenv("TEST_TTL", 24 * 60 * 60)) # Tests are deleted this long after they were created
+PURGE_INTERVAL_SECONDS = 600 # How often each process deletes expired tests
+MAX_CACHED_TESTS = 512 # Tests kept in memory per process
+
+# Stored tests never change once written, so a per-process cache never goes stale
+_cache = OrderedDict() # test_id -> (checksum, practice set, expires_at)
+_lock = threading.Lock()
+_last_purge = 0
+_encoder = msgspec.msgpack.Encoder()
+_decoders = {kind: msgspec.msgpack.Decoder(set_type) for kind, set_type in SET_TYPES.items()}
+
+def init_test_store():
+    """Create the test table if it doesn't exist, safe to call on every startup"""
+    with connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stored_tests (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                data BLOB NOT NULL,
+                checksum TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_stored_tests_expires ON stored_tests (expires_at)")
+
+def new_test_id():
+    return uuid.uuid4().hex
+
+def _remember(test_id, checksum, data, expires_at):
+    with _lock:
+        _cache[test_id] = (checksum, data, expires_at)
+        _cache.move_to_end(test_id)
+        while len(_cache) > MAX_CACHED_TESTS:
+            _cache.popitem(last=False)
+
+def _decode(kind, data):
+    """Tests are stored as msgpack, rows written before that hold the bare item list as JSON text"""
+    if isinstance(data, str):
+        return practice_set(kind, msgspec.json.decode(data, type=list[ITEM_TYPES[kind]]))
+    return _decoders[kind].decode(data)
+
+def save_test(kind, items, test_id=None):
+    """
+    Store the items of a test with their answer key under its ID (a new one if not given) and return the ID,
+    nothing is written if the items didn't change
+    """
+    test_id = test_id or new_test_id()
+    data = practice_set(kind, items)
+    payload = _encoder.encode(data)
+    checksum = hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    with _lock:
+        cached = _cache.get(test_id)
+    if cached and cached[0] == checksum:
+        return test_id
+
+    expires_at = time.time() + TEST_TTL_SECONDS
+    try:
+        with connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO stored_tests (id, kind, data, checksum, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (test_id, kind, payload, checksum, expires_at)
+            )
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        raise
+    _remember(test_id, checksum, data, expires_at)
+    purge_expired()
+    return test_id
+
+def load_test(test_id):
+    """Return the stored test as a PracticeSet, or None if it doesn't exist or has expired"""
+    if not test_id:
+        return None
+    with _lock:
+        cached = _cache.get(test_id)
+    if cached:
+        return cached[1] if cached[2] > time.time() else None
+
+    try:
+        with connection() as conn:
+            row = conn.execute(
+                "SELECT kind, data, checksum, expires_at FROM stored_tests WHERE id = ? AND expires_at > ?", (test_id, time.time())
+            ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return None
+    if not row:
+        return None
+    kind, payload, checksum, expires_at = row
+    try:
+        data = _decode(kind, payload)
+    except (msgspec.DecodeError, ValueError) as e:
+        print(f"Unreadable stored test {test_id}: {e}")
+        return None
+    _remember(test_id, checksum, data, expires_at)
+    return data
+
+def delete_test(test_id):
+    if not test_id:
+        return
+    with _lock:
+        _cache.pop(test_id, None)
+    try:
+        with connection() as conn:
+            conn.execute("DELETE FROM stored_tests WHERE id = ?", (test_id,))
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+
+def purge_expired():
+    """Delete expired tests, at most once per PURGE_INTERVAL_SECONDS per process"""
+    global _last_purge
+    now = time.time()
+    with _lock:
+        if now - _last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        _last_purge = now
+    try:
+        with connection() as conn:
+            conn.execute("DELETE FROM stored_tests WHERE expires_at <= ?", (now,))
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")